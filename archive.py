@@ -0,0 +1,188 @@
+import json
+import os
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+
+import storage
+
+# Сколько последних месяцев (включая текущий) остаётся в горячей таблице.
+HOT_MONTHS = int(os.getenv("FINBOT_HOT_MONTHS", "12"))
+
+ARCHIVE_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS operations (
+        user_id INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        id INTEGER NOT NULL,
+        kind INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        currency TEXT,
+        category TEXT,
+        import_hash TEXT,
+        note TEXT,
+        PRIMARY KEY (user_id, day, id)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_archive_import
+    ON operations (user_id, import_hash) WHERE import_hash IS NOT NULL
+    """,
+)
+
+
+# Первый день первого горячего месяца: всё раньше него уходит в архив.
+def archive_cutoff(keep_months=HOT_MONTHS, today=None):
+    month = storage.month_start(today or datetime.now().date())
+    for _ in range(max(keep_months, 1) - 1):
+        month = storage.month_start(month - timedelta(days=1))
+    return month.isoformat()
+
+
+def _create_archive(s, year):
+    path = s.archive_path(year)
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        # WAL — чтобы бот читал архив, пока его пополняют
+        conn.execute("PRAGMA journal_mode=WAL")
+        for sql in ARCHIVE_SCHEMA:
+            conn.execute(sql)
+    finally:
+        conn.close()
+    s.add_archive(year, path)
+
+
+# ---------- Архивация ----------
+# Месяц переносится двумя транзакциями: копия в архив, потом удаление из
+# горячей таблицы и сдвиг archived_until. Между файлами SQLite не даёт
+# общей атомарности, поэтому порядок такой, чтобы сбой не терял данные:
+# после сбоя строки остаются в обоих местах, а повторный запуск (копия —
+# INSERT OR IGNORE) просто доделывает перенос. balances и сводные таблицы
+# не трогаются: итоги по архивным операциям в них уже учтены.
+#
+# Индекса, который начинался бы с даты, у горячей таблицы нет, поэтому
+# она просматривается один раз за запуск: id переносимых строк по месяцам
+# складываются во временную таблицу соединения архива, а дальше строки
+# берутся по первичному ключу.
+def archive_shard(s, cutoff):
+    with s.archive_write() as conn:
+        conn.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS archive_move (
+                month TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                PRIMARY KEY (month, id)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("DELETE FROM temp.archive_move")
+        conn.execute("""
+            INSERT INTO temp.archive_move (month, id)
+            SELECT substr(date, 1, 7), id FROM operations WHERE date < ?
+        """, (cutoff,))
+        months = [row[0] for row in conn.execute("SELECT DISTINCT month FROM temp.archive_move ORDER BY month")]
+    moved = 0
+    for month in months:
+        year = int(month[:4])
+        bounds = (f"{month}-01", min(storage.next_month(date.fromisoformat(f"{month}-01")).isoformat(), cutoff))
+        if year not in s.archives:
+            _create_archive(s, year)
+        alias = f"archive_{year}"
+        with s.archive_write() as conn:
+            # архивы, созданные до появления заметок
+            if storage._archive_note(conn, alias) == "NULL":
+                conn.execute(f"ALTER TABLE {alias}.operations ADD COLUMN note TEXT")
+            # дата могла поменяться после просмотра — сверяем её ещё раз
+            ids = conn.execute("""
+                SELECT o.id FROM temp.archive_move m JOIN operations o ON o.id = m.id
+                WHERE m.month = ? AND o.date >= ? AND o.date < ?
+            """, (month, *bounds)).fetchall()
+            conn.execute(f"""
+                INSERT OR IGNORE INTO {alias}.operations
+                    (user_id, day, id, kind, amount, currency, category, import_hash, note)
+                SELECT o.user_id, {storage.ORDINAL_SQL.format("o.date")}, o.id, o.type = 'income',
+                       o.amount, o.currency, o.category, o.import_hash, o.note
+                FROM temp.archive_move m JOIN operations o ON o.id = m.id
+                WHERE m.month = ? AND o.date >= ? AND o.date < ?
+            """, (month, *bounds))
+        with s.write() as conn:
+            moved += conn.execute(
+                "DELETE FROM operations WHERE id IN (SELECT value FROM json_each(?)) AND date >= ? AND date < ?",
+                (json.dumps([op_id for op_id, in ids]), *bounds),
+            ).rowcount
+            conn.execute("""
+                INSERT INTO archive_state (key, value) VALUES ('archived_until', ?)
+                ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)
+            """, (cutoff if month == months[-1] else bounds[1],))
+    return moved
+
+
+def archive(cutoff, vacuum=False):
+    moved = 0
+    for s in storage.shards:
+        moved += archive_shard(s, cutoff)
+        if vacuum:
+            # освобождённые страницы горячей базы возвращаются ОС, архивы
+            # упаковываются плотно
+            s.vacuum()
+            for year in sorted(s.archives):
+                s.vacuum(f"archive_{year}")
+    return moved
+
+
+# ---------- Отчёт ----------
+def _file_size(path):
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+# Размер горячих и архивных данных по всем шардам.
+def size_report():
+    hot_rows = hot_bytes = archive_rows = archive_bytes = 0
+    for s in storage.shards:
+        with s.read() as conn:
+            hot_rows += conn.execute("SELECT COUNT(*) FROM operations").fetchone()[0]
+            for alias in storage._archive_aliases(conn):
+                archive_rows += conn.execute(f"SELECT COUNT(*) FROM {alias}.operations").fetchone()[0]
+        hot_bytes += _file_size(s.path)
+        archive_bytes += sum(_file_size(p) for p in s.archives.values())
+    return {"hot_rows": hot_rows, "hot_bytes": hot_bytes,
+            "archive_rows": archive_rows, "archive_bytes": archive_bytes}
+
+
+# Время типичных запросов бота (мс, медиана из repeat) для пользователя
+# с самым большим числом горячих операций: страница истории и статистика
+# за последний месяц, остаток, а также проход по горячей таблице, как у
+# запросов без подходящего индекса.
+def latency_report(repeat=20, today=None):
+    best = None
+    for s in storage.shards:
+        with s.read() as conn:
+            row = conn.execute("""
+                SELECT user_id, COUNT(*) FROM operations GROUP BY user_id ORDER BY 2 DESC LIMIT 1
+            """).fetchone()
+        if row and (best is None or row[1] > best[1]):
+            best = row
+    if best is None:
+        return {}
+    user_id = best[0]
+    start, end = storage.period_bounds("month", today)
+    queries = {
+        "history_page": lambda: storage.get_operations_page(user_id, start, end),
+        "stats_month": lambda: storage.get_category_stats(user_id, start, end),
+        "balance": lambda: storage.get_balance(user_id),
+        "hot_scan": lambda: _hot_scan(user_id),
+    }
+    result = {}
+    for name, query in queries.items():
+        times = []
+        for _ in range(repeat):
+            t = time.perf_counter()
+            query()
+            times.append(time.perf_counter() - t)
+        result[name] = sorted(times)[len(times) // 2] * 1000
+    return result
+
+
+def _hot_scan(user_id):
+    with storage.db_for(user_id).read() as conn:
+        return conn.execute(
+            "SELECT COUNT(*), SUM(amount) FROM operations NOT INDEXED WHERE user_id = ?", (user_id,)
+        ).fetchone()
@@ -0,0 +1,172 @@
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import storage
+
+# Сколько ждать соседние записи, чтобы закоммитить их одной транзакцией.
+BATCH_WINDOW = float(os.getenv("FINBOT_BATCH_WINDOW_MS", "3")) / 1000
+BATCH_MAX = 256
+
+
+# ---------- Асинхронный фасад ----------
+# Чтения выполняются в пуле потоков, записи идут через задачу-писателя
+# своего шарда: всё, что пришло в пределах BATCH_WINDOW, коммитится одной
+# транзакцией, и future каждого вызова завершается только после COMMIT.
+class ShardWriter:
+    def __init__(self, target, window, max_batch):
+        self.target = target
+        self.window = window
+        self.max_batch = max_batch
+        self._pool = ThreadPoolExecutor(1, thread_name_prefix="db-write")
+        self._queue = None
+        self._task = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        # fsync на каждый групповой коммит: запись подтверждается только
+        # после того, как она долговечна, а цена делится на всю пачку
+        await loop.run_in_executor(self._pool, self.target.set_synchronous, "FULL")
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        await self._queue.put(None)
+        await self._task
+        self._pool.shutdown()
+
+    async def submit(self, fn, args):
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((fn, args, fut))
+        return await fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            try:
+                results = await loop.run_in_executor(self._pool, self._commit_batch, batch)
+            except Exception as e:
+                results = [(False, e)] * len(batch)
+            for (_, _, fut), (ok, value) in zip(batch, results):
+                if fut.done():
+                    continue
+                if ok:
+                    fut.set_result(value)
+                else:
+                    fut.set_exception(value)
+
+    def _commit_batch(self, batch):
+        results = []
+        with self.target.write():
+            for fn, args, _ in batch:
+                try:
+                    results.append((True, fn(*args)))
+                except Exception as e:
+                    results.append((False, e))
+        return results
+
+
+class AsyncStorage:
+    def __init__(self, readers=storage.READERS, window=BATCH_WINDOW, max_batch=BATCH_MAX):
+        self.window = window
+        self.max_batch = max_batch
+        self._read_pool = ThreadPoolExecutor(readers, thread_name_prefix="db-read")
+        self._writers = {}
+
+    async def start(self):
+        for target in storage.shards:
+            writer = ShardWriter(target, self.window, self.max_batch)
+            await writer.start()
+            self._writers[target] = writer
+
+    async def stop(self):
+        writers, self._writers = self._writers, {}
+        for writer in writers.values():
+            await writer.stop()
+        self._read_pool.shutdown()
+
+    async def read(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_pool, fn, *args)
+
+    # Все хелперы записи принимают user_id первым аргументом — по нему
+    # выбирается шард и его писатель.
+    async def write(self, fn, user_id, *args):
+        writer = self._writers.get(storage.db_for(user_id))
+        if writer is None:
+            # писатель не запущен (скрипты, тесты) — выполняем сразу
+            return fn(user_id, *args)
+        return await writer.submit(fn, (user_id, *args))
+
+
+adb = AsyncStorage()
+
+
+# ---------- Задержка цикла событий ----------
+# Раз в interval секунд просыпается и меряет, насколько позже положенного
+# его разбудили. Включается FINBOT_LOOP_LAG=1, отчёт печатается раз в минуту.
+class LoopLagMonitor:
+    def __init__(self, interval=0.05, report_every=60, keep=10000):
+        self.interval = interval
+        self.report_every = report_every
+        self.samples = deque(maxlen=keep)
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        last_report = time.perf_counter()
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            self.samples.append(now - start - self.interval)
+            if self.report_every and now - last_report >= self.report_every:
+                print(self.report())
+                last_report = now
+
+    def stats(self):
+        lags = sorted(self.samples)
+        if not lags:
+            return {"samples": 0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        return {
+            "samples": len(lags),
+            "p50_ms": lags[len(lags) // 2] * 1000,
+            "p99_ms": lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000,
+            "max_ms": lags[-1] * 1000,
+        }
+
+    def report(self):
+        s = self.stats()
+        return f"Задержка цикла: p50={s['p50_ms']:.2f} мс, p99={s['p99_ms']:.2f} мс, max={s['max_ms']:.2f} мс ({s['samples']} замеров)"
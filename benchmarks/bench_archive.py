@@ -0,0 +1,109 @@
+# Архивация закрытых месяцев: размер горячей таблицы и время запросов до
+# и после, плюс сверка — остатки, статистика, листание истории, выгрузка
+# и повторный импорт дают те же результаты, что и без архива.
+#
+#   python benchmarks/bench_archive.py [операций] [пользователей]
+
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import archive
+import storage
+
+TODAY = date(2026, 6, 15)
+YEARS = 5
+CATEGORIES = storage.BASE_CATEGORIES
+CURRENCIES = ["RUB", "USD", "EUR"]
+
+
+def rows_for(user_id, count, rng):
+    first = TODAY - timedelta(days=365 * YEARS)
+    for i in range(count):
+        day = (first + timedelta(days=i * 365 * YEARS // count)).isoformat()
+        op_type = "income" if rng.random() < 0.1 else "expense"
+        yield (op_type, round(rng.uniform(1, 5000), 2), rng.choice(CURRENCIES),
+               rng.choice(CATEGORIES) if op_type == "expense" else None, day, f"{user_id}:{i}")
+
+
+def walk_history(user_id, start, end):
+    rows, after = [], None
+    while True:
+        page, more = storage.get_operations_page(user_id, start, end, after=after, limit=50)
+        rows += page
+        if not more:
+            return rows
+        after = [page[-1][5], page[-1][0]]
+
+
+def walk_back(user_id, start, end):
+    rows, before = [], None
+    while True:
+        # первая страница с конца — ключ (end, 0) раньше любой строки за end
+        page, more = storage.get_operations_page(user_id, start, end, before=before or [end, 0], limit=50)
+        rows = page + rows
+        if not more:
+            return rows
+        before = [page[0][5], page[0][0]]
+
+
+def snapshot(users):
+    result = {}
+    ranges = [("2021-01-01", "2027-01-01"), ("2022-03-10", "2022-09-20"), ("2025-12-01", "2026-02-01")]
+    for user_id in users:
+        result[(user_id, "balance")] = {c: round(a, 2) for c, a in storage.get_balance(user_id).items()}
+        for start, end in ranges:
+            for t in ("income", "expense"):
+                for fn in (storage.get_category_stats, storage.get_category_stats_raw):
+                    result[(user_id, fn.__name__, start, t)] = sorted(
+                        (cat or "", c, round(a, 2)) for cat, c, a in fn(user_id, start, end, t))
+        result[(user_id, "history")] = walk_history(user_id, "2021-01-01", "2026-07-01")
+        result[(user_id, "history_back")] = walk_back(user_id, "2021-01-01", "2026-07-01")
+        result[(user_id, "export")] = [r for chunk in storage.iter_operation_chunks(user_id, op_type="expense") for r in chunk]
+    return result
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.configure(os.path.join(tmp, "archive.db"), "single")
+        storage.init_db()
+        for user_id in range(1, users + 1):
+            storage.import_operations(user_id, rows_for(user_id, total // users, rng))
+        checked = [1, users // 2, users]
+        before = snapshot(checked)
+
+        sizes = archive.size_report()
+        latency = archive.latency_report(today=TODAY)
+        print(f"до: горячих {sizes['hot_rows']} строк, {sizes['hot_bytes'] / 2**20:.1f} МБ; "
+              + ", ".join(f"{k} {v:.2f} мс" for k, v in latency.items()))
+
+        cutoff = archive.archive_cutoff(12, TODAY)
+        t = time.perf_counter()
+        moved = archive.archive(cutoff, vacuum=True)
+        print(f"архивация до {cutoff}: {moved} операций за {time.perf_counter() - t:.1f} с")
+
+        sizes = archive.size_report()
+        latency = archive.latency_report(today=TODAY)
+        print(f"после: горячих {sizes['hot_rows']} строк, {sizes['hot_bytes'] / 2**20:.1f} МБ, "
+              f"архив {sizes['archive_rows']} строк, {sizes['archive_bytes'] / 2**20:.1f} МБ; "
+              + ", ".join(f"{k} {v:.2f} мс" for k, v in latency.items()))
+
+        after = snapshot(checked)
+        diff = [key for key in before if before[key] != after[key]]
+        print("результаты совпадают" if not diff else f"РАСХОЖДЕНИЯ: {diff[:5]}")
+        print("остатки сходятся" if not storage.check_balances() else "РАСХОЖДЕНИЯ в balances")
+        added, skipped = storage.import_operations(1, rows_for(1, total // users, random.Random(1)))
+        print(f"повторный импорт: добавлено {added}, пропущено {skipped}")
+        storage.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+# Нагрузочный прогон всего бота без сети: настоящий Application из
+# bot.build_application (ConversationHandler, persistence, параллельная
+# обработка) и FakeBotAPI вместо Telegram. Виртуальные пользователи
+# проходят типичные сценарии — расход, доход, история, правка и удаление,
+# баланс, статистика за месяц — каждый отправляет следующее сообщение,
+# дождавшись ответа на предыдущее.
+#
+# Считается по обработчикам: время внутри обработчика и от постановки
+# апдейта в очередь до конца обработки (p50/p95/p99), SQL-запросы на
+# вызов; в целом — апдейты в секунду и SQL-запросы на апдейт.
+#
+#   python benchmarks/bench_bot.py [--users N] [--scripts N] [--out run.json] [--compare old.json]
+
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import telegram
+from telegram import Update
+from telegram.ext import ApplicationBuilder, ConversationHandler, TypeHandler
+
+import storage
+from fake_api import FakeBotAPI, text_update
+
+SETUP = ["/start", "💱 Валюты", "➕ Добавить валюту", "RUB", "⬅️ Назад",
+         "➕ Добавить", "💰 Доход", "RUB", "{amount}"]
+
+# сценарий: (вес, сообщения)
+SCRIPTS = {
+    "expense": (40, ["➕ Добавить", "💸 Расход", "{category}", "RUB", "{amount}"]),
+    "income": (15, ["➕ Добавить", "💰 Доход", "RUB", "{amount}"]),
+    "history": (15, ["📅 История", "Месяц", "⬅️ Назад"]),
+    "edit": (5, ["📅 История", "Сегодня", "✏️ Редактировать", "1", "{amount}"]),
+    "delete": (5, ["📅 История", "Сегодня", "🗑 Удалить", "1"]),
+    "balance": (10, ["📊 Статистика", "💰 Баланс"]),
+    "stats": (10, ["📊 Статистика", "📊 Расходы по категориям (месяц)"]),
+}
+
+
+# ---------- Учёт SQL ----------
+# Каждое соединение storage получает trace-колбэк. Запрос приписывается
+# обработчику, из которого вызван adb.read/adb.write; всё остальное
+# (BEGIN/COMMIT групповых коммитов, persistence) — в "other".
+_handler = contextvars.ContextVar("handler", default=None)
+_thread = threading.local()
+_sql_counters = []
+_sql_lock = threading.Lock()
+
+
+def _count_sql(statement):
+    counter = getattr(_thread, "counter", None)
+    if counter is None:
+        counter = _thread.counter = Counter()
+        with _sql_lock:
+            _sql_counters.append(counter)
+    counter[getattr(_thread, "tag", None) or "other"] += 1
+
+
+def sql_counts():
+    total = Counter()
+    with _sql_lock:
+        for counter in _sql_counters:
+            total.update(counter)
+    return total
+
+
+def reset_sql():
+    with _sql_lock:
+        for counter in _sql_counters:
+            counter.clear()
+
+
+def install_sql_trace():
+    connect = storage.Storage._connect
+
+    def traced(self, readonly=False):
+        conn = connect(self, readonly)
+        conn.set_trace_callback(_count_sql)
+        return conn
+    storage.Storage._connect = traced
+
+
+def _tagged(fn, tag):
+    def run(*args):
+        _thread.tag = tag
+        try:
+            return fn(*args)
+        finally:
+            _thread.tag = None
+    return run
+
+
+def tag_adb(adb):
+    read, write = adb.read, adb.write
+
+    async def tagged_read(fn, *args):
+        return await read(_tagged(fn, _handler.get()), *args)
+
+    async def tagged_write(fn, user_id, *args):
+        return await write(_tagged(fn, _handler.get()), user_id, *args)
+    adb.read, adb.write = tagged_read, tagged_write
+
+
+# ---------- Замер обработчиков ----------
+class HandlerTimer:
+    def __init__(self):
+        self.times = defaultdict(list)
+        self.calls = Counter()
+        self.handled_by = {}
+
+    def wrap(self, handler):
+        callback = handler.callback
+        if getattr(callback, "_timed", False):
+            return
+        name = callback.__name__
+
+        async def timed(update, context):
+            token = _handler.set(name)
+            start = time.perf_counter()
+            try:
+                return await callback(update, context)
+            finally:
+                self.times[name].append(time.perf_counter() - start)
+                self.calls[name] += 1
+                self.handled_by[update.update_id] = name
+                _handler.reset(token)
+        timed._timed = True
+        handler.callback = timed
+
+    def install(self, app):
+        for handler in app.handlers[0]:
+            if isinstance(handler, ConversationHandler):
+                for h in handler.entry_points + handler.fallbacks:
+                    self.wrap(h)
+                for handlers in handler.states.values():
+                    for h in handlers:
+                        self.wrap(h)
+            else:
+                self.wrap(handler)
+
+    def reset(self):
+        self.times.clear()
+        self.calls.clear()
+        self.handled_by.clear()
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+    pick = lambda q: values[min(len(values) - 1, int(len(values) * q))] * 1000
+    return {"p50_ms": round(pick(0.5), 3), "p95_ms": round(pick(0.95), 3), "p99_ms": round(pick(0.99), 3)}
+
+
+# ---------- Виртуальные пользователи ----------
+class Driver:
+    def __init__(self, app):
+        self.app = app
+        self.update_ids = iter(range(1, 1 << 62))
+        self.pending = {}
+        self.sent_at = {}
+        self.done_at = {}
+
+    async def done(self, update, context):
+        self.done_at[update.update_id] = time.perf_counter()
+        fut = self.pending.pop(update.update_id, None)
+        if fut is not None:
+            fut.set_result(None)
+
+    async def send(self, user_id, text):
+        update_id = next(self.update_ids)
+        fut = asyncio.get_running_loop().create_future()
+        self.pending[update_id] = fut
+        self.sent_at[update_id] = time.perf_counter()
+        await self.app.update_queue.put(Update.de_json(text_update(update_id, user_id, text), self.app.bot))
+        await fut
+
+    async def run_script(self, user_id, messages, rng):
+        for text in messages:
+            text = text.format(amount=rng.randint(1, 5000), category=rng.choice(storage.BASE_CATEGORIES))
+            await self.send(user_id, text)
+
+    def reset(self):
+        self.sent_at.clear()
+        self.done_at.clear()
+
+
+async def virtual_user(driver, user_id, count, seed, used):
+    rng = random.Random(seed)
+    names = list(SCRIPTS)
+    weights = [SCRIPTS[n][0] for n in names]
+    for name in rng.choices(names, weights, k=count):
+        used[name] += 1
+        await driver.run_script(user_id, SCRIPTS[name][1], rng)
+
+
+async def run(users, scripts, seed):
+    import bot
+    from async_db import adb
+
+    api = FakeBotAPI()
+    app = bot.build_application("1:FAKE", ApplicationBuilder().request(api).updater(None))
+    timer = HandlerTimer()
+    timer.install(app)
+    driver = Driver(app)
+    # группа 1 выполняется после диалога — апдейт обработан целиком
+    app.add_handler(TypeHandler(Update, driver.done), group=1)
+    tag_adb(adb)
+
+    async with app:
+        await app.post_init(app)
+        await app.start()
+        await asyncio.gather(*(
+            driver.run_script(user_id, SETUP, random.Random(seed + user_id)) for user_id in range(1, users + 1)
+        ))
+        timer.reset()
+        driver.reset()
+        reset_sql()
+        api.reset()
+
+        used = Counter()
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            virtual_user(driver, user_id, scripts, seed * 1_000_003 + user_id, used)
+            for user_id in range(1, users + 1)
+        ))
+        elapsed = time.perf_counter() - start
+        sql = sql_counts()
+        await app.stop()
+        await app.post_shutdown(app)
+
+    updates = len(driver.done_at)
+    e2e = defaultdict(list)
+    for update_id, name in timer.handled_by.items():
+        if update_id in driver.done_at:
+            e2e[name].append(driver.done_at[update_id] - driver.sent_at[update_id])
+    handlers = {}
+    for name in sorted(timer.times):
+        handlers[name] = {
+            "calls": timer.calls[name],
+            **percentiles(timer.times[name]),
+            "e2e": percentiles(e2e[name]),
+            "sql_per_call": round(sql[name] / timer.calls[name], 2),
+        }
+    return {
+        "config": {"users": users, "scripts_per_user": scripts, "seed": seed,
+                   "storage": storage.BACKEND, "shards": len(storage.shards),
+                   "python": platform.python_version(), "ptb": telegram.__version__},
+        "scripts": dict(used),
+        "updates": updates,
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(updates / elapsed, 1),
+        "sql_per_update": round(sum(sql.values()) / updates, 2),
+        "sql_other_per_update": round(sql["other"] / updates, 2),
+        "e2e": percentiles([driver.done_at[i] - driver.sent_at[i] for i in driver.done_at]),
+        "handlers": handlers,
+        "api_calls": dict(api.calls),
+    }
+
+
+# ---------- Отчёт ----------
+def print_report(result, old=None):
+    def delta(new, key, old_value):
+        if old_value is None or not old_value.get(key):
+            return ""
+        return f" ({(new[key] / old_value[key] - 1) * 100:+.0f}%)"
+
+    print(f"{result['updates']} апдейтов за {result['elapsed_s']} с: "
+          f"{result['updates_per_s']} апдейтов/с{delta(result, 'updates_per_s', old)}, "
+          f"SQL на апдейт {result['sql_per_update']}{delta(result, 'sql_per_update', old)}")
+    e2e = result["e2e"]
+    print(f"от очереди до ответа: p50={e2e['p50_ms']} мс p95={e2e['p95_ms']} мс p99={e2e['p99_ms']} мс")
+    print(f"{'обработчик':<26}{'вызовов':>9}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}{'SQL':>7}" + ("  (p95 к прошлому)" if old else ""))
+    for name, h in result["handlers"].items():
+        was = (old or {}).get("handlers", {}).get(name)
+        print(f"{name:<26}{h['calls']:>9}{h['p50_ms']:>9.2f}{h['p95_ms']:>9.2f}{h['p99_ms']:>9.2f}"
+              f"{h['sql_per_call']:>7.1f}{delta(h, 'p95_ms', was)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота с FakeBotAPI")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--scripts", type=int, default=5, help="сценариев на пользователя")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="сохранить результат в JSON")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.configure(os.path.join(tmp, "bench.db"), storage.BACKEND)
+        install_sql_trace()
+        storage.init_db()
+        result = asyncio.run(run(args.users, args.scripts, args.seed))
+        storage.close_all()
+
+    old = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            old = json.load(f)
+    print_report(result, old)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
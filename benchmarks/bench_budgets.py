@@ -0,0 +1,97 @@
+# Цена проверки бюджетов при записи расхода: у пользователя 1000 бюджетов
+# (200 категорий × 5 валют), история этого месяца разного размера.
+# Сравниваются запись без проверки, запись с проверкой по итогу месяца,
+# который возвращает сама запись (как в боте), и запись с пересчётом
+# месяца через get_category_stats. Перед замерами — проверка порогов.
+#
+#   python benchmarks/bench_budgets.py [операций на замер]
+
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+
+CURRENCIES = ["RUB", "USD", "EUR", "KZT", "GEL"]
+CATEGORIES = [f"Категория {i}" for i in range(200)]
+HISTORY = [1_000, 100_000, 500_000]
+USER = 1
+
+
+def setup(history, rng):
+    storage.ensure_user(USER)
+    for code in CURRENCIES:
+        storage.add_currency(USER, code)
+    for name in CATEGORIES:
+        storage.add_category(USER, name)
+    for name in CATEGORIES:
+        for code in CURRENCIES:
+            storage.set_budget(USER, name, code, 1e12)
+    month = datetime.now().strftime("%Y-%m")
+    rows = ((("expense", rng.randint(1, 1000), rng.choice(CURRENCIES), rng.choice(CATEGORIES),
+              f"{month}-{rng.randint(1, 28):02d}", f"h{i}")) for i in range(history))
+    storage.import_operations(USER, rows)
+
+
+def measure(count, rng, write):
+    start = time.perf_counter()
+    for _ in range(count):
+        amount, currency, category = rng.randint(1, 1000), rng.choice(CURRENCIES), rng.choice(CATEGORIES)
+        write(category, currency, amount)
+    return (time.perf_counter() - start) / count
+
+
+def recount(category, currency, amount):
+    storage.add_operation(USER, "expense", amount, currency, category)
+    start, end = storage.period_bounds("month")
+    for cat, cur, total in storage.get_category_stats(USER, start, end):
+        if cat == category and cur == currency:
+            return total
+
+
+# лимит 1000: 700 — ничего, +100 — 80%, +150 — ничего, +50 — 100%,
+# правка суммы назад и снова вверх — опять 100%
+def check_thresholds():
+    storage.set_budget(USER, "🍔 Еда", "RUB", 1000)
+    steps = [(700, None), (100, 0.8), (150, None), (50, 1.0)]
+    for amount, want in steps:
+        crossing = storage.add_operation_checked(USER, "expense", amount, "RUB", "🍔 Еда")
+        assert (crossing and crossing[0]) == want, (amount, crossing)
+    op_id = storage.add_operation(USER, "expense", 1, "RUB", "🍔 Еда")
+    assert storage.update_operation_amount(USER, op_id, 0.5)[-1] is None
+    storage.delete_operation(USER, op_id)
+    op_id = storage.add_operation(USER, "income", 5, "RUB")
+    assert storage.update_operation_amount(USER, op_id, 10)[-1] is None
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(f"{len(storage.BASE_CATEGORIES) + len(CATEGORIES)} категорий, "
+          f"{len(CATEGORIES) * len(CURRENCIES)} бюджетов, {count} записей на замер")
+    for history in HISTORY:
+        rng = random.Random(history)
+        with tempfile.TemporaryDirectory() as tmp:
+            storage.configure(os.path.join(tmp, "budgets.db"), "single")
+            storage.init_db()
+            setup(history, rng)
+            assert len(storage.get_budgets(USER)) == len(CATEGORIES) * len(CURRENCIES)
+            check_thresholds()
+            plain = measure(count, rng, lambda cat, cur, amount: storage.add_operation(USER, "expense", amount, cur, cat))
+            checked = measure(count, rng, lambda cat, cur, amount: storage.add_operation_checked(USER, "expense", amount, cur, cat))
+            start = time.perf_counter()
+            for _ in range(count):
+                storage.budget_crossing(USER, rng.choice(CATEGORIES), rng.choice(CURRENCIES), rng.randint(1, 1000), 1)
+            check_only = (time.perf_counter() - start) / count
+            naive = measure(count // 10, rng, recount)
+            storage.close_all()
+        print(f"история {history:>7}: запись {plain * 1e6:.0f} мкс, запись + проверка {checked * 1e6:.0f} мкс "
+              f"(проверка {check_only * 1e6:.1f} мкс), запись + пересчёт месяца {naive * 1e6:.0f} мкс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# Рассылка сводок на большом числе подписчиков: время полного прохода
+# (чтение страниц, сборка текстов, отправка в FakeBotAPI без ограничения
+# скорости) для дня, недели и месяца, и для сравнения — тот же месяц
+# запросом get_monthly_category_stats на каждого пользователя.
+# Сводные таблицы заполняются напрямую, без operations: рассылка читает
+# только их.
+#
+#   python benchmarks/bench_digest.py [пользователей] [дней истории] [single|sharded]
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+
+CATEGORIES = storage.BASE_CATEGORIES
+CURRENCIES = ["RUB", "RUB", "RUB", "USD"]
+TODAY = date(2026, 10, 15)
+
+
+def populate(users, days, seed=1):
+    rng = random.Random(seed)
+    first = TODAY - timedelta(days=days)
+    for s in storage.shards:
+        with s.write() as conn:
+            conn.executemany(
+                "INSERT INTO digest_subscriptions (period, user_id, chat_id) VALUES (?, ?, ?)",
+                ((period, u, u) for u in range(1, users + 1) if storage.db_for(u) is s
+                 for period in storage.DIGEST_PERIODS)
+            )
+
+    def rows(s):
+        for u in range(1, users + 1):
+            if storage.db_for(u) is not s:
+                continue
+            # каждый пользователь активен примерно в каждый третий день
+            for d in range(days):
+                if rng.random() < 0.33:
+                    day = (first + timedelta(days=d)).isoformat()
+                    for category in rng.sample(CATEGORIES, rng.randint(1, 3)):
+                        yield u, "expense", day, category, rng.choice(CURRENCIES), rng.randint(100, 5000), 1
+                    if rng.random() < 0.05:
+                        yield u, "income", day, "", "RUB", rng.randint(10000, 100000), 1
+
+    count = 0
+    for s in storage.shards:
+        with s.write() as conn:
+            before = conn.total_changes
+            conn.executemany("""
+                INSERT OR IGNORE INTO daily_totals (user_id, type, day, category, currency, amount, count)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, rows(s))
+            count += conn.total_changes - before
+            conn.execute("""
+                INSERT INTO monthly_totals (user_id, type, month, category, currency, amount, count)
+                SELECT user_id, type, substr(day, 1, 7), category, currency, SUM(amount), SUM(count)
+                FROM daily_totals
+                GROUP BY user_id, type, substr(day, 1, 7), category, currency
+            """)
+            conn.execute("ANALYZE")
+    return count
+
+
+async def run(users):
+    import digest
+    from async_db import adb
+    from telegram import Bot
+    from fake_api import FakeBotAPI
+
+    api = FakeBotAPI()
+    bot = Bot("1:FAKE", request=api)
+    await adb.start()
+    results = []
+    async with bot:
+        for period in storage.DIGEST_PERIODS:
+            api.reset()
+            page_time = 0.0
+            original = storage.get_digest_page
+
+            def timed_page(*args):
+                nonlocal page_time
+                start = time.perf_counter()
+                result = original(*args)
+                page_time += time.perf_counter() - start
+                return result
+
+            storage.get_digest_page = timed_page
+            start = time.perf_counter()
+            stats = await digest.run_digest(bot, period, TODAY, rate=0)
+            elapsed = time.perf_counter() - start
+            storage.get_digest_page = original
+            # повторный запуск за тот же период ничего не шлёт
+            again = await digest.run_digest(bot, period, TODAY, rate=0)
+            results.append((period, stats, elapsed, page_time, api.calls["sendMessage"], again["sent"]))
+
+        # для сравнения: месяц запросами на каждого пользователя
+        sample = min(users, 5000)
+        month = digest.period_range("month", TODAY)[0][:7]
+        start = time.perf_counter()
+        for u in range(1, sample + 1):
+            storage.get_monthly_category_stats(u, month)
+            day = date.fromisoformat(month + "-01")
+            storage.get_category_stats(u, *storage.period_bounds("month", day), op_type="income")
+        per_user = (time.perf_counter() - start) / sample
+    await adb.stop()
+    return results, per_user
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    backend = sys.argv[3] if len(sys.argv) > 3 else "single"
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.configure(os.path.join(tmp, "digest.db"), backend)
+        storage.init_db()
+        start = time.perf_counter()
+        count = populate(users, days)
+        print(f"{users} подписчиков, {count} строк daily_totals за {days} дней, "
+              f"{backend}: заполнено за {time.perf_counter() - start:.0f} с")
+        results, per_user = asyncio.run(run(users))
+        storage.close_all()
+
+    for period, stats, elapsed, page_time, sent, again in results:
+        print(f"{period:>5}: {stats['sent']} сводок из {stats['users']} подписчиков за {elapsed:.1f} с "
+              f"(SQL {page_time:.1f} с, {stats['users'] / elapsed:.0f} польз./с), "
+              f"sendMessage {sent}, повторный запуск отправил {again}")
+    print(f"месяц по запросу на пользователя: {per_user * 1e6:.0f} мкс → {per_user * users:.1f} с на {users} "
+          f"только на SQL")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# Экспорт большой истории: заполняет базу синтетическими операциями и
+# выгружает их в CSV и JSON Lines. Каждая выгрузка идёт в отдельном
+# процессе, чтобы пиковая память (ru_maxrss) относилась только к ней;
+# выгрузка пятой части истории показывает, что память от объёма не зависит.
+# Страницы базы, отображённые через mmap (PRAGMA mmap_size), тоже входят в
+# ru_maxrss, поэтому отдельно печатается анонимная память процесса.
+#
+# В конце месяц выгрузки загружается обратно через importer другому
+# пользователю: операции вместе с заметками должны совпасть.
+#
+#   python benchmarks/bench_export.py [операций]
+
+import gzip
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+from exporter import export_operations
+from importer import import_csv
+
+USER = 7
+COPY = 8
+
+
+def fill(total):
+    with storage.db.write() as conn:
+        conn.execute("""
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+            INSERT INTO operations (user_id, type, amount, currency, category, date, note)
+            SELECT ?, CASE WHEN i % 10 = 0 THEN 'income' ELSE 'expense' END,
+                   (i * 7919) % 100000 / 100.0,
+                   CASE WHEN i % 7 = 0 THEN 'USD' ELSE 'RUB' END,
+                   CASE WHEN i % 10 = 0 THEN NULL ELSE '🍔 Еда' END,
+                   date('2010-01-01', '+' || (i * 5000 / ?) || ' days'),
+                   CASE WHEN i % 4 = 0 THEN 'обед, "у дома" ' || i END
+            FROM n
+        """, (total, USER, total))
+
+
+def anon_memory():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float("nan")
+
+
+def export_child(db_path, fmt, start, end):
+    storage.configure(db_path, "single")
+    out = os.path.join(os.path.dirname(db_path), f"export.{fmt}.gz")
+    begin = time.perf_counter()
+    count = export_operations(USER, out, fmt, start or None, end or None)
+    elapsed = time.perf_counter() - begin
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{fmt:5} {count:>9} строк за {elapsed:6.2f} с ({count / elapsed:,.0f} строк/с), "
+          f"файл {os.path.getsize(out) / 1e6:.1f} МБ, пиковая память {rss:.0f} МБ (анонимная {anon_memory():.0f} МБ)")
+
+
+def round_trip(tmp, start, end):
+    packed = os.path.join(tmp, "month.csv.gz")
+    plain = os.path.join(tmp, "month.csv")
+    count = export_operations(USER, packed, "csv", start, end)
+    with gzip.open(packed, "rb") as src, open(plain, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    storage.ensure_user(COPY)
+    added, skipped, bad, _ = import_csv(COPY, plain)
+    assert (added, skipped, bad) == (count, 0, 0), (count, added, skipped, bad)
+
+    def operations(user_id):
+        return sorted(row for rows in storage.iter_operation_chunks(user_id, start, end) for row in rows)
+    original = operations(USER)
+    assert operations(COPY) == original
+    notes = sum(row[-1] is not None for row in original)
+    assert notes, "в выгрузке нет заметок"
+    print(f"выгрузка и загрузка обратно: {count} операций, из них {notes} с заметками — совпадают")
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000_000
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "export.db")
+        storage.configure(db_path, "single")
+        storage.init_db()
+        begin = time.perf_counter()
+        fill(total)
+        print(f"заполнение: {total} операций за {time.perf_counter() - begin:.1f} с")
+        storage.close_all()
+
+        for fmt, start, end in (("csv", "", ""), ("jsonl", "", ""), ("csv", "2010-01-01", "2012-09-28")):
+            subprocess.run([sys.executable, __file__, "--child", db_path, fmt, start, end], check=True)
+
+        storage.configure(db_path, "single")
+        round_trip(tmp, "2010-01-01", "2010-02-01")
+        storage.close_all()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--child"]:
+        export_child(*sys.argv[2:6])
+    else:
+        main()
@@ -0,0 +1,167 @@
+# Поиск /find по большой базе: у одного пользователя большая история
+# (по умолчанию 1% всех строк), остальные строки поровну у обычных
+# пользователей. Для каждого запроса — медиана времени первой и
+# следующей страницы и план запроса (какие индексы он использует).
+# Результат сверяется с перебором всей истории пользователя в Python.
+#
+#   python benchmarks/bench_find.py [строк] [пользователей] [доля большого]
+
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+
+CURRENCIES = ["RUB", "RUB", "RUB", "USD", "EUR"]
+# половина операций с заметкой: из них 40% — частые заметки (по 4%
+# каждая), остальные — названия 2000 магазинов
+COMMON_NOTES = ["такси до аэропорта", "кофе с собой", "обед с коллегами", "подарок маме", "абонемент в зал",
+                "ремонт велосипеда", "билеты в кино", "аренда квартиры", "штраф за парковку", "зоомагазин"]
+SHOPS = [f"магазин{i}" for i in range(2000)]
+FIRST = date(2021, 1, 1)
+DAYS = 5 * 365
+REPEAT = 20
+
+
+def populate(rows, users, heavy_share, rng):
+    heavy = int(rows * heavy_share)
+    per_user = (rows - heavy) // max(users - 1, 1)
+
+    def generate(count):
+        for i in range(count):
+            day = (FIRST + timedelta(days=rng.randrange(DAYS))).isoformat()
+            income = rng.random() < 0.05
+            category = None if income else rng.choice(storage.BASE_CATEGORIES)
+            note = None
+            if rng.random() < 0.5:
+                note = rng.choice(COMMON_NOTES) if rng.random() < 0.4 else rng.choice(SHOPS)
+            yield ("income" if income else "expense", round(rng.lognormvariate(6, 1.2), 2),
+                   rng.choice(CURRENCIES), category, day, f"b{i}", note)
+
+    storage.import_operations(1, generate(heavy))
+    for user_id in range(2, users + 1):
+        storage.import_operations(user_id, generate(per_user))
+    for s in storage.shards:
+        with s.write() as conn:
+            conn.execute("ANALYZE")
+    return heavy, per_user
+
+
+# (название, запрос) — такие же словари собирает /find в bot.py
+QUERIES = [
+    ("редкое слово", {"words": ["магазин1234"]}),
+    ("частое слово", {"words": ["кофе"]}),
+    ("два слова", {"words": ["штраф", "парковк"]}),
+    ("слово из категории", {"words": ["транс"]}),
+    ("«такси»", {"words": [["такси", "транспорт"]]}),
+    ("слово + период", {"words": ["кофе"], "start": "2024-03-01", "end": "2024-06-01"}),
+    ("сумма 1200", {"min": 1200.0, "max": 1200.0}),
+    ("сумма 1000-1500 + период", {"min": 1000.0, "max": 1500.0, "start": "2023-03-01", "end": "2023-06-01"}),
+    ("категория + валюта", {"category": "🚕 Транспорт", "currency": "USD"}),
+    ("всё сразу", {"words": [["такси", "транспорт"]], "min": 1000.0, "max": 1500.0, "currency": "RUB",
+                   "start": "2022-03-01", "end": "2022-06-01"}),
+    ("только период", {"start": "2025-03-01", "end": "2025-03-08"}),
+]
+
+
+def expected(user_id, query):
+    with storage.db_for(user_id).read() as conn:
+        rows = conn.execute("""
+            SELECT id, type, amount, currency, category, date, note FROM operations
+            WHERE user_id = ? ORDER BY date, id
+        """, (user_id,)).fetchall()
+    groups = storage._word_groups(query)
+    result = []
+    for row in rows:
+        if query.get("start") and row[5] < query["start"] or query.get("end") and row[5] >= query["end"]:
+            continue
+        if query.get("min") is not None and row[2] < query["min"] or query.get("max") is not None and row[2] > query["max"]:
+            continue
+        if query.get("currency") and row[3] != query["currency"] or query.get("category") and row[4] != query["category"]:
+            continue
+        if storage._words_match(groups, row[6], row[4]):
+            result.append(row)
+    return result
+
+
+def plan(user_id, query):
+    # тот же SQL, что строит find_operations_page, через EXPLAIN QUERY PLAN
+    captured = []
+    conn_read = storage.db_for(user_id).read
+
+    class Spy:
+        def __init__(self, conn):
+            self.conn = conn
+
+        def execute(self, sql, params=()):
+            if "FROM operations_fts" in sql or "FROM operations o" in sql:
+                captured.extend(r[3] for r in self.conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+            return self.conn.execute(sql, params)
+
+        def __getattr__(self, name):
+            return getattr(self.conn, name)
+
+    from contextlib import contextmanager
+
+    @contextmanager
+    def spy_read():
+        with conn_read() as conn:
+            yield Spy(conn)
+
+    storage.db_for(user_id).read = spy_read
+    try:
+        storage.find_operations_page(user_id, query)
+    finally:
+        del storage.db_for(user_id).read
+    return "; ".join(captured)
+
+
+def median_ms(fn):
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+    heavy_share = float(sys.argv[3]) if len(sys.argv) > 3 else 0.01
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.configure(os.path.join(tmp, "find.db"), "single")
+        storage.init_db()
+        start = time.perf_counter()
+        heavy, per_user = populate(rows, users, heavy_share, rng)
+        size = os.path.getsize(os.path.join(tmp, "find.db")) / 2 ** 20
+        print(f"{rows} операций, {users} пользователей (большой — {heavy}, остальные по {per_user}), "
+              f"база {size:.0f} МБ, заполнено за {time.perf_counter() - start:.0f} с")
+
+        for user_id, label in ((1, "большой"), (users // 2, "обычный")):
+            print(f"\nпользователь {label}:")
+            for name, query in QUERIES:
+                page, more = storage.find_operations_page(user_id, query)
+                full = expected(user_id, query)
+                assert page == full[:storage.PAGE_SIZE], (name, page[:2], full[:2])
+                first = median_ms(lambda: storage.find_operations_page(user_id, query))
+                line = f"  {name:<26} найдено {len(full):>6}: первая страница {first:6.2f} мс"
+                if more:
+                    after = [page[-1][5], page[-1][0]]
+                    nxt, _ = storage.find_operations_page(user_id, query, after)
+                    assert nxt == full[storage.PAGE_SIZE:2 * storage.PAGE_SIZE], name
+                    line += f", следующая {median_ms(lambda: storage.find_operations_page(user_id, query, after)):6.2f} мс"
+                print(line)
+                print(f"    план: {plan(user_id, query)}")
+        storage.close_all()
+
+
+if __name__ == "__main__":
+    main()
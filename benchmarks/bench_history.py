@@ -0,0 +1,73 @@
+# Листание истории: время получения страницы на разной глубине для
+# keyset-пагинации (get_operations_page) и для наивного LIMIT/OFFSET.
+#
+#   python benchmarks/bench_history.py [операций]
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+
+USER = 7
+START, END = "2000-01-01", "2100-01-01"
+REPEAT = 50
+
+
+def fill(total):
+    with storage.db.write() as conn:
+        conn.execute("""
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+            INSERT INTO operations (user_id, type, amount, currency, category, date)
+            SELECT ?, 'expense', i % 1000, 'RUB', '🍔 Еда', date('2010-01-01', '+' || (i * 3000 / ?) || ' days')
+            FROM n
+        """, (total, USER, total))
+
+
+def page_by_offset(offset):
+    with storage.db.read() as conn:
+        return conn.execute("""
+            SELECT id, type, amount, currency, category, date
+            FROM operations
+            WHERE user_id = ? AND date >= ? AND date < ?
+            ORDER BY date, id
+            LIMIT ? OFFSET ?
+        """, (USER, START, END, storage.PAGE_SIZE, offset)).fetchall()
+
+
+def timed(fn):
+    begin = time.perf_counter()
+    for _ in range(REPEAT):
+        fn()
+    return (time.perf_counter() - begin) / REPEAT * 1000
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.configure(os.path.join(tmp, "history.db"), "single")
+        storage.init_db()
+        fill(total)
+        print(f"{total} операций, страница {storage.PAGE_SIZE} строк; среднее по {REPEAT} запросам")
+        # последняя страница может быть неполной; на маленькой истории
+        # глубины обрезаются до неё
+        last = max(total - 1, 0) // storage.PAGE_SIZE
+        for depth in sorted({min(depth, last) for depth in (0, 100, 10_000, last)}):
+            offset = depth * storage.PAGE_SIZE
+            # ключ последней строки предыдущей страницы — то, что бот держит в user_data
+            prev = page_by_offset(offset - storage.PAGE_SIZE)[-1] if depth else None
+            after = [prev[5], prev[0]] if prev else None
+            keyset_rows, _ = storage.get_operations_page(USER, START, END, after=after)
+            assert keyset_rows == page_by_offset(offset)
+            keyset = timed(lambda: storage.get_operations_page(USER, START, END, after=after))
+            by_offset = timed(lambda: page_by_offset(offset))
+            back = timed(lambda: storage.get_operations_page(USER, START, END, before=[keyset_rows[0][5], keyset_rows[0][0]]))
+            print(f"страница {depth + 1:>7}: keyset {keyset:7.3f} мс (назад {back:7.3f} мс), OFFSET {by_offset:8.3f} мс")
+        storage.close_all()
+
+
+if __name__ == "__main__":
+    main()
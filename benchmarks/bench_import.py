@@ -0,0 +1,133 @@
+# Импорт большой выписки: генерирует CSV в формате банковской выгрузки
+# (cp1251, «;»), импортирует его так, как это делает бот, — пачками через
+# писатель шарда (import_csv_chunked), затем повторно (все строки должны
+# отсеяться как дубли) и сверяет производные таблицы с operations.
+#
+# Пока идёт импорт, другой пользователь того же шарда каждые 10 мс
+# добавляет операцию через тот же писатель; печатается, сколько ждали
+# его записи. Для сравнения — прежний путь бота: вся выписка одной
+# записью через adb.write(import_csv, ...).
+#
+#   python benchmarks/bench_import.py [строк] [строк в пачке]
+
+import asyncio
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+from async_db import AsyncStorage
+from importer import IMPORT_CHUNK, import_csv, import_csv_chunked
+
+USER = 42
+OLD_PATH_USER = 43
+NEIGHBOUR = 7
+CATEGORIES = ["Супермаркеты", "Рестораны", "Такси", "Аптеки", "Маркетплейсы", "Связь", ""]
+
+
+def write_statement(path, rows):
+    rnd = random.Random(1)
+    day = date(2020, 1, 1)
+    with open(path, "w", encoding="cp1251", newline="") as f:
+        f.write("Дата операции;Статус;Сумма операции;Валюта операции;Категория;Описание\r\n")
+        for i in range(rows):
+            if i % 300 == 0:
+                day += timedelta(days=1)
+            if rnd.random() < 0.05:
+                amount, category = f"{rnd.randint(1000, 90000)},00", "Пополнения"
+            else:
+                amount, category = f"-{rnd.randint(50, 5000)},{rnd.randint(0, 99):02d}", rnd.choice(CATEGORIES)
+            currency = "RUB" if rnd.random() < 0.9 else "USD"
+            f.write(f"{day:%d.%m.%Y} 12:{i % 60:02d}:00;OK;{amount};{currency};{category};Покупка {i % 97}\r\n")
+
+
+def rounded(stats):
+    return sorted((cat or "", cur, round(total, 2)) for cat, cur, total in stats)
+
+
+# Импорт и параллельно записи соседа; возвращает время импорта, его
+# результат и задержки записей соседа.
+async def with_neighbour(db, run):
+    waits = []
+    done = asyncio.Event()
+
+    async def neighbour():
+        while not done.is_set():
+            start = time.perf_counter()
+            await db.write(storage.add_operation, NEIGHBOUR, "expense", 1.0, "RUB", "🍔 Еда")
+            waits.append(time.perf_counter() - start)
+            await asyncio.sleep(0.01)
+
+    task = asyncio.create_task(neighbour())
+    start = time.perf_counter()
+    result = await run()
+    elapsed = time.perf_counter() - start
+    done.set()
+    await task
+    waits.sort()
+    return elapsed, result, waits
+
+
+def report_waits(waits):
+    return (f"записи соседа: {len(waits)}, p50 {waits[len(waits) // 2] * 1000:.0f} мс, "
+            f"p99 {waits[int(len(waits) * 0.99)] * 1000:.0f} мс, худшая {waits[-1] * 1000:.0f} мс")
+
+
+async def run(path, rows, size, chunk):
+    db = AsyncStorage()
+    await db.start()
+    try:
+        elapsed, (added, skipped, bad, _), waits = await with_neighbour(
+            db, lambda: import_csv_chunked(USER, path, chunk, db=db))
+        print(f"импорт {rows} строк ({size:.0f} МБ) пачками по {chunk}: {elapsed:.2f} с, {rows / elapsed:,.0f} строк/с; "
+              f"добавлено {added}, дублей {skipped}, ошибок {bad}")
+        print(f"  {report_waits(waits)}")
+
+        elapsed, (again, skipped, _, _), waits = await with_neighbour(
+            db, lambda: import_csv_chunked(USER, path, chunk, db=db))
+        print(f"повторный импорт: {elapsed:.2f} с; добавлено {again}, дублей {skipped}; {report_waits(waits)}")
+
+        elapsed, (old_added, _, _, _), waits = await with_neighbour(
+            db, lambda: db.write(import_csv, OLD_PATH_USER, path))
+        print(f"одной записью (как раньше): {elapsed:.2f} с, добавлено {old_added}; {report_waits(waits)}")
+    finally:
+        await db.stop()
+    return added, again
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    chunk = int(sys.argv[2]) if len(sys.argv) > 2 else IMPORT_CHUNK
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "statement.csv")
+        write_statement(path, rows)
+        size = os.path.getsize(path) / 1e6
+        storage.configure(os.path.join(tmp, "import.db"), "single")
+        storage.init_db()
+        for user in (USER, OLD_PATH_USER, NEIGHBOUR):
+            storage.ensure_user(user)
+
+        added, again = asyncio.run(run(path, rows, size, chunk))
+
+        drift = storage.check_balances()
+        start, end = "2020-01-01", "2030-01-01"
+        same = all(
+            rounded(storage.get_category_stats(USER, start, end, t)) == rounded(storage.get_category_stats_raw(USER, start, end, t))
+            for t in ("expense", "income")
+        )
+        print(f"балансы сходятся: {not drift}, сводные таблицы сходятся: {same}")
+        print(f"пиковая память процесса: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} МБ")
+        storage.close_all()
+        if drift or not same or added != rows or again:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,98 @@
+# Reply-клавиатура против inline-меню: сколько вызовов Bot API и байт
+# запросов уходит на одно законченное действие. Каждый сценарий
+# повторяется на своём пользователе; в inline-режиме меню открыто
+# заранее (/menu — один sendMessage на всю сессию, считается отдельно).
+#
+#   python benchmarks/bench_inline.py [повторов]
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+
+SETUP = ["/start", "💱 Валюты", "➕ Добавить валюту", "RUB", "⬅️ Назад"]
+
+# (название, шаги в reply-режиме, шаги в inline-режиме); "!данные" — нажатие
+# inline-кнопки, {tag} — метка списка категорий
+FLOWS = [
+    ("расход", ["➕ Добавить", "💸 Расход", "🍔 Еда", "RUB", "250"], ["!c0~{tag}", "250"]),
+    ("доход", ["➕ Добавить", "💰 Доход", "RUB", "1000"], ["!i", "1000"]),
+    ("баланс", ["📊 Статистика", "💰 Баланс"], ["!b"]),
+    ("за месяц", ["📊 Статистика", "📊 Расходы по категориям (месяц)"], ["!s"]),
+]
+
+
+async def run(repeats):
+    import bot
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder
+    from fake_api import FakeBotAPI, callback_update, text_update
+
+    api = FakeBotAPI()
+    app = bot.build_application("1:FAKE", ApplicationBuilder().request(api).updater(None))
+    update_ids = iter(range(1, 1 << 30))
+    tag = bot.list_tag(tuple(storage.BASE_CATEGORIES))
+
+    async def send(user_id, step, menu_id=None):
+        if step.startswith("!"):
+            data = callback_update(next(update_ids), user_id, step[1:].format(tag=tag), menu_id)
+        else:
+            data = text_update(next(update_ids), user_id, step)
+        await app.process_update(Update.de_json(data, app.bot))
+
+    results = []
+    async with app:
+        await app.post_init(app)
+        for n, (name, reply_steps, inline_steps) in enumerate(FLOWS):
+            row = [name]
+            for mode, steps in (("reply", reply_steps), ("inline", inline_steps)):
+                user_id = 100 + n * 2 + (mode == "inline")
+                for step in SETUP:
+                    await send(user_id, step)
+                menu_id = None
+                if mode == "inline":
+                    api.reset()
+                    await send(user_id, "/menu")
+                    menu = (sum(api.calls.values()), sum(api.payload_bytes.values()))
+                    menu_id = api.last_message_id
+                api.reset()
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    for step in steps:
+                        await send(user_id, step, menu_id)
+                elapsed = (time.perf_counter() - start) / repeats
+                row += [len(steps), sum(api.calls.values()) / repeats,
+                        sum(api.payload_bytes.values()) / repeats, elapsed,
+                        {method: count // repeats for method, count in api.calls.items()}]
+            results.append(row)
+        await app.post_shutdown(app)
+    return results, menu
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.configure(os.path.join(tmp, "inline.db"), "single")
+        storage.init_db()
+        results, menu = asyncio.run(run(repeats))
+        storage.close_all()
+
+    print(f"{'действие':>10} | {'апдейтов':>9} | {'вызовов API':>12} | {'байт запросов':>14} | {'мс':>11}")
+    print(f"{'':>10} | {'reply/inl':>9} | {'reply/inl':>12} | {'reply/inl':>14} | {'reply/inl':>11}")
+    for name, r_steps, r_calls, r_bytes, r_time, _, i_steps, i_calls, i_bytes, i_time, i_methods in results:
+        print(f"{name:>10} | {r_steps:>4}/{i_steps:<4} | {r_calls:>5.1f}/{i_calls:<6.1f} | "
+              f"{r_bytes:>6.0f}/{i_bytes:<7.0f} | {r_time * 1000:>5.2f}/{i_time * 1000:<5.2f}")
+    total = [sum(r[i] for r in results) for i in (2, 3, 7, 8)]
+    print(f"{'всего':>10} | {'':>9} | {total[0]:>5.1f}/{total[2]:<6.1f} | {total[1]:>6.0f}/{total[3]:<7.0f} | "
+          f"вызовов {(total[2] / total[0] - 1) * 100:+.0f}%, байт {(total[3] / total[1] - 1) * 100:+.0f}%")
+    print("inline-вызовы по методам: " + ", ".join(f"{r[0]}: {r[10]}" for r in results))
+    print(f"открыть /menu: {menu[0]} вызов, {menu[1]} байт (один раз на сессию)")
+
+
+if __name__ == "__main__":
+    main()
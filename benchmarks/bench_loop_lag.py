@@ -0,0 +1,64 @@
+# Задержка цикла событий при записи из обработчиков: прямой вызов
+# блокирующих хелперов против async-фасада с групповым коммитом.
+#
+#   python benchmarks/bench_loop_lag.py [чатов] [операций на чат]
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+from async_db import AsyncStorage, LoopLagMonitor
+
+
+async def chat_blocking(n):
+    for i in range(n):
+        storage.add_operation(1, "expense", i, "USD", "🍔 Еда")
+        storage.get_balance(1)
+        await asyncio.sleep(0)
+
+
+async def chat_async(adb, n):
+    for i in range(n):
+        await adb.write(storage.add_operation, 1, "expense", i, "USD", "🍔 Еда")
+        await adb.read(storage.get_balance, 1)
+
+
+async def measure(label, make_chat, chats, per_chat):
+    monitor = LoopLagMonitor(interval=0.005, report_every=0)
+    monitor.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(make_chat(per_chat) for _ in range(chats)))
+    elapsed = time.perf_counter() - start
+    await monitor.stop()
+    s = monitor.stats()
+    print(f"{label:<10} {chats * per_chat / elapsed:>8.0f} записей/с  "
+          f"lag p50={s['p50_ms']:.2f} мс p99={s['p99_ms']:.2f} мс max={s['max_ms']:.2f} мс")
+
+
+async def main():
+    chats = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    per_chat = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.configure(os.path.join(tmp, "blocking.db"), "single")
+        storage.init_db()
+        # тот же режим долговечности, что и у писателя фасада
+        storage.db.set_synchronous("FULL")
+        await measure("blocking", chat_blocking, chats, per_chat)
+        storage.close_all()
+
+        storage.configure(os.path.join(tmp, "async.db"), "single")
+        storage.init_db()
+        adb = AsyncStorage()
+        await adb.start()
+        await measure("async", lambda n: chat_async(adb, n), chats, per_chat)
+        await adb.stop()
+        storage.close_all()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,143 @@
+# Цена метрик: тот же поток апдейтов через весь бот и те же запросы к
+# storage без инструментирования и с ним (гистограммы обработчиков и
+# состояний, замер каждого SQL-запроса). Каждый прогон — в отдельном
+# процессе, режимы чередуются, берётся лучший из повторов.
+#
+#   python benchmarks/bench_metrics.py [пользователей] [повторов]
+
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+SCRIPT = ["/start", "💱 Валюты", "➕ Добавить валюту", "RUB", "⬅️ Назад",
+          "➕ Добавить", "💸 Расход", "🍔 Еда", "RUB", "250",
+          "➕ Добавить", "💰 Доход", "RUB", "1000",
+          "📅 История", "Месяц", "✏️ Редактировать", "1", "300",
+          "📊 Статистика", "💰 Баланс",
+          "📊 Статистика", "📊 Расходы по категориям (месяц)",
+          "-250 еда",
+          # inline-меню: категория кнопкой, потом сумма — её забирает
+          # inline_amount в группе -1 и завершает ApplicationHandlerStop
+          "/menu", "!c0", "77"]
+DB_CALLS = 20000
+
+
+async def bot_run(users, instrumented):
+    import bot
+    import metrics
+    import storage
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder
+    from fake_api import FakeBotAPI, callback_update, text_update
+
+    app = bot.build_application("1:FAKE", ApplicationBuilder().request(FakeBotAPI()).updater(None))
+    if instrumented:
+        metrics.instrument_application(app, bot.state_names(app.handlers[0][0].states))
+    tag = bot.list_tag(storage.BASE_CATEGORIES)
+
+    def make(update_id, user_id, text):
+        if text.startswith("!"):
+            return callback_update(update_id, user_id, f"{text[1:]}~{tag}", 1)
+        return text_update(update_id, user_id, text)
+    updates = [
+        Update.de_json(make(i * len(SCRIPT) + j + 1, 1000 + i, text), app.bot)
+        for i in range(users) for j, text in enumerate(SCRIPT)
+    ]
+    async with app:
+        await app.post_init(app)
+        start = time.perf_counter()
+        for update in updates:
+            await app.process_update(update)
+        elapsed = time.perf_counter() - start
+        scrape = None
+        if instrumented:
+            # сумма из inline-меню записана (значит, inline_amount дошёл до
+            # ApplicationHandlerStop), и это не посчитано как ошибка
+            with storage.db.read() as conn:
+                inline = conn.execute("SELECT COUNT(*) FROM operations WHERE amount = 77").fetchone()[0]
+            assert inline == users, inline
+            assert not metrics.HANDLER_ERRORS.values, metrics.HANDLER_ERRORS.values
+            server = metrics.MetricsServer(port=0)
+            await server.start()
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            t = time.perf_counter()
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            body = await reader.read()
+            scrape = (time.perf_counter() - t, len(body))
+            writer.close()
+            await server.stop()
+        await app.post_shutdown(app)
+    return elapsed / len(updates), scrape
+
+
+def db_run():
+    import storage
+    storage.ensure_user(1)
+    start = time.perf_counter()
+    for i in range(DB_CALLS // 2):
+        storage.add_operation(1, "expense", i % 500, "RUB", "🍔 Еда")
+        storage.get_operations_page(1, "2000-01-01", "2100-01-01")
+    per_call = (time.perf_counter() - start) / DB_CALLS
+    # самый дешёвый запрос — здесь доля замера наибольшая
+    with storage.db.read() as conn:
+        start = time.perf_counter()
+        for _ in range(DB_CALLS):
+            conn.execute("SELECT amount FROM balances WHERE user_id = ? AND currency = ?", (1, "RUB")).fetchone()
+        per_statement = (time.perf_counter() - start) / DB_CALLS
+    return per_call, per_statement
+
+
+def child(users, instrumented):
+    import storage
+    import metrics
+    with tempfile.TemporaryDirectory() as tmp:
+        if instrumented:
+            metrics.instrument_storage()
+        storage.configure(os.path.join(tmp, "metrics.db"), "single")
+        storage.init_db()
+        per_update, scrape = asyncio.run(bot_run(users, instrumented))
+        per_call, per_statement = db_run()
+        storage.close_all()
+    line = f"{per_update} {per_call} {per_statement}"
+    if scrape:
+        line += f" {scrape[0]} {scrape[1]}"
+    print(line)
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    best = {False: [float("inf")] * 3, True: [float("inf")] * 3}
+    scrape = None
+    for _ in range(rounds):
+        for instrumented in (False, True):
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", str(users), str(int(instrumented))],
+                capture_output=True, text=True, check=True,
+            ).stdout.split()
+            values = list(map(float, out))
+            best[instrumented] = [min(a, b) for a, b in zip(best[instrumented], values[:3])]
+            if instrumented:
+                scrape = values[3:]
+    (bot_off, db_off, sql_off), (bot_on, db_on, sql_on) = best[False], best[True]
+    print(f"апдейт через бот ({users} пользователей × {len(SCRIPT)} сообщений): "
+          f"{bot_off * 1e6:.0f} мкс без метрик, {bot_on * 1e6:.0f} мкс с метриками ({(bot_on / bot_off - 1) * 100:+.1f}%)")
+    print(f"вызов storage ({DB_CALLS}): "
+          f"{db_off * 1e6:.1f} мкс без метрик, {db_on * 1e6:.1f} мкс с метриками ({(db_on / db_off - 1) * 100:+.1f}%)")
+    print(f"точечный SELECT: {sql_off * 1e6:.1f} мкс без метрик, {sql_on * 1e6:.1f} мкс с метриками "
+          f"(+{(sql_on - sql_off) * 1e6:.1f} мкс на запрос)")
+    if scrape:
+        print(f"/metrics: {scrape[1] / 1024:.0f} КБ за {scrape[0] * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        sys.path.insert(0, os.path.dirname(__file__))
+        child(int(sys.argv[2]), sys.argv[3] == "1")
+    else:
+        main()
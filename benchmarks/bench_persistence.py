@@ -0,0 +1,93 @@
+# Стоимость SQLitePersistence на большом числе сохранённых диалогов:
+# время "рестарта" (загрузка состояний + первый апдейт пользователя) и
+# время сброса пачки изменившихся ключей.
+#
+#   python benchmarks/bench_persistence.py [диалогов] [изменённых ключей]
+
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+from persistence import SQLitePersistence
+
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    dirty = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.configure(os.path.join(tmp, "persist.db"), "single")
+        storage.init_db()
+
+        p = SQLitePersistence()
+        start = time.perf_counter()
+        for user_id in range(total):
+            await p.update_conversation("main", (user_id, user_id), 0)
+            await p.update_user_data(user_id, {"history_ids": [1, 2, 3], "type": "expense"})
+        await p.flush()
+        print(f"заполнение: {total} диалогов за {time.perf_counter() - start:.2f} с")
+
+        # рестарт: новый объект, состояния диалогов и первый апдейт
+        p = SQLitePersistence()
+        start = time.perf_counter()
+        conversations = await p.get_conversations("main")
+        await p.get_user_data()
+        loaded = time.perf_counter()
+        user_data = {}
+        await p.refresh_user_data(total // 2, user_data)
+        first = time.perf_counter()
+        print(f"рестарт: get_conversations {len(conversations)} ключей за {(loaded - start) * 1000:.1f} мс, "
+              f"первый refresh_user_data {(first - loaded) * 1000:.3f} мс ({user_data})")
+
+        # user_data читается в пуле adb: апдейты, пришедшие во время чтения,
+        # ждут ту же загрузку и видят данные
+        user_data = {}
+        await asyncio.gather(*(p.refresh_user_data(total // 3, user_data) for _ in range(10)))
+        assert user_data == {"history_ids": [1, 2, 3], "type": "expense"}, user_data
+        start = time.perf_counter()
+        await asyncio.gather(*(p.refresh_user_data(user_id, {}) for user_id in range(dirty)))
+        elapsed = time.perf_counter() - start
+        print(f"refresh_user_data {dirty} пользователей сразу: {elapsed * 1000:.1f} мс")
+
+        # сброс: одна пачка изменившихся ключей, как после update_persistence
+        start = time.perf_counter()
+        for user_id in range(dirty):
+            await p.update_conversation("main", (user_id, user_id), 3)
+            await p.update_user_data(user_id, {"edit_op_id": user_id})
+        await asyncio.sleep(0)
+        await p.flush()
+        elapsed = time.perf_counter() - start
+        print(f"сброс: {dirty} диалогов и user_data за {elapsed * 1000:.1f} мс "
+              f"({elapsed / dirty * 1e6:.1f} мкс на ключ)")
+
+        # запись не удалась (база занята): пачка возвращается и пишется
+        # повтором, а более новое значение ключа старым не затирается
+        p = SQLitePersistence()
+        failures = [sqlite3.OperationalError("database is locked")]
+
+        def flaky(batch):
+            if failures:
+                raise failures.pop()
+            SQLitePersistence._write(batch)
+        p._write = flaky
+        await p.update_user_data(1, {"type": "old"})
+        await p.update_user_data(2, {"type": "lost?"})
+        await asyncio.sleep(0.01)
+        await p.update_user_data(1, {"type": "new"})
+        await p.flush()
+        p = SQLitePersistence()
+        for user_id, want in ((1, "new"), (2, "lost?")):
+            user_data = {}
+            await p.refresh_user_data(user_id, user_data)
+            assert user_data == {"type": want}, (user_id, user_data)
+        print("неудачная запись повторена, новые значения не затёрты — ок")
+        storage.close_all()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+# Быстрый ввод: время разбора одного сообщения и построения индекса, и
+# сравнение с обычным добавлением через меню — апдейты, вызовы Bot API и
+# общее время на одну операцию через весь бот с FakeBotAPI.
+#
+#   python benchmarks/bench_quick_entry.py [сообщений] [операций через бот]
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+from quick_entry import QuickIndex
+
+CURRENCIES = ("RUB", "USD", "EUR")
+WORDS = ["еда", "такси", "кафе", "кино", "аптека", "транспорт", "покупки", "usd", "eur", "руб", "зарплата", "кофе"]
+
+
+def messages(count, rng):
+    result = []
+    for _ in range(count):
+        words = rng.sample(WORDS, rng.randint(0, 3))
+        amount = f"{rng.choice(['-', '+', ''])}{rng.randint(1, 99999)}{rng.choice(['', ',50', '.5'])}"
+        words.insert(rng.randint(0, len(words)), amount)
+        result.append(" ".join(words))
+    return result
+
+
+def bench_parse(count):
+    rng = random.Random(1)
+    categories = tuple(storage.BASE_CATEGORIES) + tuple(f"Категория {i}" for i in range(30))
+    start = time.perf_counter()
+    for _ in range(1000):
+        index = QuickIndex(categories, CURRENCIES)
+    build = (time.perf_counter() - start) / 1000
+    texts = messages(count, rng)
+    start = time.perf_counter()
+    for text in texts:
+        try:
+            index.parse(text)
+        except ValueError:
+            pass
+    parse = (time.perf_counter() - start) / count
+    print(f"индекс ({len(categories)} категорий, {len(index.prefixes)} префиксов): {build * 1e6:.0f} мкс на сборку")
+    print(f"разбор: {parse * 1e6:.2f} мкс на сообщение ({count} сообщений)")
+
+
+async def bench_bot(operations):
+    import bot
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder
+    from fake_api import FakeBotAPI, text_update
+
+    api = FakeBotAPI()
+    app = bot.build_application("1:FAKE", ApplicationBuilder().request(api).updater(None))
+    update_ids = iter(range(1, 1 << 30))
+
+    async def send(user_id, text):
+        await app.process_update(Update.de_json(text_update(next(update_ids), user_id, text), app.bot))
+
+    flows = {
+        "меню": ["➕ Добавить", "💸 Расход", "🍔 Еда", "USD", "250"],
+        "одной строкой": ["-250 еда usd"],
+    }
+    async with app:
+        await app.post_init(app)
+        for user_id, flow in enumerate(flows, start=1):
+            for text in ["/start", "💱 Валюты", "➕ Добавить валюту", "USD", "⬅️ Назад"]:
+                await send(user_id, text)
+            api.reset()
+            start = time.perf_counter()
+            for _ in range(operations):
+                for text in flows[flow]:
+                    await send(user_id, text)
+            elapsed = (time.perf_counter() - start) / operations
+            calls = sum(api.calls.values()) / operations
+            ops = len(storage.get_operations_page(user_id, "2000-01-01", "2100-01-01", limit=operations * 2)[0])
+            print(f"{flow:>14}: {len(flows[flow])} апдейтов, {calls:.0f} вызовов API, "
+                  f"{elapsed * 1000:.2f} мс на операцию (записано {ops})")
+        await app.post_shutdown(app)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    operations = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    bench_parse(count)
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.configure(os.path.join(tmp, "quick.db"), "single")
+        storage.init_db()
+        asyncio.run(bench_bot(operations))
+        storage.close_all()
+
+
+if __name__ == "__main__":
+    main()
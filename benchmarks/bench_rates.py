@@ -0,0 +1,114 @@
+# Сводная статистика в одной валюте: миллион операций в четырёх валютах
+# за три года и ежедневные курсы (EUR→RUB — кросс-курс через USD).
+# Сравнивается пересчёт по дневным суммам из daily_totals, векторный
+# пересчёт каждой операции и поштучный bisect в цикле.
+#
+#   python benchmarks/bench_rates.py [операций]
+
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import rates
+import storage
+
+USER = 7
+BASE = "RUB"
+DAYS = 3 * 365
+FIRST = date(2021, 1, 1)
+START, END = FIRST.isoformat(), (FIRST + timedelta(days=DAYS)).isoformat()
+
+
+def fill(total):
+    with storage.db.write() as conn:
+        conn.execute("""
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+            INSERT INTO operations (user_id, type, amount, currency, category, date)
+            SELECT ?, 'expense', (i * 7919) % 10000 / 100.0,
+                   CASE i % 4 WHEN 0 THEN 'RUB' WHEN 1 THEN 'USD' WHEN 2 THEN 'EUR' ELSE 'CNY' END,
+                   CASE i % 3 WHEN 0 THEN '🍔 Еда' WHEN 1 THEN '🚕 Транспорт' ELSE '🛒 Покупки' END,
+                   date(?, '+' || (i * ? / ?) || ' days')
+            FROM n
+        """, (total, USER, START, DAYS, total + 1))
+        storage._rebuild_aggregates(conn)
+    rnd = random.Random(1)
+    rows = []
+    for pair, level in ((("USD", "RUB"), 75.0), (("EUR", "USD"), 1.1), (("CNY", "RUB"), 11.5)):
+        for d in range(DAYS):
+            level *= 1 + rnd.uniform(-0.01, 0.01)
+            rows.append((*pair, (FIRST + timedelta(days=d)).isoformat(), level))
+    storage.save_rates(rows)
+    rates.reload_rates()
+
+
+def load_operations():
+    columns = {}
+    with storage.db.read() as conn:
+        for currency in ("RUB", "USD", "EUR", "CNY"):
+            rows = conn.execute(f"""
+                SELECT {storage.ORDINAL_SQL.format("date")}, category, amount FROM operations
+                WHERE user_id = ? AND currency = ? AND type = 'expense' AND date >= ? AND date < ?
+            """, (USER, currency, START, END)).fetchall()
+            days, cats, amounts = zip(*rows)
+            names, codes = np.unique(np.array(cats), return_inverse=True)
+            columns[currency] = (np.array(days), names, codes, np.array(amounts))
+    return columns
+
+
+def per_operation(columns, vectorized):
+    totals = {}
+    table = rates.get_rates()
+    for currency, (days, names, codes, amounts) in columns.items():
+        if vectorized:
+            converted = rates.convert(currency, BASE, days, amounts)
+        else:
+            converted = np.array([a * (table.rate(currency, BASE, int(d)) if currency != BASE else 1.0)
+                                  for d, a in zip(days.tolist(), amounts.tolist())])
+        for name, value in zip(names, np.bincount(codes, weights=converted)):
+            totals[name] = totals.get(name, 0.0) + float(value)
+    return totals
+
+
+def timed(fn):
+    begin = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - begin) * 1000
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.configure(os.path.join(tmp, "rates.db"), "single")
+        storage.init_db()
+        fill(total)
+
+        (stats, missing), ms = timed(lambda: rates.consolidated_stats(USER, START, END, BASE))
+        print(f"{total} операций; сводная статистика по daily_totals: {ms:.1f} мс, без курса: {missing or 'нет'}")
+        _, ms = timed(lambda: rates.consolidated_balance(USER, BASE))
+        print(f"сводный баланс: {ms:.1f} мс")
+
+        columns, ms = timed(load_operations)
+        print(f"чтение {total} операций в массивы: {ms:.0f} мс")
+        vector, ms = timed(lambda: per_operation(columns, True))
+        print(f"векторный пересчёт каждой операции: {ms:.1f} мс")
+        scalar, ms = timed(lambda: per_operation(columns, False))
+        print(f"поштучный bisect в цикле: {ms:.0f} мс")
+
+        ok = all(
+            np.isclose(dict(stats)[cat], vector[cat]) and np.isclose(vector[cat], scalar[cat])
+            for cat in vector
+        )
+        print(f"результаты совпадают: {ok}")
+        storage.close_all()
+        return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
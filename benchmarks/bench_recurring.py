@@ -0,0 +1,255 @@
+# Регулярные операции: догон после долгого перерыва и цена чтения.
+#
+# Сначала проверки: месячное правило на 31-е, дата окончания, удалённое
+# повторение не возвращается, одновременные чтения из потоков и из
+# нескольких процессов записывают каждое повторение ровно один раз,
+# остатки и сводные таблицы сходятся с операциями.
+#
+# Потом замеры: у пользователей правила «кофе каждый день», «подписка
+# каждую неделю» и «зарплата каждый месяц», начатые N лет назад, — столько
+# они не заходили в бот. Первое чтение после перерыва (баланс) догоняет
+# всё одной пачкой; для сравнения — те же повторения по одному через
+# add_operation, как их писал бы ежедневный cron. Дальше — цена чтения,
+# когда догонять нечего, и сводка по странице подписчиков, у каждого из
+# которых есть что догнать.
+#
+#   python benchmarks/bench_recurring.py [пользователей в сводке] [процессов]
+
+import calendar
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+
+YEARS = [1, 3, 10]
+DIGEST_IDLE_DAYS = 30
+RULES = [
+    ("expense", 250.0, "🍔 Еда", "кофе", "day"),
+    ("expense", 799.0, "🎮 Развлечения", "подписка", "week"),
+    ("income", 50000.0, None, "зарплата", "month"),
+]
+
+
+def add_rules(user_id, start):
+    storage.ensure_user(user_id)
+    storage.add_currency(user_id, "RUB")
+    for op_type, amount, category, note, period in RULES:
+        storage.add_recurring(user_id, op_type, amount, "RUB", category, note, period, start)
+
+
+def occurrences(period, start, until, end):
+    days, day = [], start
+    while day < end and (until is None or day <= until):
+        days.append(day)
+        day = storage.next_occurrence(period, start, day)
+    return days
+
+
+def count(user_id):
+    with storage.db_for(user_id).read() as conn:
+        return conn.execute("SELECT COUNT(*) FROM operations WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+def expected_count(start, today):
+    end = (today + timedelta(days=1)).isoformat()
+    return sum(len(occurrences(period, start, None, end)) for *_, period in RULES)
+
+
+# ---------- Проверки ----------
+def check_rules(today):
+    user = 100
+    storage.ensure_user(user)
+    storage.add_currency(user, "RUB")
+    # 31-е число месяца больше года назад
+    start = storage.month_start(today - timedelta(days=400))
+    while calendar.monthrange(start.year, start.month)[1] < 31:
+        start = storage.next_month(start)
+    start = start.replace(day=31)
+    monthly = storage.add_recurring(user, "income", 1000.0, "RUB", None, "аренда", "month", start.isoformat())
+    until = (today - timedelta(days=10)).isoformat()
+    weekly = storage.add_recurring(user, "expense", 10.0, "RUB", "🍔 Еда", None, "week", (today - timedelta(days=60)).isoformat(), until)
+    future = storage.add_recurring(user, "expense", 5.0, "RUB", None, None, "day", (today + timedelta(days=3)).isoformat())
+
+    # статистика за прошлый месяц догоняет только до его конца
+    first = storage.month_start(today)
+    prev = storage.month_start(first - timedelta(days=1))
+    storage.get_category_stats(user, prev.isoformat(), first.isoformat())
+    with storage.db_for(user).read() as conn:
+        assert conn.execute("SELECT MAX(date) FROM operations WHERE user_id = ?", (user,)).fetchone()[0] < first.isoformat()
+
+    storage.get_balance(user)
+    end = (today + timedelta(days=1)).isoformat()
+    with storage.db_for(user).read() as conn:
+        by_rule = {}
+        for h, d in conn.execute("SELECT import_hash, date FROM operations WHERE user_id = ? ORDER BY date", (user,)):
+            by_rule.setdefault(int(h.split(":")[1]), []).append(d)
+    assert by_rule[monthly] == occurrences("month", start.isoformat(), None, end)
+    # 31-е в коротких месяцах — последний день месяца, потом снова 31-е
+    for d in by_rule[monthly]:
+        day = date.fromisoformat(d)
+        last = (storage.next_month(day) - timedelta(days=1)).day
+        assert day.day == min(start.day, last), d
+    assert by_rule[weekly][-1] <= until and len(by_rule[weekly]) == len(occurrences("week", by_rule[weekly][0], until, end))
+    assert future not in by_rule
+
+    # удалённое повторение не возвращается, правило после until закончено
+    op_id = storage.get_operations_between(user, by_rule[monthly][-1], end)[0][0]
+    storage.delete_operation(user, op_id)
+    storage._recurring_next.clear()
+    storage.get_balance(user)
+    assert count(user) == sum(map(len, by_rule.values())) - 1
+    rules = {r[0]: r for r in storage.get_recurring(user)}
+    assert rules[weekly][9] is None and rules[future][9] > end
+
+    # clear_db удаляет и правила
+    storage.clear_db(user)
+    storage.get_balance(user)
+    assert count(user) == 0 and storage.get_recurring(user) == []
+    print("проверки правил: 31-е число, дата окончания, будущие повторения, удаление — ок")
+
+
+def check_threads(today, threads=16):
+    user = 200
+    start = (today - timedelta(days=365 * 3)).isoformat()
+    add_rules(user, start)
+    barrier = threading.Barrier(threads)
+    errors = []
+
+    def reader(i):
+        try:
+            barrier.wait()
+            [storage.get_balance, lambda u: storage.get_category_stats(u, start, today.isoformat()),
+             lambda u: storage.get_operations_page(u, start, today.isoformat())][i % 3](user)
+        except Exception as e:
+            errors.append(e)
+
+    workers = [threading.Thread(target=reader, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    assert not errors, errors
+    assert count(user) == expected_count(start, today), (count(user), expected_count(start, today))
+    print(f"{threads} одновременных чтений в потоках: {count(user)} операций, каждое повторение один раз — ок")
+
+
+def _process_reader(path, user, barrier, result):
+    storage.configure(path, "single")
+    barrier.wait()
+    result.put(storage.catch_up(user))
+    storage.close_all()
+
+
+def check_processes(path, today, processes):
+    user = 300
+    start = (today - timedelta(days=365 * 3)).isoformat()
+    add_rules(user, start)
+    storage.close_all()
+    ctx = multiprocessing.get_context("spawn")
+    barrier, result = ctx.Barrier(processes), ctx.Queue()
+    procs = [ctx.Process(target=_process_reader, args=(path, user, barrier, result)) for _ in range(processes)]
+    for p in procs:
+        p.start()
+    added = sorted(result.get() for _ in procs)
+    for p in procs:
+        p.join()
+    storage.configure(path, "single")
+    assert count(user) == expected_count(start, today) == sum(added), (count(user), added)
+    print(f"{processes} процессов догоняют одного пользователя: записал один ({added[-1]}), остальные {added[:-1]} — ок")
+
+
+def check_aggregates(users):
+    assert storage.check_balances() == []
+    for user in users:
+        got = sorted(storage.get_category_stats(user, "2000-01-01", "2100-01-01"))
+        raw = sorted(storage.get_category_stats_raw(user, "2000-01-01", "2100-01-01"))
+        assert [(c or "", cur, round(a, 6)) for c, cur, a in got] == [(c or "", cur, round(a, 6)) for c, cur, a in raw]
+    print("остатки и сводные таблицы сходятся с операциями — ок")
+
+
+# ---------- Замеры ----------
+def bench_catch_up(today):
+    for years in YEARS:
+        start = (today - timedelta(days=365 * years)).isoformat()
+        lazy_user, cron_user = 1000 + years, 2000 + years
+        add_rules(lazy_user, start)
+        storage.get_all_currencies(lazy_user)
+        began = time.perf_counter()
+        storage.get_balance(lazy_user)
+        lazy = time.perf_counter() - began
+        n = count(lazy_user)
+        assert n == expected_count(start, today)
+
+        storage.ensure_user(cron_user)
+        began = time.perf_counter()
+        for op_type, amount, category, note, period in RULES:
+            for day in occurrences(period, start, None, (today + timedelta(days=1)).isoformat()):
+                storage.add_operation(cron_user, op_type, amount, "RUB", category, day, note)
+        cron = time.perf_counter() - began
+
+        reads = 10000
+        began = time.perf_counter()
+        for _ in range(reads):
+            storage.catch_up(lazy_user)
+        check = (time.perf_counter() - began) / reads
+        print(f"перерыв {years:>2} г.: {n:>5} повторений, первое чтение догоняет за {lazy * 1000:6.1f} мс "
+              f"(по одной через add_operation — {cron * 1000:7.1f} мс); проверка без догона {check * 1e6:.2f} мкс")
+
+
+def bench_digest(users, today):
+    shard = 0
+    first = 10_000
+    start = (today - timedelta(days=DIGEST_IDLE_DAYS)).isoformat()
+    for user in range(first, first + users):
+        storage.ensure_user(user)
+        storage.add_recurring(user, "expense", 250.0, "RUB", "🍔 Еда", "кофе", "day", start)
+        storage.set_digest_subscriptions(user, ["day"])
+    began = time.perf_counter()
+    subscribers, totals = storage.get_digest_page(shard, "day", *storage.period_bounds("day", today - timedelta(days=1)),
+                                                 first - 1, users)
+    elapsed = time.perf_counter() - began
+    assert len({row[0] for row in totals}) == users
+    began = time.perf_counter()
+    storage.get_digest_page(shard, "day", *storage.period_bounds("day", today - timedelta(days=1)), first - 1, users)
+    again = time.perf_counter() - began
+    print(f"сводка за вчера, {users} подписчиков с правилом «каждый день», {DIGEST_IDLE_DAYS} дней без входа: "
+          f"первая страница {elapsed * 1000:.0f} мс (догон {users * DIGEST_IDLE_DAYS} повторений), "
+          f"повторная {again * 1000:.1f} мс")
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    today = date.today()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "recurring.db")
+        storage.configure(path, "single")
+        storage.init_db()
+        check_rules(today)
+        check_threads(today)
+        check_processes(path, today, processes)
+
+        # пользователи с правилами, которые не заходят, ничего не стоят:
+        # ни одной операции, пока их данные никто не читает
+        idle = range(50_000, 60_000)
+        for user in idle:
+            storage.add_recurring(user, "expense", 250.0, "RUB", None, None, "day", "2020-01-01")
+        with storage.db.read() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM operations WHERE user_id >= 50000").fetchone()[0] == 0
+        print(f"{len(idle)} пользователей с правилами без входа: 0 записанных операций")
+
+        bench_catch_up(today)
+        bench_digest(users, today)
+        check_aggregates([200, 300, 1001, 1003, 1010])
+        storage.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# Случайные добавления, правки и удаления, после чего статистика из
+# сводных таблиц сверяется с агрегацией по operations на случайных
+# периодах; заодно сравнивается время обоих вариантов.
+#
+#   python benchmarks/bench_rollups.py [операций] [seed]
+
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+
+CATEGORIES = ["🍔 Еда", "🚕 Транспорт", "🎮 Развлечения", None]
+CURRENCIES = ["USD", "EUR", "RUB"]
+USERS = [1, 2, 3]
+FIRST_DAY = date(2022, 1, 1)
+
+
+def random_day(rng):
+    return (FIRST_DAY + timedelta(days=rng.randrange(3 * 365))).isoformat()
+
+
+def same(a, b):
+    a = {(cat, cur): total for cat, cur, total in a}
+    b = {(cat, cur): total for cat, cur, total in b}
+    return a.keys() == b.keys() and all(abs(a[k] - b[k]) < 1e-6 * max(1, abs(b[k])) for k in a)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rng = random.Random(int(sys.argv[2]) if len(sys.argv) > 2 else 1)
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.configure(os.path.join(tmp, "rollups.db"), "single")
+        storage.init_db()
+        ids = []
+        for _ in range(n):
+            action = rng.random()
+            if action < 0.8 or not ids:
+                op_type = rng.choice(["income", "expense"])
+                user_id = rng.choice(USERS)
+                op_id = storage.add_operation(user_id, op_type, round(rng.uniform(1, 1000), 2),
+                                              rng.choice(CURRENCIES), rng.choice(CATEGORIES), random_day(rng))
+                ids.append((user_id, op_id))
+            elif action < 0.9:
+                storage.update_operation_amount(*rng.choice(ids), round(rng.uniform(1, 1000), 2))
+            else:
+                storage.delete_operation(*ids.pop(rng.randrange(len(ids))))
+
+        fast = slow = 0.0
+        checks = 500
+        for _ in range(checks):
+            a, b = sorted([random_day(rng), random_day(rng)])
+            op_type = rng.choice(["income", "expense"])
+            user_id = rng.choice(USERS)
+            t0 = time.perf_counter()
+            rolled = storage.get_category_stats(user_id, a, b, op_type)
+            t1 = time.perf_counter()
+            raw = storage.get_category_stats_raw(user_id, a, b, op_type)
+            t2 = time.perf_counter()
+            fast += t1 - t0
+            slow += t2 - t1
+            if not same(rolled, raw):
+                print(f"Расхождение у {user_id} на [{a}, {b}) {op_type}:\n  {rolled}\n  {raw}")
+                return 1
+        print(f"{checks} периодов совпали, операций в базе: {len(ids)}")
+        print(f"сводные таблицы: {fast / checks * 1000:.3f} мс, operations: {slow / checks * 1000:.3f} мс на запрос")
+        drift = storage.check_balances()
+        if drift:
+            print(f"Расхождение остатков: {drift}")
+            return 1
+        storage.close_all()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,57 @@
+# Параллельные писатели разных пользователей: одна база против шардов.
+#
+#   python benchmarks/bench_shards.py [потоков] [записей на поток]
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+
+
+def writer(user_id, n):
+    for i in range(n):
+        storage.add_operation(user_id, "expense", i, "USD", "🍔 Еда")
+
+
+def measure(label, threads, per_thread):
+    # по одному пользователю на поток; в режиме sharded подбираем id так,
+    # чтобы они попали в разные файлы, как при реальном распределении
+    users, seen = [], set()
+    candidate = 1
+    while len(users) < threads:
+        index = storage.shard_index(candidate, len(storage.shards))
+        if index not in seen or len(seen) == len(storage.shards):
+            seen.add(index)
+            users.append(candidate)
+        candidate += 1
+    for s in storage.shards:
+        s.set_synchronous("FULL")
+
+    workers = [threading.Thread(target=writer, args=(u, per_thread)) for u in users]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} {threads * per_thread / elapsed:>8.0f} записей/с")
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in ("single", "sharded"):
+            storage.configure(os.path.join(tmp, f"{backend}.db"), backend, threads)
+            storage.init_db()
+            measure(backend, threads, per_thread)
+            storage.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# Сравнение пула соединений из storage.py с прежним подходом
+# "sqlite3.connect на каждый вызов".
+#
+#   python benchmarks/bench_storage.py [количество операций]
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+
+
+def connect_per_call_insert(path, i):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO operations (type, amount, currency, category, date) VALUES (?, ?, ?, ?, ?)",
+        ("expense", i, "USD", "🍔 Еда", "2024-01-01")
+    )
+    conn.commit()
+    conn.close()
+
+
+def connect_per_call_read(path):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT code FROM currencies")
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+def storage_read():
+    with storage.db.read() as conn:
+        return conn.execute("SELECT code FROM currencies").fetchall()
+
+
+# Справочники из кэша: каждое сотое обращение после добавления валюты,
+# которое сбрасывает кэш пользователя, — остальные должны быть попаданиями.
+def cached_read(i):
+    if i % 100 == 0:
+        storage.add_currency(1, f"C{i}")
+    return storage.get_all_currencies(1)
+
+
+def run(label, fn, n):
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {n / elapsed:>10.0f} оп/с")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with tempfile.TemporaryDirectory() as tmp:
+        old_path = os.path.join(tmp, "old.db")
+        storage.configure(old_path, "single")
+        storage.init_db()
+        # прежний вариант работал в журнале по умолчанию
+        storage.close_all()
+        conn = sqlite3.connect(old_path)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.close()
+
+        run("connect-per-call insert", lambda i: connect_per_call_insert(old_path, i), n)
+        run("connect-per-call read", lambda i: connect_per_call_read(old_path), n)
+
+        storage.configure(os.path.join(tmp, "new.db"), "single")
+        storage.init_db()
+        run("storage insert", lambda i: storage.add_operation(1, "expense", i, "USD", "🍔 Еда"), n)
+        run("storage read", lambda i: storage_read(), n)
+        before = storage.get_ref_cache_stats()
+        run("storage cached read", cached_read, n)
+        after = storage.get_ref_cache_stats()
+        hits, misses = after["hits"] - before["hits"], after["misses"] - before["misses"]
+        print(f"кэш справочников: {hits} попаданий, {misses} промахов ({hits / (hits + misses):.1%})")
+        assert hits + misses == n and hits / n >= 0.98, (hits, misses)
+        storage.close_all()
+
+
+if __name__ == "__main__":
+    main()
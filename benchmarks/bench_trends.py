@@ -0,0 +1,130 @@
+# Тренды для пользователей с длинной историей: расчёт без кэша (чтение
+# окна daily_totals и расчёт в NumPy), попадание в кэш, текст и ответ
+# на «📈 Тренды» через весь бот. Заодно итоги месяца сверяются с
+# get_category_stats, а кэш — с записью новой операции.
+#
+#   python benchmarks/bench_trends.py [операций в день] [повторов]
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+import trends
+
+YEARS = [1, 3, 5, 10]
+CURRENCIES = ["RUB", "RUB", "RUB", "USD", "EUR"]
+CATEGORIES = storage.BASE_CATEGORIES + [f"Категория {i}" for i in range(14)]
+
+
+def populate(user_id, years, per_day, rng):
+    today = date.today()
+    first = today - timedelta(days=365 * years)
+    storage.ensure_user(user_id)
+
+    def rows():
+        day = first
+        while day <= today:
+            for i in range(rng.randint(0, per_day * 2)):
+                amount = rng.lognormvariate(6, 1)
+                yield "expense", round(amount, 2), rng.choice(CURRENCIES), rng.choice(CATEGORIES), day.isoformat(), f"{day}:{i}"
+            day += timedelta(days=1)
+
+    return storage.import_operations(user_id, rows())[0]
+
+
+def best(fn, repeats):
+    result = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        result = min(result, time.perf_counter() - start)
+    return result
+
+
+def check(user_id, result):
+    start, end = storage.period_bounds("month")
+    expected = {}
+    for cat, cur, total in storage.get_category_stats(user_id, start, end):
+        expected[(cat, cur)] = total
+    got = {(s.category, s.currency): s.month for s in result.series if not s.total and s.month}
+    assert expected.keys() == got.keys(), (expected.keys() ^ got.keys())
+    for key, total in expected.items():
+        assert abs(got[key] - total) < 1e-6 * max(1, total), (key, got[key], total)
+
+
+async def bot_latency(user_ids, repeats):
+    import bot
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder
+    from fake_api import FakeBotAPI, text_update
+
+    app = bot.build_application("1:FAKE", ApplicationBuilder().request(FakeBotAPI()).updater(None))
+    update_ids = iter(range(1, 1 << 30))
+    result = {}
+    async with app:
+        await app.post_init(app)
+        for user_id in user_ids:
+            await app.process_update(Update.de_json(text_update(next(update_ids), user_id, "/start"), app.bot))
+            timings = []
+            for i in range(repeats):
+                if i % 2 == 0:
+                    # запись сбрасывает кэш — чётные замеры считают заново
+                    await bot.adb.write(storage.add_operation, user_id, "expense", 1.0, "RUB", "🍔 Еда")
+                for text in ("📊 Статистика", "📈 Тренды"):
+                    start = time.perf_counter()
+                    await app.process_update(Update.de_json(text_update(next(update_ids), user_id, text), app.bot))
+                timings.append(time.perf_counter() - start)
+            result[user_id] = (max(timings[0::2]), max(timings[1::2]))
+        await app.post_shutdown(app)
+    return result
+
+
+def main():
+    per_day = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.configure(os.path.join(tmp, "trends.db"), "single")
+        storage.init_db()
+        users = {}
+        for user_id, years in enumerate(YEARS, start=1):
+            users[user_id] = (years, populate(user_id, years, per_day, rng))
+
+        for user_id, (years, ops) in users.items():
+            with storage.db.read() as conn:
+                buckets = conn.execute("SELECT COUNT(*) FROM daily_totals WHERE user_id = ?", (user_id,)).fetchone()[0]
+            result = trends.load(user_id)
+            check(user_id, result)
+            window = ((date.today() - timedelta(days=trends.WINDOW_DAYS - 1)).isoformat(),
+                      (date.today() + timedelta(days=1)).isoformat())
+            rows = storage.get_daily_totals_iso(user_id, *window)
+            query = best(lambda: storage.get_daily_totals_iso(user_id, *window), repeats)
+            numpy_part = best(lambda: trends.compute(rows, date.today()), repeats)
+            cold = best(lambda: trends.load(user_id), repeats)
+            trends.get_trends(user_id)
+            hit = best(lambda: trends.get_trends(user_id), repeats)
+            text = best(lambda: trends.render(result), repeats)
+            version = storage.data_version(user_id)
+            storage.add_operation(user_id, "expense", 1.0, "RUB", "🍔 Еда")
+            assert storage.data_version(user_id) != version
+            assert trends.get_trends(user_id) is not result
+            print(f"{years:>2} г., {ops:>6} операций, {buckets:>6} дневных сумм: "
+                  f"без кэша {cold * 1000:.1f} мс (SQL {query * 1000:.1f}, NumPy {numpy_part * 1000:.1f}), "
+                  f"из кэша {hit * 1e6:.1f} мкс, текст {text * 1e6:.0f} мкс")
+
+        latency = asyncio.run(bot_latency(list(users), repeats))
+        for user_id, (fresh, cached) in latency.items():
+            print(f"«📈 Тренды» через бот, {users[user_id][0]:>2} г.: худший ответ "
+                  f"{fresh * 1000:.1f} мс после записи, {cached * 1000:.1f} мс из кэша")
+        storage.close_all()
+
+
+if __name__ == "__main__":
+    main()
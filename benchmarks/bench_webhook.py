@@ -0,0 +1,89 @@
+# Нагрузочный драйвер для webhook-режима без сети: поднимает Application
+# с FakeBotAPI и WebhookServer на localhost, шлёт синтетические апдейты
+# по нескольким keep-alive соединениям и считает принятые апдейты в
+# секунду и p99 времени от отправки до обработчика.
+#
+#   python benchmarks/bench_webhook.py [апдейтов] [соединений]
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, TypeHandler
+
+from concurrency import ChatOrderedUpdateProcessor
+from fake_api import FakeBotAPI, text_update
+from webhook import WebhookServer
+
+SECRET = "bench-secret"
+
+
+async def sender(port, updates, sent_at, statuses):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for data in updates:
+        body = json.dumps(data).encode()
+        request = (
+            b"POST /telegram HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+            + f"X-Telegram-Bot-Api-Secret-Token: {SECRET}\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+        while True:
+            sent_at[data["update_id"]] = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            while (await reader.readline()) not in (b"\r\n", b""):
+                pass
+            statuses[status] = statuses.get(status, 0) + 1
+            if status != 503:
+                break
+            # как Telegram: повторить доставку чуть позже
+            await asyncio.sleep(0.01)
+    writer.close()
+
+
+async def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    connections = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    handled_at = {}
+
+    async def record(update, context):
+        handled_at[update.update_id] = time.perf_counter()
+
+    # тот же процессор апдейтов, что у бота: по нему приёмник считает очередь
+    app = (ApplicationBuilder().token("1:FAKE").request(FakeBotAPI()).updater(None)
+           .concurrent_updates(ChatOrderedUpdateProcessor()).build())
+    app.add_handler(TypeHandler(Update, record))
+    server = WebhookServer(app, listen="127.0.0.1", port=0, secret=SECRET, max_pending=5000)
+
+    async with app:
+        await app.start()
+        await server.start()
+        updates = [text_update(i, 1000 + i % 500, "➕ Добавить") for i in range(1, total + 1)]
+        sent_at, statuses = {}, {}
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            sender(server.port, updates[i::connections], sent_at, statuses) for i in range(connections)
+        ))
+        while len(handled_at) < server.accepted:
+            await asyncio.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        await server.stop()
+        await app.stop()
+
+    latencies = sorted(handled_at[i] - sent_at[i] for i in handled_at)
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"принято {server.accepted} апдейтов ({statuses}) за {elapsed:.2f} с: "
+          f"{server.accepted / elapsed:.0f} апдейтов/с")
+    print(f"время до обработчика: p50={p50:.2f} мс p99={p99:.2f} мс")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
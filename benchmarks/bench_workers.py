@@ -0,0 +1,131 @@
+# Пул воркеров (workers.py) с FakeBotAPI вместо Telegram: приёмник
+# раскладывает по воркерам апдейты N пользователей — /start и потом
+# быстрый ввод «-<сумма> еда» — и ждёт, пока воркеры всё доработают и
+# выйдут. Для 1, 2, 4… воркеров — апдейты в секунду и процессорное время
+# на апдейт (воркеры + приёмник) без запуска и остановки самих воркеров:
+# их замеряем отдельно прогоном без апдейтов и вычитаем. На машине с одним ядром пропускная
+# способность расти не может; там смысл замера в том, что время на
+# апдейт не растёт с числом воркеров, то есть пул не добавляет накладных
+# расходов и упирается только в ядра.
+#
+# Потом — перезапуск всех воркеров по одному посреди нагрузки (как по
+# SIGHUP): ни одна операция не теряется и не записывается дважды, а
+# операции каждого пользователя записаны в том порядке, в каком он их
+# отправил. Остатки и сводные таблицы сходятся с операциями.
+#
+#   python benchmarks/bench_workers.py [пользователей] [сообщений] [воркеров через запятую]
+
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fake_api import text_update
+
+SHARDS = 8
+
+
+# вызывается в воркере: Application с FakeBotAPI и без Updater
+def fake_builder():
+    from telegram.ext import ApplicationBuilder
+    from fake_api import FakeBotAPI
+    return ApplicationBuilder().request(FakeBotAPI()).updater(None)
+
+
+def prepare(tmp, name, users):
+    # воркеры настраивают storage при импорте из тех же переменных
+    os.environ["FINBOT_DB"] = os.path.join(tmp, f"{name}.db")
+    os.environ["FINBOT_STORAGE"] = "sharded"
+    os.environ["FINBOT_SHARDS"] = str(SHARDS)
+    import storage
+    storage.configure(os.environ["FINBOT_DB"], "sharded", SHARDS)
+    storage.init_db()
+    for user in users:
+        storage.ensure_user(user)
+        storage.add_currency(user, "RUB")
+    storage.close_all()
+
+
+def workload(users, messages):
+    update_ids = iter(range(1, 1 << 30))
+    updates = [text_update(next(update_ids), user, "/start") for user in users]
+    for i in range(messages):
+        updates += [text_update(next(update_ids), user, f"-{i + 1} еда") for user in users]
+    return [(data, json.dumps(data).encode()) for data in updates]
+
+
+def cpu(usage):
+    return usage.ru_utime + usage.ru_stime
+
+
+async def drive(count, updates, restart_at=None):
+    import workers
+
+    pool = workers.WorkerPool("1:FAKE", count, builder_factory=fake_builder)
+    await pool.start()
+    children = cpu(resource.getrusage(resource.RUSAGE_CHILDREN))
+    own = cpu(resource.getrusage(resource.RUSAGE_SELF))
+    start = time.perf_counter()
+    restart = None
+    for i, (data, body) in enumerate(updates):
+        if i == restart_at:
+            restart = asyncio.create_task(pool.restart())
+        await pool.route_wait(data, body)
+    if restart is not None:
+        await restart
+    await pool.stop()
+    elapsed = time.perf_counter() - start
+    used = cpu(resource.getrusage(resource.RUSAGE_CHILDREN)) - children + cpu(resource.getrusage(resource.RUSAGE_SELF)) - own
+    return elapsed, used, sum(link.restarts for link in pool.links)
+
+
+def check(users, messages):
+    import storage
+    storage.configure(os.environ["FINBOT_DB"], "sharded", SHARDS)
+    total = 0
+    for user in users:
+        with storage.db_for(user).read() as conn:
+            amounts = [row[0] for row in conn.execute(
+                "SELECT amount FROM operations WHERE user_id = ? ORDER BY id", (user,))]
+        assert amounts == [float(i + 1) for i in range(messages)], (user, amounts[:10])
+        total += len(amounts)
+    assert storage.check_balances() == []
+    storage.close_all()
+    return total
+
+
+def main():
+    users_count = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    counts = [int(n) for n in sys.argv[3].split(",")] if len(sys.argv) > 3 else [1, 2, 4]
+    users = list(range(1000, 1000 + users_count))
+    updates = workload(users, messages)
+    print(f"ядер: {os.cpu_count()}; {users_count} пользователей, {len(updates)} апдейтов, {SHARDS} шардов")
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in counts:
+            prepare(tmp, f"idle{count}", users)
+            idle_elapsed, idle_used, _ = asyncio.run(drive(count, []))
+            prepare(tmp, f"run{count}", users)
+            elapsed, used, _ = asyncio.run(drive(count, updates))
+            written = check(users, messages)
+            elapsed, used = elapsed - idle_elapsed, used - idle_used
+            print(f"{count} воркер(ов): {len(updates) / elapsed:6.0f} апдейтов/с, {elapsed:5.2f} с, "
+                  f"процессор {used / len(updates) * 1000:.2f} мс на апдейт; {written} операций — ок "
+                  f"(запуск и остановка без апдейтов: {idle_used:.2f} с процессора)")
+
+        count = max(counts)
+        prepare(tmp, "restart", users)
+        elapsed, used, restarts = asyncio.run(drive(count, updates, restart_at=len(updates) // 3))
+        written = check(users, messages)
+        print(f"{count} воркер(ов) с перезапуском по одному посреди нагрузки: {restarts} перезапусков, "
+              f"{len(updates) / elapsed:.0f} апдейтов/с, {written} операций без потерь и повторов, "
+              f"порядок внутри чатов сохранён — ок")
+
+
+if __name__ == "__main__":
+    main()
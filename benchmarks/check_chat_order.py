@@ -0,0 +1,73 @@
+# Проверка ChatOrderedUpdateProcessor: много чатов шлют пронумерованные
+# апдейты, обработчик со случайной задержкой ведёт в user_data счётчик
+# шагов и падает, если шаг пришёл не по порядку. Заодно видно, что разные
+# чаты действительно обрабатывались параллельно.
+#
+#   python benchmarks/check_chat_order.py [чатов] [апдейтов на чат]
+
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+
+from concurrency import ChatOrderedUpdateProcessor
+from fake_api import FakeBotAPI, text_update
+
+
+async def main():
+    chats = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    per_chat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    processor = ChatOrderedUpdateProcessor(max_concurrent_updates=16)
+    errors = []
+    peak = {"active": 0, "depth": 0}
+
+    async def step(update, context):
+        expected = context.user_data.get("step", 0) + 1
+        got = int(update.message.text)
+        peak["active"] = max(peak["active"], processor.active_updates)
+        peak["depth"] = max(peak["depth"], max(processor.queue_depths().values(), default=0))
+        # переключение посреди перехода: другой апдейт того же чата не
+        # должен успеть вклиниться между чтением и записью состояния
+        await asyncio.sleep(random.uniform(0, 0.003))
+        if got != expected:
+            errors.append((update.effective_chat.id, expected, got))
+        context.user_data["step"] = got
+
+    app = (
+        ApplicationBuilder().token("1:FAKE").request(FakeBotAPI()).updater(None)
+        .concurrent_updates(processor).build()
+    )
+    app.add_handler(MessageHandler(filters.TEXT, step))
+
+    updates = []
+    for n in range(1, per_chat + 1):
+        for chat in range(chats):
+            updates.append(text_update(len(updates) + 1, 5000 + chat, str(n)))
+
+    async with app:
+        await app.start()
+        start = time.perf_counter()
+        for data in updates:
+            await app.update_queue.put(Update.de_json(data, app.bot))
+        while app.update_queue.qsize() or processor.queue_depths():
+            await asyncio.sleep(0.005)
+        elapsed = time.perf_counter() - start
+        await app.stop()
+
+    print(f"{len(updates)} апдейтов из {chats} чатов за {elapsed:.2f} с, "
+          f"одновременно до {peak['active']} апдейтов, очередь чата до {peak['depth']}")
+    if errors:
+        print(f"Нарушен порядок в {len(errors)} случаях, например: {errors[:5]}")
+        return 1
+    print("Порядок внутри каждого чата сохранён.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
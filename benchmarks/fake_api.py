@@ -0,0 +1,113 @@
+# Локальная замена Bot API для бенчмарков: подключается как request
+# в ApplicationBuilder, отвечает на методы без сети и считает вызовы.
+
+import itertools
+import json
+import time
+from collections import Counter
+
+from telegram.request import BaseRequest
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "FinanceBot", "username": "finance_bot"}
+
+
+class FakeBotAPI(BaseRequest):
+    def __init__(self):
+        self.calls = Counter()
+        self.payload_bytes = Counter()
+        self.files = {}
+        self._message_ids = itertools.count(1)
+        self.last_message_id = None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return 1.0
+
+    def reset(self):
+        self.calls.clear()
+        self.payload_bytes.clear()
+
+    # файл, который бот сможет скачать через getFile
+    def add_file(self, file_id, data):
+        self.files[file_id] = data
+
+    def _message(self, params):
+        chat_id = int(params.get("chat_id", 0))
+        self.last_message_id = int(params.get("message_id") or next(self._message_ids))
+        return {
+            "message_id": self.last_message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        if "/file/bot" in url:
+            return 200, self.files[url.rsplit("/", 1)[-1]]
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[api_method] += 1
+        if request_data is not None:
+            self.payload_bytes[api_method] += len(request_data.json_payload)
+
+        if api_method == "getMe":
+            result = BOT_USER
+        elif api_method in ("sendMessage", "editMessageText", "sendDocument"):
+            result = self._message(params)
+        elif api_method == "getFile":
+            file_id = params["file_id"]
+            result = {"file_id": file_id, "file_unique_id": file_id,
+                      "file_size": len(self.files[file_id]), "file_path": file_id}
+        elif api_method == "getUpdates":
+            result = []
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def text_update(update_id, user_id, text, chat_id=None):
+    chat_id = user_id if chat_id is None else chat_id
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"update_id": update_id, "message": message}
+
+
+def document_update(update_id, user_id, file_id, file_name="statement.csv", file_size=None):
+    update = text_update(update_id, user_id, "")
+    message = update["message"]
+    del message["text"]
+    message["document"] = {"file_id": file_id, "file_unique_id": file_id, "file_name": file_name,
+                           "mime_type": "text/csv", "file_size": file_size}
+    return update
+
+
+# нажатие inline-кнопки под сообщением бота message_id
+def callback_update(update_id, user_id, data, message_id, chat_id=None):
+    chat_id = user_id if chat_id is None else chat_id
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": BOT_USER,
+        "text": "",
+    }
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "chat_instance": str(chat_id), "data": data, "message": message,
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+    }}
@@ -0,0 +1,77 @@
+# Фаззинг разбора быстрого ввода. Две проверки:
+#  - случайный мусор (буквы, цифры, знаки, эмодзи, пробелы) — parse либо
+#    возвращает None/QuickEntry, либо бросает ValueError, и ничего больше;
+#  - сообщение, собранное из известных частей в случайном порядке и
+#    регистре, разбирается ровно в эти части.
+#
+#   python benchmarks/fuzz_quick_entry.py [итераций] [seed]
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+from importer import normalize_name
+from quick_entry import QuickEntry, QuickIndex
+
+CURRENCIES = ("RUB", "USD", "EUR", "KZT")
+ALPHABET = "абвгдеёжзийклмнопрстуфхцчшщъыьэюяabcdefghijklmnopqrstuvwxyz0123456789+-.,₽$€ \t🍔🚕"
+
+
+def garbage(rng):
+    return "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 40)))
+
+
+def check_garbage(index, rng, iterations):
+    for _ in range(iterations):
+        text = garbage(rng)
+        try:
+            result = index.parse(text)
+        except ValueError:
+            continue
+        assert result is None or isinstance(result, QuickEntry), (text, result)
+        if result is not None:
+            assert result.amount > 0 and result.currency in CURRENCIES, (text, result)
+            assert result.type in ("income", "expense"), (text, result)
+
+
+def check_roundtrip(index, categories, rng, iterations):
+    for _ in range(iterations):
+        op_type = rng.choice(["income", "expense"])
+        amount = round(rng.uniform(0.01, 1e6), rng.choice([0, 1, 2]))
+        currency = rng.choice(CURRENCIES)
+        category = rng.choice(categories) if op_type == "expense" else None
+
+        number = f"{amount:g}" if amount < 1e5 else f"{amount:.2f}"
+        if rng.random() < 0.5:
+            number = number.replace(".", ",")
+        sign = "+" if op_type == "income" else rng.choice(["-", ""])
+        parts = [currency if rng.random() < 0.5 else currency.lower()]
+        if category:
+            word = normalize_name(category)
+            parts.append(rng.choice([word, word.upper(), word.capitalize()]))
+        rng.shuffle(parts)
+        parts.insert(rng.randint(0, len(parts)), sign + number)
+        text = rng.choice([" ", "  ", "\t"]).join(parts)
+
+        result = index.parse(text)
+        expected = QuickEntry(op_type, float(number.replace(",", ".")), currency,
+                              category or (None if op_type == "income" else index.fallback), None)
+        assert result == expected, (text, result, expected)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    rng = random.Random(seed)
+    categories = tuple(storage.BASE_CATEGORIES) + ("Дом и ремонт", "Кафе и рестораны", "Подарки")
+    index = QuickIndex(categories, CURRENCIES)
+    check_garbage(index, rng, iterations)
+    check_roundtrip(index, categories, rng, iterations)
+    print(f"ok: {iterations} случайных строк и {iterations} собранных сообщений (seed {seed})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,45 @@
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
+from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, MessageHandler,
-    ConversationHandler, filters, ContextTypes
+    ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler,
+    ConversationHandler, ApplicationHandlerStop, filters, ContextTypes
 )
-import sqlite3
 from datetime import datetime, timedelta
+from functools import cache, lru_cache
 
 import os
+import re
+import tempfile
+import zlib
 from dotenv import load_dotenv
 
+from storage import (
+    init_db, add_operation_checked, get_balance, get_operations_page,
+    delete_operation, update_operation_amount, clear_db,
+    get_category_stats, period_bounds, add_currency, delete_currency_db,
+    get_all_currencies, get_all_categories, add_category, delete_category,
+    ensure_user, parse_date, DIGEST_PERIODS, get_digest_subscriptions,
+    set_digest_subscriptions, get_budget_report, set_budget, delete_budget,
+    find_operations_page, next_month, add_recurring, get_recurring,
+    delete_recurring
+)
+from async_db import adb, LoopLagMonitor
+from persistence import SQLitePersistence
+from webhook import run_webhook
+from concurrency import ChatOrderedUpdateProcessor
+from importer import CATEGORY_ALIASES, import_csv_chunked, normalize_name
+from exporter import export_operations
+from rates import BASE_CURRENCY, consolidated_balance, consolidated_stats
+import metrics
+import digest
+import trends
+import workers
+from quick_entry import QuickEntry, get_index, has_amount
+
 load_dotenv()
 TOKEN = os.getenv("BOT_TOKEN")
+# polling — long-poll getUpdates; webhook — встроенный HTTP-приёмник
+MODE = os.getenv("FINBOT_MODE", "polling")
 
 # ---------- Состояния ----------
 (
@@ -29,175 +58,17 @@ TOKEN = os.getenv("BOT_TOKEN")
     EDIT_AMOUNT,
     CURRENCY_MENU,
     ADD_CURRENCY,
-    DELETE_CURRENCY
-) = range(16)
-
-# ---------- База ----------
-def init_db():
-    conn = sqlite3.connect("finance.db")
-    cursor = conn.cursor()
-    
-    # таблица операций
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS operations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            type TEXT,
-            amount REAL,
-            currency TEXT,
-            category TEXT,
-            date TEXT
-        )
-    """)
-    
-    # таблица валют
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS currencies (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            code TEXT UNIQUE
-        )
-    """)
-    
-    # таблица категорий
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS categories (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE
-        )
-    """)
-    
-    # базовые категории, если таблица пустая
-    cursor.execute("SELECT COUNT(*) FROM categories")
-    if cursor.fetchone()[0] == 0:
-        base_categories = ["🍔 Еда", "🚕 Транспорт", "🎮 Развлечения", "🛒 Покупки", "💊 Здоровье", "📦 Другое"]
-        cursor.executemany("INSERT INTO categories (name) VALUES (?)", [(c,) for c in base_categories])
-    
-    conn.commit()
-    conn.close()
-
-def add_operation(op_type, amount, currency, category=None, date=None):
-    if date is None:
-        date = datetime.now().strftime("%Y-%m-%d")
-    conn = sqlite3.connect("finance.db")
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO operations (type, amount, currency, category, date) VALUES (?, ?, ?, ?, ?)",
-        (op_type, amount, currency, category, date)
-    )
-    conn.commit()
-    conn.close()
-
-def get_balance():
-    conn = sqlite3.connect("finance.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT type, amount, currency FROM operations")
-    rows = cursor.fetchall()
-    conn.close()
-    balances = {}
-    for t, a, c in rows:
-        balances.setdefault(c, 0)
-        balances[c] += a if t == "income" else -a
-    return balances
-
-def get_operations_by_date(date_str):
-    conn = sqlite3.connect("finance.db")
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id, type, amount, currency, category FROM operations WHERE date = ?",
-        (date_str,)
-    )
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
-
-def delete_operation(op_id):
-    conn = sqlite3.connect("finance.db")
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM operations WHERE id = ?", (op_id,))
-    conn.commit()
-    conn.close()
-
-def update_operation_amount(op_id, new_amount):
-    conn = sqlite3.connect("finance.db")
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE operations SET amount = ? WHERE id = ?",
-        (new_amount, op_id)
-    )
-    conn.commit()
-    conn.close()
-
-def clear_db():
-    conn = sqlite3.connect("finance.db")
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM operations")
-    conn.commit()
-    conn.close()
-
-def get_monthly_category_stats(year_month):
-    conn = sqlite3.connect("finance.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT category, currency, SUM(amount)
-        FROM operations
-        WHERE type = 'expense'
-        AND date LIKE ?
-        GROUP BY category, currency
-    """, (f"{year_month}-%",))
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
-
-# валюты
-def add_currency(code):
-    conn = sqlite3.connect("finance.db")
-    cursor = conn.cursor()
-    try:
-        cursor.execute("INSERT INTO currencies (code) VALUES (?)", (code.upper(),))
-        conn.commit()
-    except sqlite3.IntegrityError:
-        pass
-    conn.close()
-
-def delete_currency_db(code):
-    conn = sqlite3.connect("finance.db")
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM currencies WHERE code = ?", (code.upper(),))
-    conn.commit()
-    conn.close()
-
-def get_all_currencies():
-    conn = sqlite3.connect("finance.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT code FROM currencies")
-    rows = [r[0] for r in cursor.fetchall()]
-    conn.close()
-    return rows
-def get_all_categories():
-    conn = sqlite3.connect("finance.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM categories")
-    rows = [r[0] for r in cursor.fetchall()]
-    conn.close()
-    return rows
-
-def add_category(name):
-    conn = sqlite3.connect("finance.db")
-    cursor = conn.cursor()
-    try:
-        cursor.execute("INSERT INTO categories (name) VALUES (?)", (name,))
-        conn.commit()
-    except sqlite3.IntegrityError:
-        pass
-    conn.close()
-
-def delete_category(name):
-    conn = sqlite3.connect("finance.db")
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM categories WHERE name = ?", (name,))
-    conn.commit()
-    conn.close()
+    DELETE_CURRENCY,
+    BUDGET_MENU,
+    BUDGET_CATEGORY,
+    BUDGET_AMOUNT,
+    DELETE_BUDGET
+) = range(20)
 
 # ---------- Кнопки ----------
+# Клавиатуры неизменяемы, поэтому статические меню строятся один раз,
+# а меню из справочников кэшируются по их содержимому.
+@cache
 def main_menu():
     return ReplyKeyboardMarkup([
         [KeyboardButton("➕ Добавить")],
@@ -205,75 +76,110 @@ def main_menu():
         [KeyboardButton("💱 Валюты"), KeyboardButton("⚙️ Настройки")]
     ], resize_keyboard=True)
 
+@cache
 def add_menu():
     return ReplyKeyboardMarkup([
         [KeyboardButton("💰 Доход"), KeyboardButton("💸 Расход")],
         [KeyboardButton("⬅️ Назад")]
     ], resize_keyboard=True)
 
-def category_menu():
-    return ReplyKeyboardMarkup([
-        [KeyboardButton("🍔 Еда"), KeyboardButton("🚕 Транспорт")],
-        [KeyboardButton("🎮 Развлечения"), KeyboardButton("🛒 Покупки")],
-        [KeyboardButton("💊 Здоровье"), KeyboardButton("📦 Другое")],
-        [KeyboardButton("⬅️ Назад")]
-    ], resize_keyboard=True)
-
+@cache
 def history_menu_buttons():
     return ReplyKeyboardMarkup([
         [KeyboardButton("Сегодня"), KeyboardButton("Вчера")],
+        [KeyboardButton("Неделя"), KeyboardButton("Месяц")],
         [KeyboardButton("🗓 Ввести дату")],
         [KeyboardButton("⬅️ Назад")]
     ], resize_keyboard=True)
 
-def history_actions_menu():
-    return ReplyKeyboardMarkup([
+@cache
+def history_actions_menu(has_prev=False, has_next=False):
+    nav = []
+    if has_prev:
+        nav.append(KeyboardButton("◀️ Раньше"))
+    if has_next:
+        nav.append(KeyboardButton("Позже ▶️"))
+    return ReplyKeyboardMarkup(([nav] if nav else []) + [
         [KeyboardButton("✏️ Редактировать"), KeyboardButton("🗑 Удалить")],
         [KeyboardButton("⬅️ Назад")]
     ], resize_keyboard=True)
 
+@cache
 def stats_menu():
     return ReplyKeyboardMarkup([
         [KeyboardButton("💰 Баланс")],
         [KeyboardButton("📊 Расходы по категориям (месяц)")],
+        [KeyboardButton("📊 За неделю"), KeyboardButton("📊 За год")],
+        [KeyboardButton("📈 Тренды")],
         [KeyboardButton("⬅️ Назад")]
     ], resize_keyboard=True)
 
+@cache
 def settings_menu():
     return ReplyKeyboardMarkup([
-        [KeyboardButton("🛠 Категории")],
+        [KeyboardButton("🛠 Категории"), KeyboardButton("💼 Бюджеты")],
+        [KeyboardButton("📥 Импорт выписки")],
         [KeyboardButton("🗑 Очистить базу")],
         [KeyboardButton("⬅️ Назад")]
     ], resize_keyboard=True)
 
+@cache
+def budgets_menu():
+    return ReplyKeyboardMarkup([
+        [KeyboardButton("➕ Установить бюджет"), KeyboardButton("🗑 Удалить бюджет")],
+        [KeyboardButton("⬅️ Назад")]
+    ], resize_keyboard=True)
+
+@cache
 def confirm_clear_menu():
     return ReplyKeyboardMarkup([
         [KeyboardButton("✅ Да"), KeyboardButton("❌ Нет")]
     ], resize_keyboard=True)
 
+@cache
 def currencies_menu():
     return ReplyKeyboardMarkup([
         [KeyboardButton("➕ Добавить валюту"), KeyboardButton("🗑 Удалить валюту")],
         [KeyboardButton("⬅️ Назад")]
     ], resize_keyboard=True)
 
+@cache
 def categories_menu():
     return ReplyKeyboardMarkup([
         [KeyboardButton("➕ Добавить категорию"), KeyboardButton("🗑 Удалить категорию")],
         [KeyboardButton("⬅️ Назад")]
     ], resize_keyboard=True)
 
-def category_menu():
-    cats = get_all_categories()
-    if not cats:
-        return ReplyKeyboardMarkup([[KeyboardButton("⬅️ Назад")]], resize_keyboard=True)
-    buttons = [[KeyboardButton(c)] for c in cats]
+@lru_cache(maxsize=64)
+def list_menu(items):
+    buttons = [[KeyboardButton(i)] for i in items]
     buttons.append([KeyboardButton("⬅️ Назад")])
     return ReplyKeyboardMarkup(buttons, resize_keyboard=True)
 
+async def category_menu(update):
+    return list_menu(await adb.read(get_all_categories, uid(update)))
+
 # ---------- Старт ----------
+# Все данные разделены по пользователям Telegram.
+def uid(update):
+    return update.effective_user.id
+
+# Сбрасывает промежуточные данные диалога, но не настройки пользователя.
+USER_SETTINGS = ("base_currency",)
+
+def reset_flow(context):
+    kept = {k: context.user_data[k] for k in USER_SETTINGS if k in context.user_data}
+    context.user_data.clear()
+    context.user_data.update(kept)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("💸 Финансовый бот", reply_markup=main_menu())
+    await adb.write(ensure_user, uid(update))
+    await update.message.reply_text(
+        "💸 Финансовый бот\nМожно одной строкой: «-250 еда» или «+5000 usd зарплата»\n"
+        "/menu — меню кнопками в одном сообщении\n/find — поиск по истории\n"
+        "/recurring — регулярные операции: зарплата, подписки",
+        reply_markup=main_menu()
+    )
     return MAIN_MENU
 
 # ---------- Главное меню ----------
@@ -300,6 +206,49 @@ async def main_menu_handler(update: Update, context):
         await update.message.reply_text("Управление валютами:", reply_markup=currencies_menu())
         return CURRENCY_MENU
 
+    if has_amount(text):
+        return await quick_entry(update, context)
+
+    return MAIN_MENU
+
+# Быстрый ввод: "-250 еда usd", "+5000 EUR зарплата" — операция
+# добавляется сразу, без меню. Знак минус или без знака — расход. Расход
+# без узнанной категории бот сначала переспрашивает.
+async def quick_entry(update: Update, context):
+    index = await adb.read(get_index, uid(update))
+    try:
+        entry = index.parse(update.message.text)
+    except ValueError as e:
+        await update.message.reply_text(str(e), reply_markup=main_menu())
+        return MAIN_MENU
+    if entry is None:
+        return MAIN_MENU
+    if entry.guessed:
+        # категория не названа — число могло оказаться не суммой ("12.05 встреча")
+        context.user_data["quick_entry"] = entry._asdict()
+        await update.message.reply_text(
+            f"Записать расход {entry.amount} {entry.currency}"
+            f"{f' в «{entry.category}»' if entry.category else ''}?",
+            reply_markup=confirm_clear_menu())
+        return CONFIRM_ENTRY
+    return await save_quick_entry(update, entry)
+
+async def confirm_entry(update: Update, context):
+    data = context.user_data.pop("quick_entry", None)
+    if update.message.text != "✅ Да" or data is None:
+        await update.message.reply_text("Отменено.", reply_markup=main_menu())
+        return MAIN_MENU
+    return await save_quick_entry(update, QuickEntry(**data))
+
+async def save_quick_entry(update: Update, entry):
+    crossing = await adb.write(add_operation_checked, uid(update), entry.type, entry.amount, entry.currency,
+                               entry.category, None, entry.note)
+    income = entry.type == "income"
+    msg = f"{'💰' if income else '💸'} {entry.amount} {entry.currency} {'добавлено' if income else 'потрачено'}"
+    if entry.category:
+        msg += f" ({entry.category})"
+    msg += budget_note(entry.category, entry.currency, crossing)
+    await update.message.reply_text(msg, reply_markup=main_menu())
     return MAIN_MENU
 
 # ---------- Валюты ----------
@@ -314,13 +263,11 @@ async def currency_menu_handler(update: Update, context):
         return ADD_CURRENCY
 
     if text == "🗑 Удалить валюту":
-        currencies = get_all_currencies()
+        currencies = await adb.read(get_all_currencies, uid(update))
         if not currencies:
             await update.message.reply_text("Список валют пуст.", reply_markup=currencies_menu())
             return CURRENCY_MENU
-        buttons = [[KeyboardButton(c)] for c in currencies]
-        buttons.append([KeyboardButton("⬅️ Назад")])
-        await update.message.reply_text("Выберите валюту для удаления:", reply_markup=ReplyKeyboardMarkup(buttons, resize_keyboard=True))
+        await update.message.reply_text("Выберите валюту для удаления:", reply_markup=list_menu(currencies))
         return DELETE_CURRENCY
 
     return CURRENCY_MENU
@@ -329,7 +276,7 @@ async def add_currency_handler(update: Update, context):
     code = update.message.text.strip().upper()
     if code == "⬅️ Назад":
         return await main_menu_handler(update, context)
-    add_currency(code)
+    await adb.write(add_currency, uid(update), code)
     await update.message.reply_text(f"✅ Валюта {code} добавлена.", reply_markup=currencies_menu())
     return CURRENCY_MENU
 
@@ -337,13 +284,14 @@ async def delete_currency_handler(update: Update, context):
     code = update.message.text.strip().upper()
     if code == "⬅️ Назад":
         return await currency_menu_handler(update, context)
-    delete_currency_db(code)
+    await adb.write(delete_currency_db, uid(update), code)
     await update.message.reply_text(f"🗑 Валюта {code} удалена.", reply_markup=currencies_menu())
     return CURRENCY_MENU
 
 CATEGORY_MENU = 100
 ADD_CATEGORY = 101
 DELETE_CATEGORY = 102
+CONFIRM_ENTRY = 103
 
 async def categories_menu_handler(update: Update, context):
     text = update.message.text
@@ -354,13 +302,11 @@ async def categories_menu_handler(update: Update, context):
         await update.message.reply_text("Введите название новой категории:")
         return ADD_CATEGORY
     if text == "🗑 Удалить категорию":
-        categories = get_all_categories()
+        categories = await adb.read(get_all_categories, uid(update))
         if not categories:
             await update.message.reply_text("Категории отсутствуют.", reply_markup=categories_menu())
             return CATEGORY_MENU
-        buttons = [[KeyboardButton(c)] for c in categories]
-        buttons.append([KeyboardButton("⬅️ Назад")])
-        await update.message.reply_text("Выберите категорию для удаления:", reply_markup=ReplyKeyboardMarkup(buttons, resize_keyboard=True))
+        await update.message.reply_text("Выберите категорию для удаления:", reply_markup=list_menu(categories))
         return DELETE_CATEGORY
     return CATEGORY_MENU
 
@@ -369,7 +315,7 @@ async def add_category_handler(update: Update, context):
     if name == "⬅️ Назад":
         await update.message.reply_text("Управление категориями:", reply_markup=categories_menu())
         return CATEGORY_MENU
-    add_category(name)
+    await adb.write(add_category, uid(update), name)
     await update.message.reply_text(f"✅ Категория '{name}' добавлена.", reply_markup=categories_menu())
     return CATEGORY_MENU
 
@@ -378,7 +324,7 @@ async def delete_category_handler(update: Update, context):
     if name == "⬅️ Назад":
         await update.message.reply_text("Управление категориями:", reply_markup=categories_menu())
         return CATEGORY_MENU
-    delete_category(name)
+    await adb.write(delete_category, uid(update), name)
     await update.message.reply_text(f"🗑 Категория '{name}' удалена.", reply_markup=categories_menu())
     return CATEGORY_MENU
 
@@ -394,18 +340,16 @@ async def add_menu_handler(update: Update, context):
         context.user_data["type"] = "income"
         context.user_data["category"] = None
         # Выбор валюты из БД
-        currencies = get_all_currencies()
+        currencies = await adb.read(get_all_currencies, uid(update))
         if not currencies:
             await update.message.reply_text("Сначала добавьте валюту в разделе Валюты.", reply_markup=main_menu())
             return MAIN_MENU
-        buttons = [[KeyboardButton(c)] for c in currencies]
-        buttons.append([KeyboardButton("⬅️ Назад")])
-        await update.message.reply_text("Выберите валюту:", reply_markup=ReplyKeyboardMarkup(buttons, resize_keyboard=True))
+        await update.message.reply_text("Выберите валюту:", reply_markup=list_menu(currencies))
         return CHOOSING_CURRENCY
 
     if text == "💸 Расход":
         context.user_data["type"] = "expense"
-        await update.message.reply_text("Выберите категорию:", reply_markup=category_menu())
+        await update.message.reply_text("Выберите категорию:", reply_markup=await category_menu(update))
         return CHOOSING_CATEGORY
 
     return ADD_MENU
@@ -418,17 +362,15 @@ async def choosing_category(update: Update, context):
         return ADD_MENU
     context.user_data["category"] = text
 
-    currencies = get_all_currencies()
-    buttons = [[KeyboardButton(c)] for c in currencies]
-    buttons.append([KeyboardButton("⬅️ Назад")])
-    await update.message.reply_text("Выберите валюту:", reply_markup=ReplyKeyboardMarkup(buttons, resize_keyboard=True))
+    currencies = await adb.read(get_all_currencies, uid(update))
+    await update.message.reply_text("Выберите валюту:", reply_markup=list_menu(currencies))
     return CHOOSING_CURRENCY
 
 async def choosing_currency(update: Update, context):
     text = update.message.text
     if text == "⬅️ Назад":
         if context.user_data.get("type") == "expense":
-            await update.message.reply_text("Выберите категорию:", reply_markup=category_menu())
+            await update.message.reply_text("Выберите категорию:", reply_markup=await category_menu(update))
             return CHOOSING_CATEGORY
         else:
             await update.message.reply_text("Выберите тип операции:", reply_markup=add_menu())
@@ -441,41 +383,61 @@ async def typing_amount(update: Update, context):
     text = update.message.text
     if text == "⬅️ Назад":
         if context.user_data.get("type") == "expense":
-            await update.message.reply_text("Выберите категорию:", reply_markup=category_menu())
+            await update.message.reply_text("Выберите категорию:", reply_markup=await category_menu(update))
             return CHOOSING_CATEGORY
         else:
             await update.message.reply_text("Выберите тип операции:", reply_markup=add_menu())
             return ADD_MENU
+    # после суммы можно дописать заметку: "250 обед с коллегами"
+    number, _, note = text.strip().partition(" ")
     try:
-        amount = float(text)
+        amount = float(number)
     except:
         await update.message.reply_text("Введите число.")
         return TYPING_AMOUNT
-    add_operation(
+    crossing = await adb.write(
+        add_operation_checked,
+        uid(update),
         context.user_data["type"],
         amount,
         context.user_data["currency"],
-        context.user_data["category"]
+        context.user_data["category"],
+        None,
+        note.strip() or None
     )
     msg = f"{'💰' if context.user_data['type']=='income' else '💸'} {amount} {context.user_data['currency']} {'добавлено' if context.user_data['type']=='income' else 'потрачено'}"
+    msg += budget_note(context.user_data["category"], context.user_data["currency"], crossing)
     await update.message.reply_text(msg, reply_markup=main_menu())
-    context.user_data.clear()
+    reset_flow(context)
     return MAIN_MENU
 
 # ---------- История и редактирование ----------
+# История листается страницами по PAGE_SIZE операций. В user_data лежат
+# только период, ключи (date, id) краёв текущей страницы и id её строк —
+# по ним работают «Редактировать» и «Удалить».
+NUMBERS = ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "🔟"]
+
 async def history_handler(update: Update, context):
     text = update.message.text
-    today = datetime.now().strftime("%Y-%m-%d")
+    today = datetime.now().date()
     if text == "⬅️ Назад":
         await update.message.reply_text("Главное меню:", reply_markup=main_menu())
         return MAIN_MENU
     if text == "Сегодня":
-        date = today
+        start, end = period_bounds("day", today)
     elif text == "Вчера":
-        date = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        start, end = period_bounds("day", today - timedelta(days=1))
+    elif text == "Неделя":
+        start, end = period_bounds("week", today)
+    elif text == "Месяц":
+        start, end = period_bounds("month", today)
     elif text == "🗓 Ввести дату":
-        await update.message.reply_text("Введите дату в формате ДД.MM")
+        await update.message.reply_text("Введите дату ДД.MM или период ДД.MM-ДД.MM (можно с годом: ДД.MM.ГГГГ)")
         return TYPING_DATE
+    elif text == "◀️ Раньше":
+        return await send_history_page(update, context, "prev")
+    elif text == "Позже ▶️":
+        return await send_history_page(update, context, "next")
     elif text == "✏️ Редактировать":
         await update.message.reply_text("Введите номер операции для редактирования:")
         return CHOOSE_EDIT
@@ -485,34 +447,86 @@ async def history_handler(update: Update, context):
     else:
         return HISTORY_MENU
 
-    ops = get_operations_by_date(date)
-    await send_history(update, date, ops, context)
-    return HISTORY_MENU
+    context.user_data["history"] = {"start": start, "end": end}
+    return await send_history_page(update, context)
+
+def parse_day_input(text):
+    text = text.strip()
+    if text.count(".") == 1:
+        day, month = map(int, text.split("."))
+        return datetime(datetime.now().year, month, day).date()
+    return parse_date(text)
 
 async def typing_date(update: Update, context):
+    text = update.message.text
     try:
-        day, month = map(int, update.message.text.split("."))
-        date = datetime(datetime.now().year, month, day).strftime("%Y-%m-%d")
-    except:
-        await update.message.reply_text("Неверный формат. Введите ДД.MM")
+        parts = re.split(r"\s*[-–—]\s*", text.strip()) if "." in text else [text]
+        if len(parts) > 2:
+            raise ValueError(text)
+        days = sorted(parse_day_input(p) for p in parts)
+    except ValueError:
+        await update.message.reply_text("Неверный формат. Введите ДД.MM или ДД.MM-ДД.MM")
         return TYPING_DATE
-    ops = get_operations_by_date(date)
-    await send_history(update, date, ops, context)
-    return HISTORY_MENU
+    context.user_data["history"] = {
+        "start": days[0].isoformat(),
+        "end": (days[-1] + timedelta(days=1)).isoformat(),
+    }
+    return await send_history_page(update, context)
+
+# direction: None — первая страница периода, "next"/"prev" — соседняя.
+async def send_history_page(update, context, direction=None):
+    view = context.user_data.get("history")
+    if view is None:
+        await update.message.reply_text("Выберите период:", reply_markup=history_menu_buttons())
+        return HISTORY_MENU
+    after = view["last"] if direction == "next" else None
+    before = view["first"] if direction == "prev" else None
+    if "find" in view:
+        rows, more = await adb.read(find_operations_page, uid(update), view["find"], after, before)
+    else:
+        rows, more = await adb.read(get_operations_page, uid(update), view["start"], view["end"], after, before)
+    if not rows:
+        if direction is not None:
+            text = "Дальше операций нет."
+        else:
+            text = "Ничего не найдено." if "find" in view else "Операций нет."
+        await update.message.reply_text(text, reply_markup=history_menu_buttons())
+        return HISTORY_MENU
 
-async def send_history(update, date, ops, context):
-    if not ops:
-        await update.message.reply_text("Операций нет.", reply_markup=main_menu())
-        return MAIN_MENU
-    msg = f"📅 Операции за {date}:\n\n"
-    numbered_ops = []
-    for i, (op_id, t, a, c, cat) in enumerate(ops, start=1):
+    if direction is None:
+        view.update(page=1, has_prev=False, has_next=more)
+    elif direction == "next":
+        view.update(page=view["page"] + 1, has_prev=True, has_next=more)
+    else:
+        view.update(page=view["page"] - 1, has_prev=more, has_next=True)
+    view["first"] = [rows[0][5], rows[0][0]]
+    view["last"] = [rows[-1][5], rows[-1][0]]
+    context.user_data["history_ids"] = [r[0] for r in rows]
+
+    found = "find" in view
+    if found:
+        one_day = False
+        msg = f"🔎 {view['title']}"
+    else:
+        last_day = (datetime.strptime(view["end"], "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+        one_day = view["start"] == last_day
+        title = f"за {view['start']}" if one_day else f"с {view['start']} по {last_day}"
+        msg = f"📅 Операции {title}"
+    if view["has_prev"] or view["has_next"]:
+        msg += f", стр. {view['page']}"
+    msg += ":\n\n"
+    for i, (op_id, t, a, c, cat, d, *note) in enumerate(rows):
         sign = "💰" if t == "income" else "💸"
         cat_txt = f" ({cat})" if cat else ""
-        msg += f"{i}️⃣ {sign} {a} {c}{cat_txt}\n"
-        numbered_ops.append(op_id)
-    context.user_data["history_ids"] = numbered_ops
-    await update.message.reply_text(msg, reply_markup=history_actions_menu())
+        # в найденном — год и заметка: совпадение может быть в ней
+        day_txt = "" if one_day else f"{d[8:10]}.{d[5:7]}{'.' + d[2:4] if found else ''} "
+        note_txt = f" — {note[0]}" if note and note[0] else ""
+        number = NUMBERS[i] if i < len(NUMBERS) else f"{i + 1}."
+        msg += f"{number} {day_txt}{sign} {a} {c}{cat_txt}{note_txt}\n"
+    await update.message.reply_text(msg, reply_markup=history_actions_menu(view["has_prev"], view["has_next"]))
+    return HISTORY_MENU
+
+ARCHIVED_TEXT = "🗄 Операция уже в архиве закрытых месяцев — её нельзя изменить."
 
 async def choose_delete(update: Update, context):
     try:
@@ -521,8 +535,10 @@ async def choose_delete(update: Update, context):
     except:
         await update.message.reply_text("Неверный номер.")
         return CHOOSE_DELETE
-    delete_operation(op_id)
-    await update.message.reply_text("🗑 Операция удалена", reply_markup=main_menu())
+    if await adb.write(delete_operation, uid(update), op_id):
+        await update.message.reply_text("🗑 Операция удалена", reply_markup=main_menu())
+    else:
+        await update.message.reply_text(ARCHIVED_TEXT, reply_markup=main_menu())
     return MAIN_MENU
 
 async def choose_edit(update: Update, context):
@@ -541,38 +557,399 @@ async def edit_amount(update: Update, context):
     except:
         await update.message.reply_text("Введите число.")
         return EDIT_AMOUNT
-    update_operation_amount(context.user_data["edit_op_id"], new_amount)
-    await update.message.reply_text("✏️ Операция обновлена", reply_markup=main_menu())
-    context.user_data.clear()
+    changed = await adb.write(update_operation_amount, uid(update), context.user_data["edit_op_id"], new_amount)
+    if changed:
+        op_type, currency, category, date, crossing = changed
+        msg = "✏️ Операция обновлена" + budget_note(category, currency, crossing, date)
+        await update.message.reply_text(msg, reply_markup=main_menu())
+    else:
+        await update.message.reply_text(ARCHIVED_TEXT, reply_markup=main_menu())
+    reset_flow(context)
     return MAIN_MENU
 
+# ---------- Поиск ----------
+# /find такси 1000-1500 usd 03.2025-05.2025
+# Число, «от-до», «>1000» или «<500» — сумма (копейки через запятую);
+# ДД.ММ[.ГГГГ], ММ.ГГГГ или их диапазон через дефис — период; код
+# валюты, точное название категории и «доход»/«расход» — фильтры;
+# остальные слова ищутся по началу в заметках и названиях категорий,
+# а банковские слова вроде «такси» — ещё и как своя категория.
+# Найденное листается и редактируется так же, как история.
+FIND_TYPES = {"доход": "income", "доходы": "income", "расход": "expense", "расходы": "expense"}
+FIND_AMOUNT = re.compile(r"([<>]?)(\d+(?:,\d+)?)(?:-(\d+(?:,\d+)?))?$")
+FIND_MONTH = re.compile(r"(\d{1,2})\.(\d{4})$")
+FIND_DAY = re.compile(r"\d{1,2}\.\d{1,2}(?:\.\d{2,4})?$")
+FIND_USAGE = (
+    "Формат: /find [слова] [сумма или от-до] [валюта] [категория] [доход|расход] [дата, месяц или период]\n"
+    "Например: /find такси 1000-1500 03.2025-05.2025"
+)
+
+def find_period(text):
+    bounds = []
+    for part in re.split(r"[-–—]", text):
+        month = FIND_MONTH.match(part)
+        if month:
+            first = datetime(int(month.group(2)), int(month.group(1)), 1).date()
+            bounds += [first, next_month(first)]
+        elif FIND_DAY.match(part):
+            day = parse_day_input(part)
+            bounds += [day, day + timedelta(days=1)]
+        else:
+            raise ValueError(text)
+    return min(bounds).isoformat(), max(bounds).isoformat()
+
+def parse_find_args(args, categories, currencies):
+    by_name = {normalize_name(c): c for c in categories}
+    codes = {c.upper(): c for c in currencies}
+    query = {"words": []}
+    for arg in args:
+        word = arg.lower()
+        amount = FIND_AMOUNT.match(arg)
+        if "." in arg:
+            query["start"], query["end"] = find_period(arg)
+        elif amount:
+            sign, lo, hi = amount.groups()
+            lo = float(lo.replace(",", "."))
+            hi = float(hi.replace(",", ".")) if hi else lo
+            if sign == ">":
+                query["min"] = lo
+            elif sign == "<":
+                query["max"] = lo
+            else:
+                query["min"], query["max"] = min(lo, hi), max(lo, hi)
+        elif arg.upper() in codes:
+            query["currency"] = codes[arg.upper()]
+        elif word in FIND_TYPES:
+            query["type"] = FIND_TYPES[word]
+        elif word in by_name:
+            query["category"] = by_name[word]
+        elif CATEGORY_ALIASES.get(word) in by_name:
+            query["words"].append([arg, CATEGORY_ALIASES[word]])
+        else:
+            query["words"].append(arg)
+    return query
+
+# Работает из любого состояния диалога и переводит его в историю, чтобы
+# дальше действовали «◀️ Раньше», «✏️ Редактировать» и «🗑 Удалить».
+async def find_command(update: Update, context):
+    user_id = uid(update)
+    await adb.write(ensure_user, user_id)
+    try:
+        if not context.args:
+            raise ValueError("нет условий")
+        query = parse_find_args(
+            context.args,
+            await adb.read(get_all_categories, user_id),
+            await adb.read(get_all_currencies, user_id),
+        )
+    except ValueError:
+        await update.message.reply_text(FIND_USAGE)
+        return None
+    context.user_data["history"] = {"find": query, "title": f"Найдено по «{' '.join(context.args)}»"}
+    return await send_history_page(update, context)
+
 # ---------- Статистика ----------
+STATS_PERIODS = {
+    "📊 Расходы по категориям (месяц)": ("month", "В этом месяце"),
+    "📊 За неделю": ("week", "На этой неделе"),
+    "📊 За год": ("year", "В этом году"),
+}
+
+async def balance_text(user_id, base):
+    balances = await adb.read(get_balance, user_id)
+    msg = "💰 Баланс:\n"
+    for c, b in balances.items():
+        msg += f"{c}: {b}\n"
+    total = await adb.read(consolidated_balance, user_id, base) if balances else None
+    if total:
+        at_dates, at_today, missing = total
+        if len(missing) < len(balances):
+            msg += f"\nВсего ≈ {round(at_today, 2)} {base} по текущему курсу"
+            msg += f"\n({round(at_dates, 2)} {base} по курсам на даты операций)\n"
+        if missing:
+            msg += f"Нет курса для: {', '.join(missing)}\n"
+    return msg
+
+async def stats_text(user_id, period, empty_text, base):
+    start, end = period_bounds(period)
+    stats = await adb.read(get_category_stats, user_id, start, end)
+    if not stats:
+        return f"📊 {empty_text} расходов нет."
+    label = {"month": start[:7], "year": start[:4]}.get(period, f"неделя с {start}")
+    msg = f"📊 Расходы по категориям ({label}):\n"
+    for cat, cur, total in stats:
+        cat_name = cat if cat else "📦 Другое"
+        msg += f"{cat_name} — {round(total, 2)} {cur}\n"
+    if len({cur for _, cur, _ in stats} - {base}) > 0:
+        converted = await adb.read(consolidated_stats, user_id, start, end, base)
+        if converted:
+            by_category, missing = converted
+            if by_category:
+                msg += f"\nИтого ≈ {round(sum(t for _, t in by_category), 2)} {base} по курсам на даты операций\n"
+            if missing:
+                msg += f"Нет курса для: {', '.join(missing)}\n"
+    return msg
+
 async def stats_handler(update: Update, context):
     text = update.message.text
     if text == "⬅️ Назад":
         await update.message.reply_text("Главное меню:", reply_markup=main_menu())
         return MAIN_MENU
     if text == "💰 Баланс":
-        balances = get_balance()
-        msg = "💰 Баланс:\n"
-        for c, b in balances.items():
-            msg += f"{c}: {b}\n"
+        msg = await balance_text(uid(update), base_currency(context))
         await update.message.reply_text(msg, reply_markup=main_menu())
         return MAIN_MENU
-    if text == "📊 Расходы по категориям (месяц)":
-        year_month = datetime.now().strftime("%Y-%m")
-        stats = get_monthly_category_stats(year_month)
-        if not stats:
-            await update.message.reply_text("📊 В этом месяце расходов нет.", reply_markup=main_menu())
-            return MAIN_MENU
-        msg = f"📊 Расходы по категориям ({year_month}):\n"
-        for cat, cur, total in stats:
-            cat_name = cat if cat else "📦 Другое"
-            msg += f"{cat_name} — {round(total, 2)} {cur}\n"
+    if text in STATS_PERIODS:
+        msg = await stats_text(uid(update), *STATS_PERIODS[text], base_currency(context))
         await update.message.reply_text(msg, reply_markup=main_menu())
         return MAIN_MENU
+    if text == "📈 Тренды":
+        result = await adb.read(trends.get_trends, uid(update))
+        await update.message.reply_text(trends.render(result), reply_markup=main_menu())
+        return MAIN_MENU
     return STATS_MENU
 
+# ---------- Базовая валюта ----------
+# В ней показываются общий баланс и итоги статистики.
+def base_currency(context):
+    return context.user_data.get("base_currency", BASE_CURRENCY)
+
+async def base_command(update: Update, context):
+    if not context.args:
+        await update.message.reply_text(
+            f"Базовая валюта: {base_currency(context)}. Сменить: /base КОД, например /base USD"
+        )
+        return
+    code = context.args[0].upper()
+    context.user_data["base_currency"] = code
+    await update.message.reply_text(f"Базовая валюта: {code}")
+
+# ---------- Сводки ----------
+# /digest day week month — подписка на сводки за прошедший день, неделю,
+# месяц; /digest off — отписка; /digest — текущие подписки.
+DIGEST_NAMES = {"day": "день", "week": "неделя", "month": "месяц"}
+
+async def digest_command(update: Update, context):
+    args = [a.lower() for a in context.args]
+    if not args:
+        periods = await adb.read(get_digest_subscriptions, uid(update))
+        current = ", ".join(DIGEST_NAMES[p] for p in periods) or "нет"
+        await update.message.reply_text(
+            f"Сводки: {current}.\nПодписаться: /digest day week month, отписаться: /digest off"
+        )
+        return
+    if args == ["off"]:
+        periods = []
+    else:
+        periods = [p for p in DIGEST_PERIODS if p in args]
+        if not periods or len(periods) != len(set(args)):
+            await update.message.reply_text("Периоды: day, week, month — например /digest week month")
+            return
+    await adb.write(set_digest_subscriptions, uid(update), periods, update.effective_chat.id)
+    if periods:
+        await update.message.reply_text(
+            f"Сводки: {', '.join(DIGEST_NAMES[p] for p in periods)}. Приходят в {digest.DIGEST_TIME} UTC."
+        )
+    else:
+        await update.message.reply_text("Сводки отключены.")
+
+# ---------- Бюджеты ----------
+# Месячные лимиты расходов по категориям. Расход записывается через
+# storage.add_operation_checked: та же транзакция сверяет итог месяца с
+# лимитом, и если сумма перешла 80% или 100%, предупреждение добавляется
+# к ответу — отдельного сообщения и чтения нет.
+def budget_label(category, currency):
+    return f"{category or '📦 Без категории'} · {currency}"
+
+def budget_note(category, currency, crossing, date=None):
+    date = date or datetime.now().strftime("%Y-%m-%d")
+    if crossing is None:
+        return ""
+    threshold, spent, limit = crossing
+    name = category or "📦 Без категории"
+    if threshold >= 1:
+        return f"\n\n🚨 Бюджет «{name}» на {date[:7]} превышен: {round(spent, 2)} из {round(limit, 2)} {currency}"
+    return (f"\n\n⚠️ Израсходовано {round(spent / limit * 100)}% бюджета «{name}» на {date[:7]}: "
+            f"{round(spent, 2)} из {round(limit, 2)} {currency}")
+
+async def show_budgets(update, note=""):
+    report = await adb.read(get_budget_report, uid(update), datetime.now().strftime("%Y-%m"))
+    if not report:
+        msg = note + "Бюджетов нет. Бюджет — месячный лимит расходов на категорию."
+    else:
+        msg = note + "💼 Бюджеты на этот месяц:\n"
+        for category, currency, limit, spent in report:
+            share = spent / limit if limit else 1
+            mark = "🔴" if share >= 1 else "🟡" if share >= 0.8 else "🟢"
+            msg += f"{mark} {budget_label(category, currency)}: {round(spent, 2)} / {round(limit, 2)} ({round(share * 100)}%)\n"
+    await update.message.reply_text(msg, reply_markup=budgets_menu())
+    return BUDGET_MENU
+
+async def budgets_menu_handler(update: Update, context):
+    text = update.message.text
+    if text == "⬅️ Назад":
+        await update.message.reply_text("Настройки:", reply_markup=settings_menu())
+        return SETTINGS_MENU
+    if text == "➕ Установить бюджет":
+        await update.message.reply_text("Выберите категорию:", reply_markup=await category_menu(update))
+        return BUDGET_CATEGORY
+    if text == "🗑 Удалить бюджет":
+        report = await adb.read(get_budget_report, uid(update), datetime.now().strftime("%Y-%m"))
+        if not report:
+            await update.message.reply_text("Бюджетов нет.", reply_markup=budgets_menu())
+            return BUDGET_MENU
+        labels = {budget_label(cat, cur): [cat, cur] for cat, cur, _, _ in report}
+        context.user_data["budget_labels"] = labels
+        await update.message.reply_text("Выберите бюджет для удаления:", reply_markup=list_menu(tuple(labels)))
+        return DELETE_BUDGET
+    return BUDGET_MENU
+
+async def budget_category_handler(update: Update, context):
+    text = update.message.text
+    if text == "⬅️ Назад":
+        return await show_budgets(update)
+    if text not in await adb.read(get_all_categories, uid(update)):
+        await update.message.reply_text("Выберите категорию из списка.")
+        return BUDGET_CATEGORY
+    context.user_data["budget_category"] = text
+    await update.message.reply_text("Введите лимит на месяц, например 15000 или 200 USD:")
+    return BUDGET_AMOUNT
+
+async def budget_amount_handler(update: Update, context):
+    text = update.message.text
+    if text == "⬅️ Назад":
+        context.user_data.pop("budget_category", None)
+        return await show_budgets(update)
+    parts = text.split()
+    currencies = await adb.read(get_all_currencies, uid(update))
+    if not currencies:
+        await update.message.reply_text("Сначала добавьте валюту в разделе Валюты.", reply_markup=main_menu())
+        return MAIN_MENU
+    try:
+        amount = float(parts[0].replace(",", "."))
+        currency = parts[1].upper() if len(parts) > 1 else currencies[0]
+        if amount <= 0 or len(parts) > 2:
+            raise ValueError(parts)
+    except (ValueError, IndexError):
+        await update.message.reply_text("Введите положительное число и, если нужно, валюту: 15000 или 200 USD")
+        return BUDGET_AMOUNT
+    if currency not in currencies:
+        await update.message.reply_text(f"Валюты {currency} нет в списке — добавьте её в разделе Валюты.")
+        return BUDGET_AMOUNT
+    category = context.user_data.pop("budget_category")
+    await adb.write(set_budget, uid(update), category, currency, amount)
+    return await show_budgets(update, f"✅ Бюджет {budget_label(category, currency)}: {amount} в месяц\n\n")
+
+async def delete_budget_handler(update: Update, context):
+    text = update.message.text
+    if text == "⬅️ Назад":
+        return await show_budgets(update)
+    key = context.user_data.get("budget_labels", {}).get(text)
+    if key is None:
+        await update.message.reply_text("Выберите бюджет из списка.")
+        return DELETE_BUDGET
+    await adb.write(delete_budget, uid(update), *key)
+    context.user_data.pop("budget_labels", None)
+    return await show_budgets(update, f"🗑 Бюджет {text} удалён.\n\n")
+
+# ---------- Регулярные операции ----------
+# /recurring +50000 зарплата месяц с 10.01.2025 до 31.12.2026 — сумма,
+# валюта, категория и заметка как в быстром вводе, плюс период и
+# необязательные даты первого и последнего повторения (по умолчанию —
+# с сегодняшнего дня и без конца). /recurring — список правил,
+# /recurring del 2 — удалить второе. Повторения записывает storage при
+# первом чтении, которому они нужны, — отдельного расписания нет.
+RECURRING_WORDS = {
+    "день": "day", "ежедневно": "day", "day": "day",
+    "неделя": "week", "еженедельно": "week", "week": "week",
+    "месяц": "month", "ежемесячно": "month", "month": "month",
+}
+RECURRING_USAGE = (
+    "Формат: /recurring сумма [валюта] [категория] [заметка] день|неделя|месяц [с ДД.ММ.ГГГГ] [до ДД.ММ.ГГГГ]\n"
+    "Например: /recurring +50000 зарплата месяц с 10.01.2025\n"
+    "Список: /recurring, удалить: /recurring del НОМЕР"
+)
+
+def recurring_label(rule):
+    _, op_type, amount, currency, category, note, period, start, until, next_date = rule
+    first = datetime.strptime(start, "%Y-%m-%d").date()
+    every = {"day": "каждый день", "week": "каждую неделю", "month": f"каждый месяц {first.day}-го"}[period]
+    text = f"{'💰' if op_type == 'income' else '💸'} {amount} {currency}"
+    if category:
+        text += f" ({category})"
+    if note:
+        text += f" {note}"
+    text += f" — {every}, с {first:%d.%m.%Y}"
+    if until:
+        text += f" до {datetime.strptime(until, '%Y-%m-%d'):%d.%m.%Y}"
+    if next_date is None:
+        return text + " (закончилось)"
+    return text + f", следующая {datetime.strptime(next_date, '%Y-%m-%d'):%d.%m.%Y}"
+
+def parse_recurring_args(args):
+    period = start = until = None
+    rest = []
+    args = iter(args)
+    for arg in args:
+        word = arg.lower()
+        if word in RECURRING_WORDS and period is None:
+            period = RECURRING_WORDS[word]
+        elif word in ("с", "до"):
+            day = parse_day_input(next(args, "")).isoformat()
+            if word == "с":
+                start = day
+            else:
+                until = day
+        else:
+            rest.append(arg)
+    if period is None:
+        raise ValueError("нет периода")
+    return period, start or datetime.now().strftime("%Y-%m-%d"), until, " ".join(rest)
+
+async def recurring_command(update: Update, context):
+    user_id = uid(update)
+    await adb.write(ensure_user, user_id)
+    args = context.args
+    rules = await adb.read(get_recurring, user_id)
+    if not args:
+        if not rules:
+            await update.message.reply_text("Регулярных операций нет.\n" + RECURRING_USAGE)
+            return
+        msg = "🔁 Регулярные операции:\n"
+        for i, rule in enumerate(rules, start=1):
+            msg += f"{i}. {recurring_label(rule)}\n"
+        await update.message.reply_text(msg + "\nУдалить: /recurring del НОМЕР")
+        return
+    if args[0].lower() in ("del", "удалить"):
+        if len(args) != 2 or not args[1].isdigit() or not 1 <= int(args[1]) <= len(rules):
+            await update.message.reply_text("Укажите номер правила из списка /recurring.")
+            return
+        rule = rules[int(args[1]) - 1]
+        await adb.write(delete_recurring, user_id, rule[0])
+        await update.message.reply_text(f"🗑 Удалено: {recurring_label(rule)}\nЗаписанные операции остались в истории.")
+        return
+    try:
+        period, start, until, text = parse_recurring_args(args)
+    except ValueError:
+        await update.message.reply_text(RECURRING_USAGE)
+        return
+    try:
+        entry = (await adb.read(get_index, user_id)).parse(text)
+    except ValueError as e:
+        await update.message.reply_text(str(e))
+        return
+    if entry is None:
+        await update.message.reply_text(RECURRING_USAGE)
+        return
+    if until is not None and until < start:
+        await update.message.reply_text("Дата окончания раньше первого повторения.")
+        return
+    rule_id = await adb.write(
+        add_recurring, user_id, entry.type, entry.amount, entry.currency, entry.category, entry.note, period, start, until
+    )
+    rule = next(r for r in await adb.read(get_recurring, user_id) if r[0] == rule_id)
+    await update.message.reply_text(f"🔁 Добавлено: {recurring_label(rule)}")
+
 # ---------- Настройки ----------
 async def settings_handler(update: Update, context):
     text = update.message.text
@@ -588,6 +965,18 @@ async def settings_handler(update: Update, context):
         )
         return CATEGORY_MENU
 
+    if text == "💼 Бюджеты":
+        return await show_budgets(update)
+
+    if text == "📥 Импорт выписки":
+        await update.message.reply_text(
+            "Пришлите CSV-файл или выгрузку из банка. Нужны колонки с датой и суммой; "
+            "валюта, категория и тип операции — по возможности. Повторно загруженные "
+            "строки пропускаются.",
+            reply_markup=main_menu()
+        )
+        return MAIN_MENU
+
     if text == "🗑 Очистить базу":
         await update.message.reply_text("Вы уверены?", reply_markup=confirm_clear_menu())
         return CONFIRM_CLEAR
@@ -597,45 +986,382 @@ async def settings_handler(update: Update, context):
 async def confirm_clear(update: Update, context):
     text = update.message.text
     if text == "✅ Да":
-        clear_db()
+        await adb.write(clear_db, uid(update))
         await update.message.reply_text("База очищена.", reply_markup=main_menu())
     else:
         await update.message.reply_text("Отменено.", reply_markup=main_menu())
     return MAIN_MENU
 
+# ---------- Импорт выписок ----------
+# Bot API не отдаёт ботам файлы больше 20 МБ.
+IMPORT_MAX_SIZE = 20 * 1024 * 1024
+
+async def import_document(update: Update, context):
+    document = update.message.document
+    if document.file_size and document.file_size > IMPORT_MAX_SIZE:
+        await update.message.reply_text("Файл больше 20 МБ — разбейте выписку на части.", reply_markup=main_menu())
+        return MAIN_MENU
+    await adb.write(ensure_user, uid(update))
+    tg_file = await document.get_file()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "statement.csv")
+        await tg_file.download_to_drive(path)
+        try:
+            added, skipped, bad, bad_lines = await import_csv_chunked(uid(update), path)
+        except (ValueError, UnicodeDecodeError) as e:
+            await update.message.reply_text(f"Не удалось прочитать файл: {e}", reply_markup=main_menu())
+            return MAIN_MENU
+    msg = f"📥 Импортировано: {added}"
+    if skipped:
+        msg += f"\nУже были загружены: {skipped}"
+    if bad:
+        msg += f"\nНе распознано строк: {bad} (например, {', '.join(map(str, bad_lines))})"
+    await update.message.reply_text(msg, reply_markup=main_menu())
+    return MAIN_MENU
+
+# ---------- Экспорт ----------
+# /export [csv|jsonl] [неделя|месяц|год | ДАТА [ДАТА]] [доход|расход]
+EXPORT_PERIODS = {"week": "week", "неделя": "week", "month": "month", "месяц": "month", "year": "year", "год": "year"}
+EXPORT_TYPES = {"income": "income", "доход": "income", "expense": "expense", "расход": "expense"}
+# Bot API принимает от ботов документы до 50 МБ.
+EXPORT_MAX_SIZE = 50 * 1024 * 1024
+
+def parse_export_args(args):
+    fmt, start, end, op_type = "csv", None, None, None
+    dates = []
+    for arg in args:
+        word = arg.lower()
+        if word in ("csv", "jsonl", "json"):
+            fmt = "jsonl" if word == "json" else word
+        elif word in EXPORT_PERIODS:
+            start, end = period_bounds(EXPORT_PERIODS[word])
+        elif word in EXPORT_TYPES:
+            op_type = EXPORT_TYPES[word]
+        else:
+            dates.append(parse_date(arg))
+    if len(dates) > 2:
+        raise ValueError("Слишком много дат")
+    if dates:
+        start = dates[0].isoformat()
+        # вторая дата включается в выгрузку
+        end = (dates[1] + timedelta(days=1)).isoformat() if len(dates) == 2 else None
+    return fmt, start, end, op_type
+
+async def export_command(update: Update, context):
+    try:
+        fmt, start, end, op_type = parse_export_args(context.args)
+    except ValueError:
+        await update.message.reply_text(
+            "Формат: /export [csv|jsonl] [неделя|месяц|год или ДАТА [ДАТА]] [доход|расход]\n"
+            "Например: /export jsonl 2024-01-01 2024-03-31 расход"
+        )
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "export.gz")
+        count = await adb.read(export_operations, uid(update), path, fmt, start, end, op_type)
+        if count == 0:
+            await update.message.reply_text("Нет операций для выгрузки.")
+            return
+        if os.path.getsize(path) > EXPORT_MAX_SIZE:
+            await update.message.reply_text("Выгрузка больше 50 МБ — укажите период покороче.")
+            return
+        name = "_".join(["operations", *(d for d in (start, end) if d)]) + f".{fmt}.gz"
+        with open(path, "rb") as f:
+            await update.message.reply_document(document=f, filename=name, caption=f"📤 Операций: {count}")
+
+# ---------- Inline-режим ----------
+# /menu присылает одно сообщение с inline-кнопками, дальше всё происходит
+# в нём: нажатие — это callback_query, ответ — правка того же сообщения,
+# а не новое сообщение с клавиатурой. Что нажато, записано в callback_data:
+#   c<номер категории>~<метка>  — расход в категорию
+#   u<номер валюты>~<метка>     — другая валюта для введённой суммы
+#   i — доход, b — баланс, s — расходы за месяц, h — операции за сегодня,
+#   d<id операции> — удалить, m — вернуться в меню.
+# Метка — хэш списка категорий (или валют): если список изменился после
+# того, как меню было нарисовано, номер кнопки уже ничего не значит.
+# На сервере хранится только ожидаемая сумма: user_data["inline"].
+# Подсказки и короткие ответы приходят всплывающим окном на нажатие, а
+# меню правится, только когда меняется его содержимое.
+ALERT_LIMIT = 200  # длина текста всплывающего окна answerCallbackQuery
+
+def list_tag(items):
+    return format(zlib.crc32("\n".join(items).encode()) & 0xfff, "x")
+
+@lru_cache(maxsize=256)
+def inline_main_menu(categories):
+    tag = list_tag(categories)
+    buttons = [InlineKeyboardButton(c, callback_data=f"c{i}~{tag}") for i, c in enumerate(categories)]
+    rows = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+    rows.append([InlineKeyboardButton("💰 Доход", callback_data="i"), InlineKeyboardButton("💰 Баланс", callback_data="b")])
+    rows.append([InlineKeyboardButton("📊 Месяц", callback_data="s"), InlineKeyboardButton("📅 Сегодня", callback_data="h")])
+    return InlineKeyboardMarkup(rows)
+
+@lru_cache(maxsize=256)
+def inline_currency_menu(currencies, selected):
+    tag = list_tag(currencies)
+    buttons = [
+        InlineKeyboardButton(f"✅ {c}" if i == selected else c, callback_data=f"u{i}~{tag}")
+        for i, c in enumerate(currencies)
+    ]
+    rows = [buttons[i:i + 4] for i in range(0, len(buttons), 4)] if len(currencies) > 1 else []
+    rows.append([InlineKeyboardButton("⬅️ Назад", callback_data="m")])
+    return InlineKeyboardMarkup(rows)
+
+async def inline_menu(update: Update, context):
+    await adb.write(ensure_user, uid(update))
+    categories = await adb.read(get_all_categories, uid(update))
+    context.user_data.pop("inline", None)
+    await update.message.reply_text("Выберите категорию расхода или действие:", reply_markup=inline_main_menu(categories))
+
+async def edit_inline(query, text, markup):
+    try:
+        await query.edit_message_text(text, reply_markup=markup)
+    except BadRequest as e:
+        # повторное нажатие той же кнопки — текст и клавиатура не изменились
+        if "not modified" not in str(e):
+            raise
+
+def amount_prompt(pending):
+    title = pending["category"] or "💰 Доход"
+    return f"{title} — введите сумму в {pending['currency']}:"
+
+async def inline_callback(update: Update, context):
+    query = update.callback_query
+    data = query.data or ""
+    user_id = uid(update)
+    action, _, tag = data[1:].partition("~")
+    categories = await adb.read(get_all_categories, user_id)
+    main_text = "Выберите категорию расхода или действие:"
+
+    if data[0] in "ci":
+        currencies = await adb.read(get_all_currencies, user_id)
+        if not currencies:
+            await query.answer("Сначала добавьте валюту в разделе Валюты.", show_alert=True)
+            return
+        if data[0] == "c":
+            if tag != list_tag(categories) or not action.isdigit() or int(action) >= len(categories):
+                await query.answer("Категории изменились")
+                await edit_inline(query, main_text, inline_main_menu(categories))
+                return
+            category, op_type = categories[int(action)], "expense"
+        else:
+            category, op_type = None, "income"
+        pending = context.user_data["inline"] = {
+            "type": op_type, "category": category, "currency": currencies[0],
+            "chat_id": query.message.chat.id, "message_id": query.message.message_id,
+        }
+        if len(currencies) == 1:
+            # выбирать валюту не из чего — подсказка всплывает, меню остаётся
+            await query.answer(amount_prompt(pending))
+        else:
+            await query.answer()
+            await edit_inline(query, amount_prompt(pending), inline_currency_menu(currencies, 0))
+        return
+
+    if data[0] == "u":
+        pending = context.user_data.get("inline")
+        currencies = await adb.read(get_all_currencies, user_id)
+        if pending is None or tag != list_tag(currencies) or not action.isdigit() or int(action) >= len(currencies):
+            await query.answer()
+            await edit_inline(query, main_text, inline_main_menu(categories))
+            return
+        pending["currency"] = currencies[int(action)]
+        await query.answer()
+        await edit_inline(query, amount_prompt(pending), inline_currency_menu(currencies, int(action)))
+        return
+
+    context.user_data.pop("inline", None)
+    if data[0] in "bs":
+        if data[0] == "b":
+            msg = await balance_text(user_id, base_currency(context))
+        else:
+            msg = await stats_text(user_id, *STATS_PERIODS["📊 Расходы по категориям (месяц)"], base_currency(context))
+        # короткий ответ — всплывающим окном, без правки меню
+        if len(msg.strip()) <= ALERT_LIMIT:
+            await query.answer(msg.strip(), show_alert=True)
+        else:
+            await query.answer()
+            await edit_inline(query, msg, inline_main_menu(categories))
+    elif data[0] == "h":
+        await query.answer()
+        await edit_inline(query, *await inline_today(user_id))
+    elif data[0] == "d" and action.isdigit():
+        if await adb.write(delete_operation, user_id, int(action)):
+            await query.answer("🗑 Операция удалена")
+        else:
+            await query.answer(ARCHIVED_TEXT, show_alert=True)
+        await edit_inline(query, *await inline_today(user_id))
+    else:
+        await query.answer()
+        await edit_inline(query, main_text, inline_main_menu(categories))
+
+# Операции за сегодня (первая страница) с кнопкой удаления у каждой.
+async def inline_today(user_id):
+    start, end = period_bounds("day", datetime.now().date())
+    rows, more = await adb.read(get_operations_page, user_id, start, end)
+    if not rows:
+        return "📅 Сегодня операций нет.", InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Назад", callback_data="m")]])
+    msg = f"📅 Операции за {start}:\n\n"
+    buttons = []
+    for i, (op_id, t, a, c, cat, d) in enumerate(rows):
+        sign = "💰" if t == "income" else "💸"
+        cat_txt = f" ({cat})" if cat else ""
+        msg += f"{NUMBERS[i]} {sign} {a} {c}{cat_txt}\n"
+        buttons.append(InlineKeyboardButton(f"🗑 {i + 1}", callback_data=f"d{op_id}"))
+    if more:
+        msg += "\nОстальные — в 📅 Истории."
+    rows = [buttons[i:i + 5] for i in range(0, len(buttons), 5)]
+    rows.append([InlineKeyboardButton("⬅️ Назад", callback_data="m")])
+    return msg, InlineKeyboardMarkup(rows)
+
+# Сумма, введённая после выбора категории в inline-меню. Работает раньше
+# диалога (группа -1): если ждём сумму и пришло число, операция
+# записывается, меню правится на месте, а диалог это сообщение не видит.
+async def inline_amount(update: Update, context):
+    pending = context.user_data.pop("inline", None)
+    if pending is None:
+        return
+    try:
+        amount = float(update.message.text)
+    except ValueError:
+        return
+    crossing = await adb.write(add_operation_checked, uid(update), pending["type"], amount,
+                               pending["currency"], pending["category"])
+    income = pending["type"] == "income"
+    msg = f"{'💰' if income else '💸'} {amount} {pending['currency']} {'добавлено' if income else 'потрачено'}"
+    if pending["category"]:
+        msg += f" ({pending['category']})"
+    msg += budget_note(pending["category"], pending["currency"], crossing)
+    categories = await adb.read(get_all_categories, uid(update))
+    try:
+        await context.bot.edit_message_text(
+            msg + "\n\nВыберите категорию расхода или действие:",
+            chat_id=pending["chat_id"], message_id=pending["message_id"],
+            reply_markup=inline_main_menu(categories),
+        )
+    except BadRequest:
+        # меню удалено или слишком старое — отвечаем новым сообщением
+        await update.message.reply_text(msg, reply_markup=inline_main_menu(categories))
+    raise ApplicationHandlerStop
+
 # ---------- Запуск ----------
-init_db()
-app = ApplicationBuilder().token(TOKEN).build()
-
-conv = ConversationHandler(
-    entry_points=[CommandHandler("start", start)],
-    states={
-        MAIN_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, main_menu_handler)],
-        ADD_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_menu_handler)],
-        CHOOSING_CATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, choosing_category)],
-        CHOOSING_CURRENCY: [MessageHandler(filters.TEXT & ~filters.COMMAND, choosing_currency)],
-        TYPING_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, typing_amount)],
-        HISTORY_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, history_handler)],
-        TYPING_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, typing_date)],
-        STATS_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, stats_handler)],
-        SETTINGS_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, settings_handler)],
-        CONFIRM_CLEAR: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_clear)],
-
-        CURRENCY_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, currency_menu_handler)],
-        ADD_CURRENCY: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_currency_handler)],
-        DELETE_CURRENCY: [MessageHandler(filters.TEXT & ~filters.COMMAND, delete_currency_handler)],
-
-        CATEGORY_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, categories_menu_handler)],
-        ADD_CATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_category_handler)],
-        DELETE_CATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, delete_category_handler)],
-
-        CHOOSE_DELETE: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_delete)],
-        CHOOSE_EDIT: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_edit)],
-        EDIT_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_amount)],
-    },
-    fallbacks=[CommandHandler("start", start)]
-)
+lag_monitor = LoopLagMonitor() if os.getenv("FINBOT_LOOP_LAG") == "1" else None
+# метрики включаются портом FINBOT_METRICS_PORT
+metrics_server = metrics.MetricsServer() if metrics.METRICS_PORT else None
+
+async def on_startup(app):
+    await adb.start()
+    if lag_monitor:
+        lag_monitor.start()
+    if metrics_server:
+        await metrics_server.start()
+        print(f"Метрики: http://{metrics_server.listen}:{metrics_server.port}/metrics")
+
+async def on_shutdown(app):
+    if metrics_server:
+        await metrics_server.stop()
+    if lag_monitor:
+        await lag_monitor.stop()
+        print(lag_monitor.report())
+    await adb.stop()
+
+# Имена состояний для метрик: MAIN_MENU и т.д. вместо чисел.
+def state_names(states):
+    names = {value: name for name, value in globals().items() if name.isupper() and isinstance(value, int)}
+    return {state: names.get(state, str(state)) for state in states}
+
+def build_conversation():
+    return ConversationHandler(
+        entry_points=[
+            CommandHandler("start", start),
+            CommandHandler("find", find_command),
+            MessageHandler(filters.Document.ALL, import_document),
+        ],
+        states={
+            MAIN_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, main_menu_handler)],
+            ADD_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_menu_handler)],
+            CHOOSING_CATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, choosing_category)],
+            CHOOSING_CURRENCY: [MessageHandler(filters.TEXT & ~filters.COMMAND, choosing_currency)],
+            TYPING_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, typing_amount)],
+            HISTORY_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, history_handler)],
+            TYPING_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, typing_date)],
+            STATS_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, stats_handler)],
+            SETTINGS_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, settings_handler)],
+            CONFIRM_CLEAR: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_clear)],
+            CONFIRM_ENTRY: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_entry)],
+
+            CURRENCY_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, currency_menu_handler)],
+            ADD_CURRENCY: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_currency_handler)],
+            DELETE_CURRENCY: [MessageHandler(filters.TEXT & ~filters.COMMAND, delete_currency_handler)],
+
+            CATEGORY_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, categories_menu_handler)],
+            ADD_CATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_category_handler)],
+            DELETE_CATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, delete_category_handler)],
+
+            CHOOSE_DELETE: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_delete)],
+            CHOOSE_EDIT: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_edit)],
+            EDIT_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_amount)],
+
+            BUDGET_MENU: [MessageHandler(filters.TEXT & ~filters.COMMAND, budgets_menu_handler)],
+            BUDGET_CATEGORY: [MessageHandler(filters.TEXT & ~filters.COMMAND, budget_category_handler)],
+            BUDGET_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, budget_amount_handler)],
+            DELETE_BUDGET: [MessageHandler(filters.TEXT & ~filters.COMMAND, delete_budget_handler)],
+        },
+        fallbacks=[
+            CommandHandler("start", start),
+            CommandHandler("find", find_command),
+            MessageHandler(filters.Document.ALL, import_document),
+        ],
+        name="main",
+        persistent=True
+    )
+
+# jobs=False — без рассылок по расписанию: в пуле воркеров (workers.py)
+# их ведёт только первый воркер.
+def build_application(token=TOKEN, builder=None, jobs=True):
+    app = (
+        (builder or ApplicationBuilder())
+        .token(token)
+        .persistence(SQLitePersistence())
+        .concurrent_updates(ChatOrderedUpdateProcessor())
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, inline_amount), group=-1)
+    app.add_handler(build_conversation())
+    # команды работают в любом состоянии диалога и не меняют его
+    app.add_handler(CommandHandler("export", export_command))
+    app.add_handler(CommandHandler("base", base_command))
+    app.add_handler(CommandHandler("menu", inline_menu))
+    app.add_handler(CommandHandler("digest", digest_command))
+    app.add_handler(CommandHandler("recurring", recurring_command))
+    app.add_handler(CallbackQueryHandler(inline_callback))
+    # JobQueue есть только с python-telegram-bot[job-queue]
+    if jobs and app.job_queue is not None:
+        digest.schedule(app.job_queue)
+    elif jobs:
+        print("JobQueue недоступна: сводки по расписанию отключены.")
+    if metrics_server:
+        conv = app.handlers[0][0]
+        metrics.instrument_application(app, state_names(conv.states))
+    return app
+
+def main():
+    if workers.WORKERS:
+        # приёмник и FINBOT_WORKERS процессов с ботом; метрики и базу
+        # воркеры поднимают сами
+        workers.run(MODE, TOKEN)
+        return
+    if metrics_server:
+        metrics.instrument_storage()
+    init_db()
+    app = build_application()
+    print("Бот запущен.")
+    if MODE == "webhook":
+        run_webhook(app)
+    else:
+        app.run_polling()
 
-app.add_handler(conv)
-print("Бот запущен.")
-app.run_polling()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
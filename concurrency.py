@@ -0,0 +1,88 @@
+import asyncio
+import os
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+MAX_CONCURRENT_UPDATES = int(os.getenv("FINBOT_CONCURRENT_UPDATES", "32"))
+# Базовый класс держит собственный семафор до вызова do_process_update;
+# делаем его заведомо большим, а реальный лимит считаем уже после
+# очереди чата — иначе ждущие апдейты одного чата занимали бы слоты.
+_UNBOUNDED = 1 << 20
+
+
+# ---------- Параллельная обработка ----------
+# Разные чаты обрабатываются параллельно (не больше max_concurrent_updates
+# одновременно), апдейты одного чата — строго по очереди, в порядке
+# поступления: ConversationHandler видит их так же, как без параллелизма.
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates=MAX_CONCURRENT_UPDATES):
+        super().__init__(_UNBOUNDED)
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._chats = {}
+        self.active_updates = 0
+        # принятые и ещё не обработанные апдейты — по ним воркер пула
+        # (workers.py) решает, читать ли следующие
+        self.pending_updates = 0
+        self._progress = asyncio.Event()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @staticmethod
+    def chat_key(update):
+        if isinstance(update, Update):
+            if update.effective_chat is not None:
+                return update.effective_chat.id
+            if update.effective_user is not None:
+                return ("user", update.effective_user.id)
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        self.pending_updates += 1
+        try:
+            await self._process_in_order(update, coroutine)
+        finally:
+            self.pending_updates -= 1
+            self._progress.set()
+
+    # Ждёт, пока обработка какого-нибудь апдейта закончится.
+    async def wait_progress(self):
+        self._progress.clear()
+        await self._progress.wait()
+
+    async def _process_in_order(self, update, coroutine):
+        key = self.chat_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        # asyncio.Lock будит ждущих в порядке очереди, а задачи на апдейты
+        # Application создаёт в порядке получения
+        entry = self._chats.get(key)
+        if entry is None:
+            entry = self._chats[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chats[key]
+
+    async def _run(self, coroutine):
+        async with self._slots:
+            self.active_updates += 1
+            try:
+                await coroutine
+            finally:
+                self.active_updates -= 1
+
+    # Сколько апдейтов каждого чата сейчас в работе или ждут своей очереди.
+    def queue_depths(self):
+        return {key: entry[1] for key, entry in self._chats.items()}
@@ -0,0 +1,178 @@
+import asyncio
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from telegram.error import Forbidden, RetryAfter, TelegramError
+
+import storage
+from async_db import adb
+
+# Время рассылки по часам JobQueue (по умолчанию UTC).
+DIGEST_TIME = os.getenv("FINBOT_DIGEST_TIME", "09:00")
+# Сообщений в секунду: Bot API без платной рассылки пропускает около 30.
+# 0 — без ограничения (бенчмарки).
+DIGEST_RATE = int(os.getenv("FINBOT_DIGEST_RATE", "25"))
+TOP_CATEGORIES = 5
+
+MONTHS = ["январь", "февраль", "март", "апрель", "май", "июнь",
+          "июль", "август", "сентябрь", "октябрь", "ноябрь", "декабрь"]
+
+
+# ---------- Периоды ----------
+# Сводка всегда за последний закончившийся период: вчера, прошлую неделю
+# (пн–вс), прошлый месяц.
+def period_range(period, today=None):
+    today = today or datetime.now().date()
+    if period == "day":
+        start, end = today - timedelta(days=1), today
+    elif period == "week":
+        end = today - timedelta(days=today.weekday())
+        start = end - timedelta(days=7)
+    elif period == "month":
+        end = storage.month_start(today)
+        start = storage.month_start(end - timedelta(days=1))
+    else:
+        raise ValueError(f"Неизвестный период сводки: {period}")
+    return start.isoformat(), end.isoformat()
+
+
+def period_title(period, start, end):
+    first = datetime.strptime(start, "%Y-%m-%d").date()
+    if period == "day":
+        return f"за {first:%d.%m.%Y}"
+    if period == "week":
+        last = datetime.strptime(end, "%Y-%m-%d").date() - timedelta(days=1)
+        return f"за неделю {first:%d.%m}–{last:%d.%m.%Y}"
+    return f"за {MONTHS[first.month - 1]} {first.year}"
+
+
+# ---------- Текст сводки ----------
+# rows — итоги одного пользователя: (user_id, type, category, currency,
+# amount, count), как их отдаёт storage.get_digest_page.
+def render(title, rows):
+    expense_total, income_total = {}, {}
+    categories = []
+    count = 0
+    for _, op_type, category, currency, amount, n in rows:
+        count += n
+        if op_type == "income":
+            income_total[currency] = income_total.get(currency, 0) + amount
+        else:
+            expense_total[currency] = expense_total.get(currency, 0) + amount
+            categories.append((amount, category or "📦 Другое", currency))
+
+    msg = f"🗓 Итоги {title}\n"
+    if expense_total:
+        msg += "\n💸 Расходы: " + ", ".join(f"{round(a, 2)} {c}" for c, a in expense_total.items()) + "\n"
+        categories.sort(key=lambda item: -item[0])
+        for amount, category, currency in categories[:TOP_CATEGORIES]:
+            msg += f"  {category} — {round(amount, 2)} {currency}\n"
+        if len(categories) > TOP_CATEGORIES:
+            msg += f"  …и ещё {len(categories) - TOP_CATEGORIES}\n"
+    if income_total:
+        msg += "\n💰 Доходы: " + ", ".join(f"{round(a, 2)} {c}" for c, a in income_total.items()) + "\n"
+    msg += f"\nОпераций: {count}"
+    return msg
+
+
+# ---------- Рассылка ----------
+def _seconds(value):
+    return value.total_seconds() if isinstance(value, timedelta) else value
+
+
+async def _send(bot, chat_id, text):
+    for _ in range(3):
+        try:
+            await bot.send_message(chat_id, text)
+            return "sent"
+        except RetryAfter as e:
+            await asyncio.sleep(_seconds(e.retry_after))
+        except Forbidden:
+            return "blocked"
+        except TelegramError as e:
+            print(f"Сводка для чата {chat_id} не отправлена: {e}")
+            return "failed"
+    return "failed"
+
+
+# Сообщения уходят пачками по rate штук не чаще раза в секунду.
+async def _send_all(bot, messages, rate, stats):
+    loop = asyncio.get_running_loop()
+    blocked = []
+    step = rate or len(messages)
+    for i in range(0, len(messages), step):
+        started = loop.time()
+        batch = messages[i:i + step]
+        results = await asyncio.gather(*(_send(bot, chat_id, text) for _, chat_id, text in batch))
+        for (user_id, _, _), result in zip(batch, results):
+            stats[result] += 1
+            if result == "blocked":
+                blocked.append(user_id)
+        if rate:
+            await asyncio.sleep(max(0.0, 1 - (loop.time() - started)))
+    return blocked
+
+
+# Рассылка за период по всем шардам. Подписчики читаются страницами по
+# storage.DIGEST_PAGE: один запрос на страницу даёт итоги сразу всех её
+# пользователей, тексты собираются и отправляются до чтения следующей
+# страницы, так что память ограничена страницей. После каждой страницы
+# запоминается последний user_id — повторный запуск (в том числе после
+# перезапуска бота) продолжает с него и не шлёт сводку дважды.
+# Пользователи без операций за период сводку не получают; заблокировавшие
+# бота отписываются.
+async def run_digest(bot, period, today=None, rate=DIGEST_RATE):
+    start, end = period_range(period, today)
+    title = period_title(period, start, end)
+    stats = Counter()
+    for shard in range(len(storage.shards)):
+        run = await adb.read(storage.get_digest_run, shard, period, start)
+        if run and run[1]:
+            continue
+        after = run[0] if run else -1
+        while True:
+            users, totals = await adb.read(storage.get_digest_page, shard, period, start, end, after)
+            if not users:
+                break
+            stats["users"] += len(users)
+            by_user = {}
+            for row in totals:
+                by_user.setdefault(row[0], []).append(row)
+            messages = [(user_id, chat_id, render(title, by_user[user_id]))
+                        for user_id, chat_id in users if user_id in by_user]
+            for user_id in await _send_all(bot, messages, rate, stats):
+                await adb.write(storage.set_digest_subscriptions, user_id, ())
+            after = users[-1][0]
+            await adb.write(storage.save_digest_run, after, period, start)
+        if after != -1:
+            await adb.write(storage.save_digest_run, after, period, start, True)
+    return stats
+
+
+async def digest_job(context):
+    period = context.job.data
+    started = time.perf_counter()
+    stats = await run_digest(context.bot, period)
+    print(f"Сводки ({period}): {stats['sent']} отправлено из {stats['users']} подписчиков, "
+          f"{stats['blocked']} заблокировали бота, {stats['failed']} ошибок, "
+          f"{time.perf_counter() - started:.1f} с")
+
+
+# Рассылки, прерванные перезапуском бота, продолжаются сразу после старта.
+async def resume_job(context):
+    for period in storage.DIGEST_PERIODS:
+        start = period_range(period)[0]
+        runs = [await adb.read(storage.get_digest_run, shard, period, start) for shard in range(len(storage.shards))]
+        if any(run and not run[1] for run in runs):
+            context.job_queue.run_once(digest_job, 0, data=period, name=f"digest-{period}-resume")
+
+
+def schedule(job_queue):
+    at = datetime.strptime(DIGEST_TIME, "%H:%M").time()
+    job_queue.run_daily(digest_job, at, data="day", name="digest-day")
+    # дни недели в JobQueue: 0 — воскресенье, 1 — понедельник
+    job_queue.run_daily(digest_job, at, days=(1,), data="week", name="digest-week")
+    job_queue.run_monthly(digest_job, at, 1, data="month", name="digest-month")
+    job_queue.run_once(resume_job, 0, name="digest-resume")
@@ -0,0 +1,32 @@
+import csv
+import gzip
+import json
+
+from storage import iter_operation_chunks
+
+# Колонки совпадают с теми, что понимает importer, — выгрузку можно
+# загрузить обратно.
+FIELDS = ("date", "type", "amount", "currency", "category", "note")
+FORMATS = ("csv", "jsonl")
+
+
+# ---------- Экспорт ----------
+# Пишет операции пользователя в сжатый файл path, читая базу кусками.
+# Возвращает число выгруженных операций.
+def export_operations(user_id, path, fmt="csv", start=None, end=None, op_type=None):
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8", newline="", compresslevel=6) as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+        for rows in iter_operation_chunks(user_id, start, end, op_type):
+            if fmt == "csv":
+                writer.writerows(rows)
+            else:
+                f.write("".join(
+                    json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False) + "\n" for row in rows
+                ))
+            count += len(rows)
+    return count
@@ -0,0 +1,239 @@
+import codecs
+import csv
+import re
+from hashlib import blake2b
+from itertools import islice
+
+from async_db import adb
+from storage import IMPORT_BATCH, get_all_categories, get_all_currencies, import_batch, import_operations, parse_date
+
+SAMPLE_SIZE = 64 * 1024
+# Строк в одной транзакции при импорте из бота: столько времени писатель
+# шарда занят выпиской, а записи других пользователей ждут (~0,1 с).
+IMPORT_CHUNK = 2000
+
+# ---------- Колонки выписок ----------
+# Названия колонок в CSV и банковских выгрузках (Тинькофф, Сбер, Альфа,
+# англоязычные банки). Внутри списка — по убыванию приоритета: например,
+# сумма операции важнее суммы в валюте карты.
+COLUMNS = {
+    "date": ["date", "дата", "дата операции", "дата платежа", "дата проводки", "transaction date", "booking date"],
+    "amount": ["amount", "сумма", "сумма операции", "сумма платежа", "сумма в валюте операции", "сумма в валюте счёта"],
+    "currency": ["currency", "валюта", "валюта операции", "валюта платежа", "валюта счёта"],
+    "category": ["category", "категория", "категория операции"],
+    "type": ["type", "тип", "тип операции"],
+    "debit": ["debit", "расход", "списание"],
+    "credit": ["credit", "приход", "доход", "зачисление", "поступление"],
+    # описание платежа становится заметкой; note — колонка выгрузки exporter
+    "description": ["description", "описание", "назначение платежа", "комментарий", "note", "заметка"],
+    "status": ["status", "статус"],
+}
+
+INCOME_WORDS = {"income", "доход", "приход", "пополнение", "зачисление", "credit", "+"}
+EXPENSE_WORDS = {"expense", "расход", "списание", "покупка", "debit", "-"}
+FAILED_STATUSES = {"failed", "declined", "отклонено", "отменено", "отмена"}
+
+CURRENCY_ALIASES = {"₽": "RUB", "РУБ": "RUB", "РУБ.": "RUB", "RUR": "RUB", "$": "USD", "€": "EUR"}
+
+# Категории банков, которые не совпадают с базовыми по названию.
+CATEGORY_ALIASES = {
+    "супермаркеты": "еда", "продукты": "еда", "рестораны": "еда", "фастфуд": "еда", "кафе": "еда",
+    "такси": "транспорт", "местный транспорт": "транспорт", "топливо": "транспорт", "азс": "транспорт",
+    "кино": "развлечения", "развлечения": "развлечения", "музыка": "развлечения",
+    "одежда и обувь": "покупки", "маркетплейсы": "покупки", "дом и ремонт": "покупки",
+    "аптеки": "здоровье", "медицина": "здоровье", "красота": "здоровье",
+    "другое": "другое", "прочее": "другое", "остальное": "другое",
+}
+
+
+def normalize_name(text):
+    return re.sub(r"^[^\w]+", "", text.strip().lower())
+
+
+def _find_columns(header):
+    names = [h.strip().strip('"').lower() for h in header]
+    found = {}
+    for field, aliases in COLUMNS.items():
+        for alias in aliases:
+            if alias in names:
+                found[field] = names.index(alias)
+                break
+    if "date" not in found or not ({"amount", "debit", "credit"} & set(found)):
+        raise ValueError("Не нашёл колонки с датой и суммой")
+    return found
+
+
+# strptime дорог, а различных дат в выписке немного: время отбрасываем,
+# разобранные даты кэшируем на время одного файла.
+def _day_parser():
+    days = {}
+
+    def parse(text):
+        key = text.strip().replace("T", " ").split(" ", 1)[0]
+        day = days.get(key)
+        if day is None:
+            day = days[key] = parse_date(key).isoformat()
+        return day
+    return parse
+
+
+def parse_amount(text):
+    if "," not in text and " " not in text and "\xa0" not in text:
+        return float(text)
+    text = text.replace("\xa0", "").replace(" ", "").strip()
+    # десятичный разделитель — тот, что стоит последним: "1,234.56" и
+    # "1.234,56"; второй знак разделяет разряды
+    if text.rfind(",") > text.rfind("."):
+        text = text.replace(".", "").replace(",", ".")
+    else:
+        text = text.replace(",", "")
+    return float(text)
+
+
+class SemicolonDialect(csv.excel):
+    delimiter = ";"
+
+
+# ---------- Чтение файла ----------
+# Кодировка и разделитель определяются по первым 64 КБ, дальше файл
+# читается построчно — в памяти никогда не лежит целиком.
+def open_statement(path):
+    with open(path, "rb") as f:
+        sample = f.read(SAMPLE_SIZE)
+    try:
+        text = codecs.getincrementaldecoder("utf-8-sig")().decode(sample, final=False)
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError:
+        encoding = "cp1251"
+        text = sample.decode(encoding)
+    try:
+        dialect = csv.Sniffer().sniff(text, delimiters=",;\t")
+    except csv.Error:
+        dialect = SemicolonDialect if ";" in text.split("\n", 1)[0] else csv.excel
+    f = open(path, newline="", encoding=encoding)
+    return f, csv.reader(f, dialect)
+
+
+# Поток строк для storage.import_operations. Строки, которые не удалось
+# разобрать, пропускаются и считаются в stats.
+def read_statement(path, categories=(), default_currency="RUB", stats=None):
+    stats = stats if stats is not None else {}
+    stats.setdefault("bad", 0)
+    stats.setdefault("bad_lines", [])
+    by_name = {normalize_name(c): c for c in categories}
+    fallback = by_name.get("другое")
+    mapped = {}
+
+    f, reader = open_statement(path)
+    with f:
+        header = next(reader, None)
+        if header is None:
+            return
+        cols = _find_columns(header)
+        width = max(cols.values()) + 1
+        # отсутствующие колонки указывают на пустую ячейку, добавленную в
+        # конец строки, — так в цикле нет проверок «есть ли колонка»
+        i_date, i_amount, i_currency, i_category, i_type, i_debit, i_credit, i_description, i_status = (
+            cols.get(field, -1) for field in COLUMNS
+        )
+        has_amount = "amount" in cols
+        parse_day = _day_parser()
+
+        # одинаковые строки в одной выписке (две покупки кофе за день)
+        # различаются порядковым номером; счётчик общий на весь файл —
+        # выписка не обязательно отсортирована по дате
+        seen = {}
+        for line, row in enumerate(reader, start=2):
+            if len(row) < width:
+                if any(row):
+                    stats["bad"] += 1
+                    if len(stats["bad_lines"]) < 5:
+                        stats["bad_lines"].append(line)
+                continue
+            row.append("")
+            try:
+                if i_status >= 0 and row[i_status].strip().lower() in FAILED_STATUSES:
+                    continue
+                day = parse_day(row[i_date])
+
+                kind = row[i_type].strip().lower()
+                if has_amount:
+                    amount = parse_amount(row[i_amount])
+                elif row[i_credit].strip():
+                    amount = parse_amount(row[i_credit])
+                    kind = kind or "income"
+                else:
+                    amount = -parse_amount(row[i_debit])
+                    kind = kind or "expense"
+                if kind in INCOME_WORDS:
+                    op_type = "income"
+                elif kind in EXPENSE_WORDS:
+                    op_type = "expense"
+                else:
+                    op_type = "expense" if amount < 0 else "income"
+                amount = abs(amount)
+                if amount == 0:
+                    raise ValueError("нулевая сумма")
+            except ValueError:
+                stats["bad"] += 1
+                if len(stats["bad_lines"]) < 5:
+                    stats["bad_lines"].append(line)
+                continue
+
+            currency = row[i_currency].strip().upper() or default_currency
+            currency = CURRENCY_ALIASES.get(currency, currency)
+
+            raw_category = row[i_category].strip()
+            category = None
+            if op_type == "expense":
+                category = mapped.get(raw_category)
+                if category is None:
+                    name = normalize_name(raw_category)
+                    category = mapped[raw_category] = (
+                        by_name.get(name) or by_name.get(CATEGORY_ALIASES.get(name)) or fallback
+                    )
+
+            description = row[i_description].strip()
+            key = f"{day}|{op_type}|{amount:.2f}|{currency}|{raw_category}|{description}"
+            n = seen.get(key, 0)
+            seen[key] = n + 1
+            digest = blake2b(f"{key}|{n}".encode(), digest_size=12).hexdigest()
+            # описание платежа становится заметкой — по нему работает /find
+            yield op_type, amount, currency, category, day, digest, description or None
+
+
+# ---------- Импорт ----------
+def _statement_rows(user_id, path, stats):
+    currencies = get_all_currencies(user_id)
+    return read_statement(
+        path,
+        categories=get_all_categories(user_id),
+        default_currency=currencies[0] if currencies else "RUB",
+        stats=stats,
+    )
+
+
+# Возвращает (добавлено, уже было, ошибок, первые строки с ошибками).
+# Вся выписка — одной транзакцией; для скриптов.
+def import_csv(user_id, path, batch=IMPORT_BATCH):
+    stats = {}
+    added, skipped = import_operations(user_id, _statement_rows(user_id, path, stats), batch)
+    return added, skipped, stats["bad"], stats["bad_lines"]
+
+
+# То же для бота: файл разбирается в пуле чтения, а в писатель шарда
+# уходят только готовые пачки по chunk строк, каждая своей транзакцией.
+# Если импорт прервётся, записанные пачки останутся, а повторная загрузка
+# того же файла их пропустит.
+async def import_csv_chunked(user_id, path, chunk=IMPORT_CHUNK, db=adb):
+    stats = {}
+    rows = await db.read(_statement_rows, user_id, path, stats)
+    added = skipped = 0
+    while True:
+        batch = await db.read(lambda: list(islice(rows, chunk)))
+        if not batch:
+            break
+        n, dup = await db.write(import_batch, user_id, batch)
+        added += n
+        skipped += dup
+    return added, skipped, stats["bad"], stats["bad_lines"]
@@ -0,0 +1,122 @@
+# Служебные команды для базы бота.
+#
+#   python manage.py check-balances [--fix]
+#   python manage.py backfill-rollups
+#   python manage.py claim-legacy USER_ID
+#   python manage.py split-shards SOURCE_DB [--owner USER_ID]
+#   python manage.py load-rates RATES_CSV
+#   python manage.py archive [--keep-months N] [--vacuum]
+#
+# --storage/--shards переопределяют FINBOT_STORAGE/FINBOT_SHARDS.
+
+import argparse
+
+import storage
+
+
+def cmd_check_balances(args):
+    drift = storage.check_balances(fix=args.fix)
+    if not drift:
+        print("Остатки сходятся с операциями.")
+        return 0
+    print("Расхождения в balances:")
+    for user_id, currency, have, want in drift:
+        print(f"  {user_id}/{currency}: в таблице {have}, по операциям {want} (разница {have - want:+})")
+    if args.fix:
+        print("Таблица balances пересобрана.")
+    return 1
+
+
+def cmd_backfill_rollups(args):
+    storage.rebuild_rollups()
+    days = months = 0
+    for s in storage.shards:
+        with s.read() as conn:
+            days += conn.execute("SELECT COUNT(*) FROM daily_totals").fetchone()[0]
+            months += conn.execute("SELECT COUNT(*) FROM monthly_totals").fetchone()[0]
+    print(f"Сводные таблицы пересчитаны: {days} дневных и {months} месячных корзин.")
+    return 0
+
+
+def cmd_claim_legacy(args):
+    moved = storage.claim_legacy(args.user_id)
+    print(f"Пользователю {args.user_id} передано операций: {moved}.")
+    return 0
+
+
+def cmd_split_shards(args):
+    if len(storage.shards) == 1:
+        print("Шардирование выключено: запустите с --storage sharded.")
+        return 1
+    moved = storage.split_into_shards(args.source, owner=args.owner)
+    print(f"Перенесено операций: {moved} в {len(storage.shards)} шардов.")
+    return 0
+
+
+def cmd_load_rates(args):
+    import rates
+    loaded = rates.load_rates_file(args.path)
+    print(f"Загружено курсов: {loaded}, пар валют: {len(rates.get_rates().pairs)}.")
+    return 0
+
+
+def _print_report(title, sizes, latency):
+    print(f"{title}: горячих операций {sizes['hot_rows']} ({sizes['hot_bytes'] / 2**20:.1f} МБ), "
+          f"в архиве {sizes['archive_rows']} ({sizes['archive_bytes'] / 2**20:.1f} МБ)")
+    if latency:
+        print("  " + ", ".join(f"{name} {ms:.2f} мс" for name, ms in latency.items()))
+
+
+def cmd_archive(args):
+    import archive
+    cutoff = archive.archive_cutoff(args.keep_months or archive.HOT_MONTHS)
+    _print_report("До архивации", archive.size_report(), archive.latency_report())
+    moved = archive.archive(cutoff, vacuum=args.vacuum)
+    print(f"В архив перенесено операций до {cutoff}: {moved}.")
+    _print_report("После архивации", archive.size_report(), archive.latency_report())
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Служебные команды финансового бота")
+    parser.add_argument("--db", default=storage.DB_PATH, help="путь к базе")
+    parser.add_argument("--storage", default=storage.BACKEND, choices=["single", "sharded"])
+    parser.add_argument("--shards", type=int, default=storage.SHARDS)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("check-balances", help="сверить balances с operations")
+    p.add_argument("--fix", action="store_true", help="пересобрать таблицу при расхождении")
+    p.set_defaults(func=cmd_check_balances)
+
+    p = sub.add_parser("backfill-rollups", help="пересчитать daily_totals/monthly_totals по operations")
+    p.set_defaults(func=cmd_backfill_rollups)
+
+    p = sub.add_parser("claim-legacy", help="передать общие данные (user_id = 0) пользователю")
+    p.add_argument("user_id", type=int)
+    p.set_defaults(func=cmd_claim_legacy)
+
+    p = sub.add_parser("split-shards", help="разложить общую базу по шардам")
+    p.add_argument("source", help="исходная база в режиме single")
+    p.add_argument("--owner", type=int, help="кому передать общие данные (user_id = 0)")
+    p.set_defaults(func=cmd_split_shards)
+
+    p = sub.add_parser("load-rates", help="загрузить курсы валют из CSV (date, base, quote, rate)")
+    p.add_argument("path")
+    p.set_defaults(func=cmd_load_rates)
+
+    p = sub.add_parser("archive", help="перенести закрытые месяцы в архивные файлы по годам")
+    p.add_argument("--keep-months", type=int, default=None, help="сколько месяцев оставить горячими (FINBOT_HOT_MONTHS)")
+    p.add_argument("--vacuum", action="store_true", help="сжать базу и архивы после переноса")
+    p.set_defaults(func=cmd_archive)
+
+    args = parser.parse_args()
+    storage.configure(args.db, args.storage, args.shards)
+    storage.init_db()
+    try:
+        return args.func(args)
+    finally:
+        storage.close_all()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,390 @@
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+from time import perf_counter
+from bisect import bisect_left
+from collections import deque
+
+from telegram.ext import ApplicationHandlerStop, ConversationHandler
+
+# 0 — метрики выключены; слушаем только localhost, наружу порт не нужен
+METRICS_PORT = int(os.getenv("FINBOT_METRICS_PORT", "0"))
+METRICS_LISTEN = os.getenv("FINBOT_METRICS_LISTEN", "127.0.0.1")
+SLOW_QUERY_MS = float(os.getenv("FINBOT_SLOW_QUERY_MS", "100"))
+
+HANDLER_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+
+# ---------- Метрики ----------
+# Гистограммы с фиксированными корзинами, как в Prometheus: наблюдение —
+# bisect и два сложения под замком, без выделения памяти.
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    def __init__(self, name, help, label, buckets):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} histogram")
+        with self._lock:
+            items = [(key, list(series)) for key, series in self.series.items()]
+        for key, series in sorted(items):
+            label = f'{self.label}="{_escape(key)}"'
+            total = 0
+            for bound, count in zip(self.buckets, series):
+                total += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {total}')
+            total += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {total}')
+            lines.append(f"{self.name}_sum{{{label}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{label}}} {total}")
+
+
+# Гистограмма запросов: в каждой серии ещё и число строк.
+class StatementHistogram(Histogram):
+    def __init__(self, name, help, buckets, rows_name, rows_help):
+        super().__init__(name, help, "statement", buckets)
+        self.rows_name = rows_name
+        self.rows_help = rows_help
+
+    def observe(self, key, value, rows=0):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 1) + [0, 0.0]
+            series[index] += 1
+            series[-2] += rows
+            series[-1] += value
+
+    def render(self, lines):
+        super().render(lines)
+        lines.append(f"# HELP {self.rows_name} {self.rows_help}")
+        lines.append(f"# TYPE {self.rows_name} counter")
+        with self._lock:
+            items = sorted((key, series[-2]) for key, series in self.series.items())
+        for key, rows in items:
+            lines.append(f'{self.rows_name}{{statement="{_escape(key)}"}} {rows}')
+
+
+class Counter:
+    def __init__(self, name, help, label):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, key, value=1):
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} counter")
+        with self._lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{{{self.label}="{_escape(key)}"}} {value}')
+
+
+# Счётчик, который ведёт кто-то другой (например, storage): значения
+# снимаются в момент запроса /metrics.
+class CounterView(Counter):
+    def __init__(self, name, help, label, fn):
+        super().__init__(name, help, label)
+        self.fn = fn
+
+    def render(self, lines):
+        values = self.fn()
+        with self._lock:
+            self.values = values
+        super().render(lines)
+
+
+# Значение снимается в момент запроса /metrics.
+class Gauge:
+    def __init__(self, name, help, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} gauge")
+        lines.append(f"{self.name} {self.fn()}")
+
+
+HANDLER_SECONDS = Histogram("finbot_handler_seconds", "Время обработчика", "handler", HANDLER_BUCKETS)
+STATE_SECONDS = Histogram("finbot_state_seconds", "Время обработки по состоянию диалога", "state", HANDLER_BUCKETS)
+HANDLER_ERRORS = Counter("finbot_handler_errors_total", "Исключения в обработчиках", "handler")
+SQL_SECONDS = StatementHistogram("finbot_sql_seconds", "Время SQL-запроса вместе с чтением строк", SQL_BUCKETS,
+                                 "finbot_sql_rows_total", "Строк прочитано или изменено")
+SQL_SLOW = Counter("finbot_sql_slow_total", "Запросов дольше FINBOT_SLOW_QUERY_MS", "statement")
+
+registry = [HANDLER_SECONDS, STATE_SECONDS, HANDLER_ERRORS, SQL_SECONDS, SQL_SLOW]
+
+
+def gauge(name, help, fn):
+    registry.append(Gauge(name, help, fn))
+
+
+def render():
+    lines = []
+    for metric in registry:
+        metric.render(lines)
+    return "\n".join(lines) + "\n"
+
+
+# ---------- SQL ----------
+# Метка запроса — его текст без лишних пробелов; списки "?, ?, ..." и
+# имена архивов сворачиваются, чтобы число меток не росло с данными.
+_labels = {}
+_MAX_LABELS = 2000
+_PLACEHOLDERS = re.compile(r"\?(?:\s*,\s*\?)+")
+_ARCHIVE = re.compile(r"archive_\d{4}")
+
+slow_queries = deque(maxlen=100)
+slow_query_threshold = SLOW_QUERY_MS / 1000
+
+
+def statement_label(sql):
+    label = _labels.get(sql)
+    if label is None:
+        label = " ".join(sql.split())
+        label = _ARCHIVE.sub("archive_N", _PLACEHOLDERS.sub("?, ...", label))[:200]
+        if len(_labels) < _MAX_LABELS:
+            _labels[sql] = label
+    return label
+
+
+def _record(connection, sql, params, elapsed, rows):
+    label = _labels.get(sql) or statement_label(sql)
+    SQL_SECONDS.observe(label, elapsed, rows)
+    if elapsed >= slow_query_threshold:
+        _log_slow(connection, label, sql, params, elapsed)
+
+
+def _log_slow(connection, label, sql, params, elapsed):
+    SQL_SLOW.inc(label)
+    plan = []
+    if params is not None and not sql.lstrip().upper().startswith(("BEGIN", "COMMIT", "ROLLBACK", "VACUUM", "PRAGMA", "ATTACH")):
+        try:
+            plan = [row[-1] for row in _execute(connection, "EXPLAIN QUERY PLAN " + sql, params)]
+        except sqlite3.Error:
+            pass
+    slow_queries.append((time.time(), elapsed, label, plan))
+    print(f"Медленный запрос {elapsed * 1000:.1f} мс: {label}")
+    for line in plan:
+        print(f"  {line}")
+
+
+# Время запроса — от execute до последней прочитанной строки. Запрос без
+# результата записывается сразу, SELECT — когда результат дочитан
+# (fetchall, fetchone, конец итерации). Недочитанный SELECT не
+# записывается: __del__ на каждом курсоре стоил бы дороже самих замеров.
+# Всё, что можно, вызывается напрямую через методы sqlite3 — на запрос
+# уходит несколько микросекунд.
+_execute = sqlite3.Connection.execute
+_cursor = sqlite3.Connection.cursor
+_cursor_execute = sqlite3.Cursor.execute
+_cursor_executemany = sqlite3.Cursor.executemany
+_fetchone = sqlite3.Cursor.fetchone
+_fetchmany = sqlite3.Cursor.fetchmany
+_fetchall = sqlite3.Cursor.fetchall
+_next = sqlite3.Cursor.__next__
+
+
+class TimedCursor(sqlite3.Cursor):
+    _sql = None
+
+    def fetchone(self):
+        start = perf_counter()
+        row = _fetchone(self)
+        sql = self._sql
+        if sql is not None:
+            self._sql = None
+            _record(self.connection, sql, self._params, self._elapsed + perf_counter() - start, self._rows + (row is not None))
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        start = perf_counter()
+        rows = _fetchmany(self, size)
+        if self._sql is not None:
+            self._elapsed += perf_counter() - start
+            self._rows += len(rows)
+            if len(rows) < size:
+                self._done(0, 0)
+        return rows
+
+    def fetchall(self):
+        start = perf_counter()
+        rows = _fetchall(self)
+        sql = self._sql
+        if sql is not None:
+            self._sql = None
+            _record(self.connection, sql, self._params, self._elapsed + perf_counter() - start, self._rows + len(rows))
+        return rows
+
+    def __next__(self):
+        start = perf_counter()
+        try:
+            row = _next(self)
+        except StopIteration:
+            if self._sql is not None:
+                self._done(perf_counter() - start, 0)
+            raise
+        if self._sql is not None:
+            self._elapsed += perf_counter() - start
+            self._rows += 1
+        return row
+
+    def _done(self, elapsed, rows):
+        sql, self._sql = self._sql, None
+        _record(self.connection, sql, self._params, self._elapsed + elapsed, self._rows + rows)
+
+
+class TimedConnection(sqlite3.Connection):
+    def execute(self, sql, params=()):
+        cursor = _cursor(self, TimedCursor)
+        start = perf_counter()
+        try:
+            _cursor_execute(cursor, sql, params)
+        except sqlite3.Error:
+            _record(self, sql, None, perf_counter() - start, 0)
+            raise
+        elapsed = perf_counter() - start
+        if cursor.description is None:
+            _record(self, sql, params, elapsed, max(cursor.rowcount, 0))
+        else:
+            cursor._sql, cursor._params, cursor._elapsed, cursor._rows = sql, params, elapsed, 0
+        return cursor
+
+    def executemany(self, sql, params):
+        cursor = _cursor(self, TimedCursor)
+        start = perf_counter()
+        try:
+            _cursor_executemany(cursor, sql, params)
+        finally:
+            _record(self, sql, None, perf_counter() - start, max(cursor.rowcount, 0))
+        return cursor
+
+
+# Соединения, открытые после вызова, замеряют свои запросы.
+def instrument_storage():
+    import storage
+    storage.connection_factory = TimedConnection
+
+    def ref_cache():
+        stats = storage.get_ref_cache_stats()
+        return {"hit": stats["hits"], "miss": stats["misses"]}
+    registry.append(CounterView("finbot_ref_cache_total", "Обращения к кэшу справочников", "result", ref_cache))
+
+
+# ---------- Обработчики ----------
+# Каждый обработчик оборачивается отдельно для каждого состояния, в
+# котором он стоит: время пишется и по имени функции, и по состоянию.
+def _timed(callback, state):
+    handler = callback.__name__
+
+    async def timed(update, context):
+        start = perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            # так обработчик группы -1 (inline_amount — сумма после выбора
+            # категории в inline-меню) говорит, что апдейт обработан, — это
+            # не ошибка
+            raise
+        except Exception:
+            HANDLER_ERRORS.inc(handler)
+            raise
+        finally:
+            elapsed = perf_counter() - start
+            HANDLER_SECONDS.observe(handler, elapsed)
+            STATE_SECONDS.observe(state, elapsed)
+    timed.__name__ = handler
+    return timed
+
+
+def instrument_application(app, state_names=None):
+    state_names = state_names or {}
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                for h in handler.entry_points:
+                    h.callback = _timed(h.callback, "entry")
+                for state, state_handlers in handler.states.items():
+                    for h in state_handlers:
+                        h.callback = _timed(h.callback, state_names.get(state, str(state)))
+                for h in handler.fallbacks:
+                    h.callback = _timed(h.callback, "fallback")
+            else:
+                handler.callback = _timed(handler.callback, "any")
+    processor = app.update_processor
+    if hasattr(processor, "active_updates"):
+        gauge("finbot_active_updates", "Апдейтов в обработке", lambda: processor.active_updates)
+        gauge("finbot_waiting_chats", "Чатов с апдейтами в работе или в очереди", lambda: len(processor.queue_depths()))
+    gauge("finbot_update_queue", "Апдейтов в очереди приложения", lambda: app.update_queue.qsize())
+
+
+# ---------- HTTP ----------
+# GET /metrics в текстовом формате Prometheus; одно соединение — один ответ.
+class MetricsServer:
+    def __init__(self, listen=METRICS_LISTEN, port=METRICS_PORT):
+        self.listen = listen
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.listen, self.port)
+        if self.port == 0:
+            self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split(" ")
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?", 1)[0] == "/metrics":
+                body = render().encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                    + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+                )
+            else:
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
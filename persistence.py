@@ -0,0 +1,196 @@
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import storage
+from async_db import adb
+
+PERSIST_INTERVAL = float(os.getenv("FINBOT_PERSIST_INTERVAL", "5"))
+# через сколько секунд повторить запись, если она не удалась
+PERSIST_RETRY = 1.0
+
+
+# ---------- Хранение состояния бота ----------
+# Состояние ConversationHandler и user_data/chat_data лежат в той же базе,
+# что и операции. Application сам передаёт сюда только изменившиеся ключи
+# раз в update_interval; они копятся в _pending и пишутся одной
+# транзакцией. user_data и chat_data читаются лениво — при первом апдейте
+# от пользователя, а не все сразу при старте; чтение идёт в пуле adb, а не
+# в цикле событий.
+class SQLitePersistence(BasePersistence):
+    def __init__(self, update_interval=PERSIST_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        # id → задача загрузки, пока она идёт (апдейты, пришедшие во время
+        # чтения, ждут её), и True, когда данные уже загружены
+        self._loaded_users = {}
+        self._loaded_chats = {}
+        self._pending = {}
+        self._flush_handle = None
+        # записи в работе: future → пачка
+        self._flushing = {}
+        self._pool = ThreadPoolExecutor(1, thread_name_prefix="persistence")
+
+    # ----- чтение -----
+    @staticmethod
+    def _query(sql, params):
+        with storage.db.read() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    async def _load(self, sql, params=()):
+        return await adb.read(self._query, sql, params)
+
+    async def _refresh(self, loaded, key, data, sql):
+        load = loaded.get(key)
+        if load is True:
+            return
+        if load is None:
+            load = loaded[key] = asyncio.ensure_future(self._fill(data, sql, key))
+        try:
+            await load
+        except Exception:
+            # не загрузилось — попробуем со следующим апдейтом
+            loaded.pop(key, None)
+            raise
+        loaded[key] = True
+
+    async def _fill(self, data, sql, key):
+        rows = await self._load(sql, (key,))
+        if rows and not data:
+            data.update(json.loads(rows[0][0]))
+
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        rows = await self._load("SELECT data FROM persist_bot_data WHERE id = 0")
+        return json.loads(rows[0][0]) if rows else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        # состояния нужны ConversationHandler до первого апдейта, поэтому
+        # их грузим целиком; это пары ключ → номер состояния
+        rows = await self._load("SELECT key, state FROM persist_conversations WHERE name = ?", (name,))
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def refresh_user_data(self, user_id, user_data):
+        await self._refresh(self._loaded_users, user_id, user_data,
+                            "SELECT data FROM persist_user_data WHERE user_id = ?")
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        await self._refresh(self._loaded_chats, chat_id, chat_data,
+                            "SELECT data FROM persist_chat_data WHERE chat_id = ?")
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # ----- запись -----
+    # Каждый update_* только запоминает последнее значение ключа и
+    # планирует запись на ближайший проход цикла: Application вызывает их
+    # пачкой через gather, и вся пачка уходит одной транзакцией.
+    def _stage(self, key, value):
+        self._pending[key] = value
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_soon(self._start_flush)
+
+    def _start_flush(self):
+        self._flush_handle = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._pool, self._write, batch)
+        self._flushing[future] = batch
+        future.add_done_callback(self._flushed)
+
+    # Пачка, которую не удалось записать, возвращается в _pending и
+    # пишется снова. Ключи, у которых уже есть значение новее (ждёт записи
+    # или пишется следующей пачкой), не возвращаются: пул в один поток
+    # пишет пачки по порядку, так что более поздние пачки ещё в _flushing.
+    def _flushed(self, future):
+        batch = self._flushing.pop(future)
+        if future.cancelled() or future.exception() is None:
+            return
+        print(f"Состояние бота не записано ({len(batch)} ключей): {future.exception()!r}, повторим")
+        for key, value in batch.items():
+            if key not in self._pending and not any(key in later for later in self._flushing.values()):
+                self._pending[key] = value
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(PERSIST_RETRY, self._start_flush)
+
+    @staticmethod
+    def _write(batch):
+        with storage.db.write() as conn:
+            for (kind, *key), value in batch.items():
+                if kind == "conversation":
+                    name, conv_key = key
+                    if value is None:
+                        conn.execute("DELETE FROM persist_conversations WHERE name = ? AND key = ?", (name, conv_key))
+                    else:
+                        conn.execute("""
+                            INSERT INTO persist_conversations (name, key, state) VALUES (?, ?, ?)
+                            ON CONFLICT(name, key) DO UPDATE SET state = excluded.state
+                        """, (name, conv_key, value))
+                elif kind == "bot":
+                    conn.execute("""
+                        INSERT INTO persist_bot_data (id, data) VALUES (0, ?)
+                        ON CONFLICT(id) DO UPDATE SET data = excluded.data
+                    """, (value,))
+                else:
+                    table, column = ("persist_user_data", "user_id") if kind == "user" else ("persist_chat_data", "chat_id")
+                    if value is None:
+                        conn.execute(f"DELETE FROM {table} WHERE {column} = ?", (key[0],))
+                    else:
+                        conn.execute(f"""
+                            INSERT INTO {table} ({column}, data) VALUES (?, ?)
+                            ON CONFLICT({column}) DO UPDATE SET data = excluded.data
+                        """, (key[0], value))
+
+    async def update_conversation(self, name, key, new_state):
+        self._stage(("conversation", name, json.dumps(list(key))),
+                    None if new_state is None else json.dumps(new_state))
+
+    async def update_user_data(self, user_id, data):
+        # сериализуем сразу: словарь продолжит меняться, пока ждёт записи
+        self._stage(("user", user_id), json.dumps(data, ensure_ascii=False) if data else None)
+
+    async def update_chat_data(self, chat_id, data):
+        self._stage(("chat", chat_id), json.dumps(data, ensure_ascii=False) if data else None)
+
+    async def update_bot_data(self, data):
+        self._stage(("bot",), json.dumps(data, ensure_ascii=False))
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id):
+        self._stage(("user", user_id), None)
+
+    async def drop_chat_data(self, chat_id):
+        self._stage(("chat", chat_id), None)
+
+    async def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._start_flush()
+        while self._flushing:
+            await asyncio.wait(list(self._flushing))
+        if self._pending:
+            # неудачные пачки — последняя попытка; ошибка уходит наружу
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            batch, self._pending = self._pending, {}
+            await asyncio.get_running_loop().run_in_executor(self._pool, self._write, batch)
+        self._pool.shutdown()
@@ -0,0 +1,186 @@
+import re
+from collections import namedtuple
+
+from importer import CATEGORY_ALIASES, CURRENCY_ALIASES, normalize_name
+from storage import get_all_categories, get_all_currencies
+
+# сумма со знаком; к ней может быть приклеена валюта: "250р", "-10usd"
+AMOUNT = re.compile(r"([+-]?)(\d+(?:[.,]\d+)?)(\D*)$")
+# из главного меню быстрым вводом считается только сообщение, которое
+# начинается с суммы: "до 5" или "встреча 12.05" — не операции
+HAS_AMOUNT = re.compile(r"\s*[+-]?\d")
+UNKNOWN_CURRENCY = re.compile(r"[A-Za-z]{3}$")
+# коды ISO 4217: трёхбуквенное слово в заметке ("bus", "gym") — не валюта
+ISO_CURRENCIES = frozenset("""
+    AED AFN ALL AMD ANG AOA ARS AUD AWG AZN BAM BBD BDT BGN BHD BIF BMD BND BOB BRL BSD BTN BWP BYN
+    BZD CAD CDF CHF CLP CNY COP CRC CUP CVE CZK DJF DKK DOP DZD EGP ERN ETB EUR FJD FKP GBP GEL GHS
+    GIP GMD GNF GTQ GYD HKD HNL HTG HUF IDR ILS INR IQD IRR ISK JMD JOD JPY KES KGS KHR KMF KPW KRW
+    KWD KYD KZT LAK LBP LKR LRD LSL LYD MAD MDL MGA MKD MMK MNT MOP MRU MUR MVR MWK MXN MYR MZN NAD
+    NGN NIO NOK NPR NZD OMR PAB PEN PGK PHP PKR PLN PYG QAR RON RSD RUB RWF SAR SBD SCR SDG SEK SGD
+    SHP SLE SOS SRD SSP STN SVC SYP SZL THB TJS TMT TND TOP TRY TTD TWD TZS UAH UGX USD UYU UZS VES
+    VND VUV WST XAF XCD XOF XPF YER ZAR ZMW ZWL
+""".split())
+MIN_PREFIX = 2
+INDEX_CACHE = 10000
+
+# сокращения, которые пишут руками, в дополнение к обозначениям из выписок
+CURRENCY_WORDS = {**CURRENCY_ALIASES, "Р": "RUB", "Р.": "RUB", "РУБЛЕЙ": "RUB", "РУБЛЯ": "RUB", "ЕВРО": "EUR"}
+
+# guessed — категория расхода не названа и подставлена «Другое»: такую
+# операцию бот сначала переспрашивает
+QuickEntry = namedtuple("QuickEntry", "type amount currency category note guessed", defaults=(False,))
+
+_AMBIGUOUS = object()
+
+
+# ---------- Индекс справочников ----------
+# Категории и валюты пользователя, разобранные заранее: каждому префиксу
+# (от двух букв) названия категории или отдельного слова в нём
+# сопоставлена категория, а если подходят несколько — пометка
+# «неоднозначно». Разбор сообщения — несколько поисков в словарях.
+class QuickIndex:
+    def __init__(self, categories, currencies):
+        self.currencies = {c.upper(): c for c in currencies}
+        for alias, code in CURRENCY_WORDS.items():
+            if code in currencies:
+                self.currencies.setdefault(alias, code)
+        self.default_currency = currencies[0] if currencies else None
+
+        self.prefixes = {}
+        names = {}
+        for category in categories:
+            name = names[category] = normalize_name(category)
+            for word in {name, *name.split()}:
+                for end in range(MIN_PREFIX, len(word) + 1):
+                    found = self.prefixes.setdefault(word[:end], category)
+                    if found != category:
+                        self.prefixes[word[:end]] = _AMBIGUOUS
+        # полное название выигрывает у префиксов других категорий;
+        # названия из нескольких слов ищутся по первому слову
+        by_name = {}
+        self.phrases = {}
+        for category, name in names.items():
+            self.prefixes[name] = category
+            by_name.setdefault(name, category)
+            words = name.split()
+            if len(words) > 1:
+                self.phrases.setdefault(words[0], []).append((words, category))
+        for options in self.phrases.values():
+            options.sort(key=lambda option: -len(option[0]))
+        # слова банковских категорий ("такси", "кафе") — только там, где
+        # не совпали с названиями самих категорий
+        for word, target in CATEGORY_ALIASES.items():
+            category = by_name.get(target)
+            if category is not None and " " not in word:
+                for end in range(MIN_PREFIX, len(word) + 1):
+                    self.prefixes.setdefault(word[:end], category)
+        self.fallback = self.prefixes.get("другое")
+
+    # Слово или его начало; окончание (до двух букв) можно отбросить:
+    # "аптека" найдёт "аптеки", "едой" — "еда".
+    def match_category(self, word):
+        found = self.prefixes.get(word)
+        for cut in (1, 2):
+            if found is not None or len(word) - cut < MIN_PREFIX:
+                break
+            found = self.prefixes.get(word[:-cut])
+        return found
+
+    # Название из нескольких слов целиком, начиная с rest[start - 1].
+    def _match_phrase(self, word, rest, start):
+        for words, category in self.phrases.get(word, ()):
+            tail = rest[start:start + len(words) - 1]
+            if len(tail) == len(words) - 1 and all(t.lower() == w for t, w in zip(tail, words[1:])):
+                return category, len(words)
+        return None
+
+    # None — в сообщении нет суммы, это не быстрый ввод. ValueError — сумма
+    # есть, но сообщение не разобрать; текст ошибки показывается как есть.
+    def parse(self, text):
+        tokens = text.split()
+        amount = sign = None
+        rest = []
+        # позиция в rest слова сразу после суммы (или приклеенного к ней)
+        near = None
+        for token in tokens:
+            if amount is None:
+                match = AMOUNT.match(token)
+                if match:
+                    sign, number, suffix = match.groups()
+                    amount = float(number.replace(",", "."))
+                    near = len(rest)
+                    if suffix:
+                        rest.append(suffix)
+                    continue
+            rest.append(token)
+        if amount is None:
+            return None
+        if amount == 0:
+            raise ValueError("Сумма должна быть больше нуля.")
+        op_type = "income" if sign == "+" else "expense"
+
+        currency = category = None
+        note = []
+        unknown = []
+        i = 0
+        while i < len(rest):
+            token = rest[i]
+            i += 1
+            if currency is None:
+                code = self.currencies.get(token.upper())
+                if code is not None:
+                    currency = code
+                    continue
+            if op_type == "expense" and category is None:
+                word = token.lower()
+                phrase = self._match_phrase(word, rest, i)
+                if phrase is not None:
+                    category, length = phrase
+                    i += length - 1
+                    continue
+                found = self.match_category(word)
+                if found is _AMBIGUOUS:
+                    raise ValueError(f"«{token}» подходит к нескольким категориям — напишите точнее.")
+                if found is not None:
+                    category = found
+                    continue
+            # код ISO заглавными или рядом с суммой ("10 gbp", "10gbp") —
+            # валюта, которой нет в списке; молча записывать сумму в другую
+            # валюту нельзя
+            if (UNKNOWN_CURRENCY.match(token) and token.upper() in ISO_CURRENCIES
+                    and (token.isupper() or i - 1 == near)):
+                unknown.append(token)
+            note.append(token)
+
+        if currency is None:
+            if unknown:
+                raise ValueError(f"Валюты {unknown[0].upper()} нет в списке — добавьте её в разделе Валюты.")
+            currency = self.default_currency
+            if currency is None:
+                raise ValueError("Сначала добавьте валюту в разделе Валюты.")
+        guessed = op_type == "expense" and category is None
+        if guessed:
+            category = self.fallback
+        return QuickEntry(op_type, amount, currency, category, " ".join(note) or None, guessed)
+
+
+def has_amount(text):
+    return HAS_AMOUNT.match(text) is not None
+
+
+# Индекс строится заново, только когда справочники пользователя изменились:
+# кэш storage отдаёт один и тот же кортеж до ближайшего изменения.
+_indexes = {}
+
+
+def get_index(user_id):
+    categories = get_all_categories(user_id)
+    currencies = get_all_currencies(user_id)
+    cached = _indexes.get(user_id)
+    if cached is not None and cached[0] is categories and cached[1] is currencies:
+        return cached[2]
+    index = QuickIndex(categories, currencies)
+    if len(_indexes) >= INDEX_CACHE:
+        _indexes.pop(next(iter(_indexes)), None)
+    _indexes[user_id] = (categories, currencies, index)
+    return index
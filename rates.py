@@ -0,0 +1,190 @@
+import bisect
+import csv
+import os
+import threading
+import time
+from datetime import date
+
+import numpy as np
+
+import storage
+
+BASE_CURRENCY = os.getenv("FINBOT_BASE_CURRENCY", "RUB")
+RATES_BATCH = 5000
+# как часто (в секундах) сверять версию курсов в базе: manage.py load-rates
+# загружает их в другом процессе, и бот подхватывает новые не позже этого
+RATES_CHECK = float(os.getenv("FINBOT_RATES_CHECK", "60"))
+
+
+# ---------- Таблица курсов в памяти ----------
+# Для каждой пары валют — отсортированные массивы дней (date.toordinal())
+# и курсов. Обратные пары строятся при загрузке, кросс-курс считается
+# через одну промежуточную валюту. Курс на день — последний известный на
+# эту дату; для дней раньше первой котировки берётся первая.
+class RateTable:
+    def __init__(self, rows):
+        grouped = {}
+        for base, quote, day, rate in rows:
+            days, values = grouped.setdefault((base, quote), ([], []))
+            days.append(day)
+            values.append(rate)
+        self.pairs = {}
+        for (base, quote), (days, values) in grouped.items():
+            self.pairs[(base, quote)] = (days, values, np.array(days, dtype=np.int64), np.array(values))
+            if (quote, base) not in grouped:
+                inverse = [1 / v for v in values]
+                self.pairs[(quote, base)] = (days, inverse, np.array(days, dtype=np.int64), np.array(inverse))
+        self.neighbours = {}
+        for base, quote in self.pairs:
+            self.neighbours.setdefault(base, set()).add(quote)
+
+    def __bool__(self):
+        return bool(self.pairs)
+
+    def _path(self, currency, base):
+        if currency == base:
+            return []
+        if (currency, base) in self.pairs:
+            return [(currency, base)]
+        for pivot in sorted(self.neighbours.get(currency, ())):
+            if (pivot, base) in self.pairs:
+                return [(currency, pivot), (pivot, base)]
+        return None
+
+    # Курс одной валюты на один день — bisect по списку дней.
+    def rate(self, currency, base, day):
+        path = self._path(currency, base)
+        if path is None:
+            return None
+        result = 1.0
+        for pair in path:
+            days, values = self.pairs[pair][:2]
+            result *= values[max(bisect.bisect_right(days, day) - 1, 0)]
+        return result
+
+    # Курсы для массива дней сразу: тот же поиск, но через searchsorted.
+    def factors(self, currency, base, days):
+        path = self._path(currency, base)
+        if path is None:
+            return None
+        result = np.ones(len(days))
+        for pair in path:
+            pair_days, pair_values = self.pairs[pair][2:]
+            index = np.searchsorted(pair_days, days, side="right") - 1
+            result *= pair_values[np.clip(index, 0, None)]
+        return result
+
+
+_table = None
+_version = None
+_checked = 0.0
+_lock = threading.Lock()
+
+
+def get_rates():
+    global _table, _version, _checked
+    now = time.monotonic()
+    if _table is None or now - _checked >= RATES_CHECK:
+        with _lock:
+            if _table is None or now - _checked >= RATES_CHECK:
+                if _table is None or storage.get_rates_version() != _version:
+                    _version, rows = storage.get_all_rates()
+                    _table = RateTable(rows)
+                _checked = now
+    return _table
+
+
+def reload_rates():
+    global _table
+    with _lock:
+        _table = None
+    return get_rates()
+
+
+# CSV с колонками date, base, quote, rate (1 base = rate quote).
+# Файл читается потоком и пишется пачками.
+def load_rates_file(path):
+    loaded = 0
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        batch = []
+        for row in csv.DictReader(f):
+            batch.append((
+                row["base"].strip().upper(),
+                row["quote"].strip().upper(),
+                storage.parse_date(row["date"]).isoformat(),
+                float(row["rate"]),
+            ))
+            if len(batch) >= RATES_BATCH:
+                storage.save_rates(batch)
+                loaded += len(batch)
+                batch = []
+        if batch:
+            storage.save_rates(batch)
+            loaded += len(batch)
+    reload_rates()
+    return loaded
+
+
+# ---------- Пересчёт в базовую валюту ----------
+# Суммы одной валюты переводятся по курсу на день операции. Возвращает
+# массив сумм в base или None, если курса для валюты нет.
+def convert(currency, base, days, amounts):
+    amounts = np.asarray(amounts, dtype=float)
+    if currency == base:
+        return amounts
+    factors = get_rates().factors(currency, base, np.asarray(days, dtype=np.int64))
+    return None if factors is None else amounts * factors
+
+
+def _by_currency(rows):
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row[-2], []).append(row)
+    return grouped
+
+
+# Статистика по категориям за [start, end) в одной валюте. Пересчитываются
+# дневные суммы из daily_totals — это то же, что пересчёт каждой операции
+# по курсу её дня, но строк в сотни раз меньше.
+# Возвращает ([(категория, сумма)], валюты без курса) или None, если
+# курсы не загружены.
+def consolidated_stats(user_id, start, end, base=BASE_CURRENCY, op_type="expense"):
+    if not get_rates():
+        return None
+    rows = storage.get_daily_totals(user_id, start, end, op_type)
+    categories = sorted({r[1] or "" for r in rows})
+    code = {c: i for i, c in enumerate(categories)}
+    totals = np.zeros(len(categories))
+    missing = set()
+    for currency, group in _by_currency(rows).items():
+        days, cats, _, amounts = zip(*group)
+        converted = convert(currency, base, days, amounts)
+        if converted is None:
+            missing.add(currency)
+            continue
+        totals += np.bincount([code[c or ""] for c in cats], weights=converted, minlength=len(categories))
+    stats = [(c or None, float(t)) for c, t in zip(categories, totals) if t]
+    stats.sort(key=lambda item: -item[1])
+    return stats, sorted(missing)
+
+
+# Общий баланс в base: по курсам на даты операций и по курсу на сегодня.
+# Возвращает (по датам операций, по текущему курсу, валюты без курса)
+# или None, если курсы не загружены.
+def consolidated_balance(user_id, base=BASE_CURRENCY, today=None):
+    rates = get_rates()
+    if not rates:
+        return None
+    today = (today or date.today()).toordinal()
+    at_dates = at_today = 0.0
+    missing = set()
+    for currency, group in _by_currency(storage.get_daily_flows(user_id)).items():
+        days, _, amounts = zip(*group)
+        converted = convert(currency, base, days, amounts)
+        rate = 1.0 if currency == base else rates.rate(currency, base, today)
+        if converted is None or rate is None:
+            missing.add(currency)
+            continue
+        at_dates += float(converted.sum())
+        at_today += sum(amounts) * rate
+    return at_dates, at_today, sorted(missing)
@@ -0,0 +1,2077 @@
+import calendar
+import glob
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import islice
+from urllib.request import pathname2url
+
+DB_PATH = os.getenv("FINBOT_DB", "finance.db")
+READERS = 4
+
+# single — все пользователи в одном файле, user_id ведёт каждый индекс;
+# sharded — FINBOT_SHARDS файлов, файл выбирается по хэшу user_id, так что
+# записи разных пользователей не делят одну блокировку.
+BACKEND = os.getenv("FINBOT_STORAGE", "single")
+SHARDS = int(os.getenv("FINBOT_SHARDS", "8"))
+# сколько пользователей держат в памяти кэши справочников, версий данных
+# и регулярных операций; давно не активные вытесняются и при следующем
+# обращении читаются из базы заново
+USER_CACHE = int(os.getenv("FINBOT_USER_CACHE", "10000"))
+
+BASE_CATEGORIES = ["🍔 Еда", "🚕 Транспорт", "🎮 Развлечения", "🛒 Покупки", "💊 Здоровье", "📦 Другое"]
+
+# Настройки соединения: WAL позволяет читателям не блокировать писателя,
+# synchronous=NORMAL в WAL делает fsync только на чекпоинтах.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Класс соединения; metrics.py подменяет его на замеряющий время запросов.
+connection_factory = sqlite3.Connection
+
+
+# ---------- Соединения ----------
+# Долгоживущие соединения с одной базой: один писатель и пул читателей.
+# Соединения открываются лениво и переиспользуются, поэтому sqlite3 держит
+# для каждого из них кэш подготовленных запросов.
+class Storage:
+    def __init__(self, path=DB_PATH, readers=READERS):
+        self.path = path
+        self.readers = readers
+        self._write_lock = threading.RLock()
+        self._writer = None
+        self._archive_writer = None
+        self._depth = 0
+        self._after_commit = []
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(readers)
+        # архивы закрытых лет: {год: путь}, подключаются к каждому
+        # соединению через ATTACH как archive_ГГГГ
+        self.archives = {}
+        self.archived_until = None
+        self._archive_version = 0
+        self._attached = {}
+        self.discover_archives()
+
+    def _connect(self, readonly=False):
+        conn = sqlite3.connect(
+            _file_uri(self.path),
+            uri=True,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=256,
+            factory=connection_factory,
+        )
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        if readonly:
+            conn.execute("PRAGMA query_only=1")
+        # нужна миграции _migration_search на базах, где она ещё не прошла;
+        # триггеры после _migration_search_terms её не вызывают
+        conn.create_function("fts_terms", 2, fts_terms, deterministic=True)
+        return conn
+
+    def _writer_conn(self):
+        if self._writer is None:
+            self._writer = self._connect()
+        return self._writer
+
+    def archive_path(self, year):
+        stem, ext = os.path.splitext(self.path)
+        return f"{stem}.archive_{year}{ext or '.db'}"
+
+    # словарь архивов заменяется целиком: его читают потоки чтения и записи
+    def discover_archives(self):
+        pattern = re.compile(r"\.archive_(\d{4})\.")
+        found = {}
+        for path in glob.glob(self.archive_path("*")):
+            match = pattern.search(os.path.basename(path))
+            if match:
+                found[int(match.group(1))] = path
+        self.archives = found
+        self._archive_version += 1
+
+    def add_archive(self, year, path):
+        self.archives = {**self.archives, year: path}
+        self._archive_version += 1
+
+    # ATTACH нельзя выполнить внутри транзакции, поэтому новые архивы
+    # подключаются при следующей выдаче соединения. Архивы подключаются
+    # только для чтения (mode=ro) везде, кроме соединения archive_write().
+    def _attach(self, conn, mode="ro"):
+        if self._attached.get(conn) == self._archive_version:
+            return
+        attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+        for year, path in sorted(self.archives.items()):
+            if f"archive_{year}" not in attached:
+                conn.execute(f"ATTACH DATABASE ? AS archive_{year}", (_file_uri(path, mode),))
+        self._attached[conn] = self._archive_version
+
+    # Вложенный write() в том же потоке не открывает новую транзакцию,
+    # а ставит SAVEPOINT: так несколько хелперов можно выполнить одним
+    # коммитом, и ошибка одного откатывает только его изменения.
+    @contextmanager
+    def write(self):
+        with self._write_lock:
+            conn = self._writer_conn()
+            depth = self._depth
+            if depth == 0:
+                self._attach(conn)
+                conn.execute("BEGIN IMMEDIATE")
+            else:
+                conn.execute(f"SAVEPOINT sp{depth}")
+            self._depth += 1
+            try:
+                yield conn
+            except BaseException:
+                if depth == 0:
+                    conn.execute("ROLLBACK")
+                    self._after_commit.clear()
+                else:
+                    conn.execute(f"ROLLBACK TO sp{depth}")
+                    conn.execute(f"RELEASE sp{depth}")
+                raise
+            else:
+                conn.execute("COMMIT" if depth == 0 else f"RELEASE sp{depth}")
+            finally:
+                self._depth -= 1
+            if depth == 0:
+                callbacks, self._after_commit = self._after_commit, []
+                for callback in callbacks:
+                    callback()
+
+    # Колбэк выполнится после COMMIT внешней транзакции — например, сброс
+    # кэша, чтобы параллельный читатель не закэшировал данные до коммита.
+    def after_commit(self, callback):
+        self._after_commit.append(callback)
+
+    # Единственный путь записи в архивы — перенос месяцев (archive_shard)
+    # и очистка истории (clear_db). У этого соединения архивы подключены на
+    # запись; главную базу оно только читает, поэтому его транзакция не
+    # спорит с писателем шарда и может идти внутри write() того же потока.
+    # Коммитится отдельно: между файлами SQLite общей атомарности нет.
+    def _archive_conn(self):
+        if self._archive_writer is None:
+            self._archive_writer = self._connect()
+        self._attach(self._archive_writer, "rw")
+        return self._archive_writer
+
+    @contextmanager
+    def archive_write(self):
+        with self._write_lock:
+            conn = self._archive_conn()
+            conn.execute("BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+
+    def set_synchronous(self, mode):
+        with self._write_lock:
+            self._writer_conn().execute(f"PRAGMA synchronous={mode}")
+
+    def vacuum(self, schema="main"):
+        with self._write_lock:
+            if schema == "main":
+                conn = self._writer_conn()
+            else:
+                # архив пишет только соединение archive_write()
+                conn = self._archive_conn()
+            conn.execute(f"VACUUM {schema}")
+            # VACUUM идёт через WAL — сбрасываем его, чтобы файл правда уменьшился
+            conn.execute(f"PRAGMA {schema}.wal_checkpoint(TRUNCATE)")
+
+    @contextmanager
+    def read(self):
+        with self._slots:
+            try:
+                conn = self._idle.pop()
+            except IndexError:
+                conn = self._connect(readonly=True)
+            try:
+                self._attach(conn)
+                yield conn
+            finally:
+                self._idle.append(conn)
+
+    def close(self):
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            if self._archive_writer is not None:
+                self._archive_writer.close()
+                self._archive_writer = None
+        while self._idle:
+            self._idle.pop().close()
+        self._attached.clear()
+
+
+def _file_uri(path, mode=None):
+    uri = "file:" + pathname2url(os.path.abspath(path))
+    return f"{uri}?mode={mode}" if mode else uri
+
+
+# ---------- Шардирование ----------
+def shard_paths(path, count):
+    stem, ext = os.path.splitext(path)
+    return [f"{stem}_{i}{ext}" for i in range(count)]
+
+
+def configure(path=DB_PATH, backend=BACKEND, shards_count=SHARDS):
+    global db, shards
+    if backend == "sharded":
+        shards = [Storage(p) for p in shard_paths(path, shards_count)]
+    elif backend == "single":
+        shards = [Storage(path)]
+    else:
+        raise ValueError(f"Неизвестный FINBOT_STORAGE: {backend}")
+    # db — основной файл: в нём же лежат служебные таблицы бота
+    db = shards[0]
+    _ref_cache.clear()
+    _known_users.clear()
+
+
+# Кэши по пользователям — OrderedDict в порядке последнего обращения:
+# сверх limit (по умолчанию USER_CACHE) записей выбрасывается самая
+# давняя, она и возвращается. Вызывается под замком своего кэша.
+def _lru_put(cache, key, value, limit=None):
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > (limit or USER_CACHE):
+        return cache.popitem(last=False)
+    return None
+
+
+def shard_index(user_id, count):
+    return zlib.crc32(str(user_id).encode()) % count
+
+
+def db_for(user_id):
+    if len(shards) == 1:
+        return shards[0]
+    return shards[shard_index(user_id, len(shards))]
+
+
+def close_all():
+    for s in shards:
+        s.close()
+
+
+# ---------- Схема ----------
+# Миграции применяются по порядку, номер последней хранится в
+# PRAGMA user_version. Каждая сама открывает транзакции, поэтому долгие
+# миграции могут идти пачками; все они идемпотентны и после сбоя
+# безопасно перезапускаются.
+MIGRATION_BATCH = 5000
+
+
+def _migration_base(s):
+    with s.write() as conn:
+        # таблица операций
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS operations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                type TEXT,
+                amount REAL,
+                currency TEXT,
+                category TEXT,
+                date TEXT
+            )
+        """)
+
+        # таблица валют
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS currencies (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                code TEXT UNIQUE
+            )
+        """)
+
+        # таблица категорий
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS categories (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE
+            )
+        """)
+
+        # базовые категории, если таблица пустая
+        if conn.execute("SELECT COUNT(*) FROM categories").fetchone()[0] == 0:
+            conn.executemany("INSERT INTO categories (name) VALUES (?)", [(c,) for c in BASE_CATEGORIES])
+
+
+def _migration_balances(s):
+    with s.write() as conn:
+        # остатки по валютам, поддерживаются при каждой записи
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS balances (
+                currency TEXT PRIMARY KEY,
+                amount REAL NOT NULL DEFAULT 0
+            )
+        """)
+
+
+DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y", "%Y-%m-%d %H:%M:%S", "%d.%m.%Y %H:%M", "%d/%m/%Y")
+
+
+def parse_date(text):
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text.strip(), fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"Неизвестный формат даты: {text!r}")
+
+
+def _migration_date_index(s):
+    # даты храним строго как YYYY-MM-DD: такие строки сортируются как даты
+    # и годятся для диапазонов date >= ? AND date < ?; приводим их пачками
+    # по id, чтобы не держать блокировку записи на всю таблицу
+    with s.read() as conn:
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM operations").fetchone()[0]
+    for lo in range(0, max_id, MIGRATION_BATCH):
+        with s.write() as conn:
+            rows = conn.execute("""
+                SELECT id, date FROM operations
+                WHERE id > ? AND id <= ?
+                AND (date IS NULL OR date NOT GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]')
+            """, (lo, lo + MIGRATION_BATCH)).fetchall()
+            fixed = []
+            for op_id, date in rows:
+                try:
+                    fixed.append((parse_date(date or "").isoformat(), op_id))
+                except ValueError:
+                    print(f"Операция {op_id}: не удалось разобрать дату {date!r}")
+            conn.executemany("UPDATE operations SET date = ? WHERE id = ?", fixed)
+
+    # каждый индекс строится в своей транзакции; amount в первом индексе
+    # делает его покрывающим для статистики по категориям
+    with s.write() as conn:
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_operations_type_date
+            ON operations (type, date, category, currency, amount)
+        """)
+    with s.write() as conn:
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_operations_date ON operations (date)")
+    with s.write() as conn:
+        conn.execute("ANALYZE operations")
+
+
+def _migration_rollups(s):
+    with s.write() as conn:
+        # суммы по дням и месяцам; категория NULL хранится как '',
+        # иначе она не совпадёт сама с собой в первичном ключе
+        for table, bucket in (("daily_totals", "day"), ("monthly_totals", "month")):
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    type TEXT NOT NULL,
+                    {bucket} TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    currency TEXT NOT NULL,
+                    amount REAL NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (type, {bucket}, category, currency)
+                ) WITHOUT ROWID
+            """)
+
+
+def _migration_users(s):
+    # у всех данных появляется владелец; старые общие данные получают
+    # user_id = 0 и переносятся командой manage.py claim-legacy
+    with s.write() as conn:
+        columns = [r[1] for r in conn.execute("PRAGMA table_info(operations)")]
+        if "user_id" not in columns:
+            conn.execute("ALTER TABLE operations ADD COLUMN user_id INTEGER NOT NULL DEFAULT 0")
+
+        # уникальность справочников теперь в пределах пользователя:
+        # ограничение UNIQUE в SQLite не меняется, таблицы пересоздаются
+        for table, column in (("currencies", "code"), ("categories", "name")):
+            conn.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+            conn.execute(f"""
+                CREATE TABLE {table} (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL DEFAULT 0,
+                    {column} TEXT NOT NULL,
+                    UNIQUE (user_id, {column})
+                )
+            """)
+            conn.execute(f"INSERT INTO {table} (id, {column}) SELECT id, {column} FROM {table}_old")
+            conn.execute(f"DROP TABLE {table}_old")
+
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                created TEXT NOT NULL
+            )
+        """)
+
+        # производные таблицы пересобираются в migrate()
+        conn.execute("DROP TABLE IF EXISTS balances")
+        conn.execute("""
+            CREATE TABLE balances (
+                user_id INTEGER NOT NULL,
+                currency TEXT NOT NULL,
+                amount REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, currency)
+            ) WITHOUT ROWID
+        """)
+        for table, bucket in (("daily_totals", "day"), ("monthly_totals", "month")):
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute(f"""
+                CREATE TABLE {table} (
+                    user_id INTEGER NOT NULL,
+                    type TEXT NOT NULL,
+                    {bucket} TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    currency TEXT NOT NULL,
+                    amount REAL NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, type, {bucket}, category, currency)
+                ) WITHOUT ROWID
+            """)
+
+    with s.write() as conn:
+        conn.execute("DROP INDEX IF EXISTS idx_operations_type_date")
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_operations_user_type_date
+            ON operations (user_id, type, date, category, currency, amount)
+        """)
+    with s.write() as conn:
+        conn.execute("DROP INDEX IF EXISTS idx_operations_date")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_operations_user_date ON operations (user_id, date)")
+
+
+def _migration_persistence(s):
+    # состояние диалогов и user_data/chat_data для SQLitePersistence
+    with s.write() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS persist_conversations (
+                name TEXT NOT NULL,
+                key TEXT NOT NULL,
+                state TEXT NOT NULL,
+                PRIMARY KEY (name, key)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS persist_user_data (
+                user_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS persist_chat_data (
+                chat_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS persist_bot_data (
+                id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL
+            )
+        """)
+
+
+def _migration_import(s):
+    # отпечаток импортированной строки: повторный импорт той же выписки
+    # не создаёт дублей; у операций, введённых вручную, он NULL
+    with s.write() as conn:
+        columns = [r[1] for r in conn.execute("PRAGMA table_info(operations)")]
+        if "import_hash" not in columns:
+            conn.execute("ALTER TABLE operations ADD COLUMN import_hash TEXT")
+        conn.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_operations_import
+            ON operations (user_id, import_hash) WHERE import_hash IS NOT NULL
+        """)
+
+
+def _migration_rates(s):
+    # исторические курсы: 1 base = rate quote на дату date
+    with s.write() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS rates (
+                base TEXT NOT NULL,
+                quote TEXT NOT NULL,
+                date TEXT NOT NULL,
+                rate REAL NOT NULL,
+                PRIMARY KEY (base, quote, date)
+            ) WITHOUT ROWID
+        """)
+
+
+def _migration_archive(s):
+    # граница архива: операции раньше archived_until лежат в архивных файлах
+    with s.write() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS archive_state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+        """)
+
+
+def _migration_digests(s):
+    # подписки на сводки: ключ начинается с периода — рассылка идёт по
+    # подписчикам одного периода в порядке user_id; digest_runs хранит,
+    # до какого пользователя дошла рассылка, чтобы после перезапуска
+    # продолжить с того же места
+    with s.write() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS digest_subscriptions (
+                period TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                PRIMARY KEY (period, user_id)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS digest_runs (
+                period TEXT NOT NULL,
+                start TEXT NOT NULL,
+                last_user INTEGER NOT NULL,
+                done INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (period, start)
+            ) WITHOUT ROWID
+        """)
+
+
+def _migration_budgets(s):
+    # месячный лимит расходов на категорию в одной валюте; категория без
+    # имени хранится как '', как в сводных таблицах
+    with s.write() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS budgets (
+                user_id INTEGER NOT NULL,
+                category TEXT NOT NULL,
+                currency TEXT NOT NULL,
+                amount REAL NOT NULL,
+                PRIMARY KEY (user_id, category, currency)
+            ) WITHOUT ROWID
+        """)
+
+
+def _migration_search(s):
+    # заметка к операции и полнотекстовый индекс по заметкам. Таблица
+    # FTS5 без своего содержимого (content=''): в ней только индекс,
+    # строки читаются из operations по rowid, операции без заметки в неё
+    # не попадают. Слова индексируются вместе с владельцем (fts_terms),
+    # поэтому поиск по началу слова перебирает только заметки одного
+    # пользователя. Индекс ведут триггеры; удаление из такой таблицы
+    # требует прежних слов — их заново считает fts_terms из OLD.*.
+    with s.write() as conn:
+        columns = [r[1] for r in conn.execute("PRAGMA table_info(operations)")]
+        if "note" not in columns:
+            conn.execute("ALTER TABLE operations ADD COLUMN note TEXT")
+        # индекс, недостроенный до сбоя, строится заново
+        conn.execute("DROP TABLE IF EXISTS operations_fts")
+        conn.execute("""
+            CREATE VIRTUAL TABLE operations_fts USING fts5(
+                terms, content='', columnsize=0, detail=none,
+                tokenize='unicode61 remove_diacritics 0'
+            )
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS operations_fts_insert AFTER INSERT ON operations
+            WHEN NEW.note IS NOT NULL BEGIN
+                INSERT INTO operations_fts (rowid, terms) VALUES (NEW.id, fts_terms(NEW.user_id, NEW.note));
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS operations_fts_delete AFTER DELETE ON operations
+            WHEN OLD.note IS NOT NULL BEGIN
+                INSERT INTO operations_fts (operations_fts, rowid, terms)
+                VALUES ('delete', OLD.id, fts_terms(OLD.user_id, OLD.note));
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS operations_fts_update AFTER UPDATE OF user_id, note ON operations BEGIN
+                INSERT INTO operations_fts (operations_fts, rowid, terms)
+                SELECT 'delete', OLD.id, fts_terms(OLD.user_id, OLD.note) WHERE OLD.note IS NOT NULL;
+                INSERT INTO operations_fts (rowid, terms)
+                SELECT NEW.id, fts_terms(NEW.user_id, NEW.note) WHERE NEW.note IS NOT NULL;
+            END
+        """)
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM operations").fetchone()[0]
+    for lo in range(0, max_id, MIGRATION_BATCH):
+        with s.write() as conn:
+            conn.execute("""
+                INSERT INTO operations_fts (rowid, terms)
+                SELECT id, fts_terms(user_id, note) FROM operations
+                WHERE id > ? AND id <= ? AND note IS NOT NULL
+            """, (lo, lo + MIGRATION_BATCH))
+    # поиск по диапазону сумм без перебора всей истории пользователя
+    with s.write() as conn:
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_operations_user_amount ON operations (user_id, amount)")
+    with s.write() as conn:
+        conn.execute("ANALYZE operations")
+
+
+def _migration_recurring(s):
+    # правила регулярных операций: period — day/week/month, start — первое
+    # повторение (для month — ещё и число месяца), until — последний
+    # допустимый день или NULL; next_date — ближайшее ещё не записанное
+    # повторение, NULL — правило закончилось
+    with s.write() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS recurring (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                type TEXT NOT NULL,
+                amount REAL NOT NULL,
+                currency TEXT NOT NULL,
+                category TEXT,
+                note TEXT,
+                period TEXT NOT NULL,
+                start TEXT NOT NULL,
+                until TEXT,
+                next_date TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_recurring_user_next ON recurring (user_id, next_date)")
+
+
+def _migration_search_terms(s):
+    # слова индекса заметок хранятся в самой строке (terms), и триггеры
+    # берут их оттуда, а не из fts_terms: иначе запись в operations
+    # падала бы в любом соединении без этой функции — в консоли sqlite3,
+    # в скриптах бэкапа и починки. terms считают те, кто пишет строки:
+    # add_operation, _import_chunk, claim_legacy, split_into_shards.
+    with s.write() as conn:
+        columns = [r[1] for r in conn.execute("PRAGMA table_info(operations)")]
+        if "terms" not in columns:
+            conn.execute("ALTER TABLE operations ADD COLUMN terms TEXT")
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM operations").fetchone()[0]
+    # прежний триггер обновления срабатывает только на user_id и note
+    for lo in range(0, max_id, MIGRATION_BATCH):
+        with s.write() as conn:
+            conn.execute("""
+                UPDATE operations SET terms = fts_terms(user_id, note)
+                WHERE id > ? AND id <= ? AND note IS NOT NULL
+            """, (lo, lo + MIGRATION_BATCH))
+    with s.write() as conn:
+        for name in ("insert", "delete", "update"):
+            conn.execute(f"DROP TRIGGER IF EXISTS operations_fts_{name}")
+        conn.execute("""
+            CREATE TRIGGER operations_fts_insert AFTER INSERT ON operations
+            WHEN NEW.terms IS NOT NULL BEGIN
+                INSERT INTO operations_fts (rowid, terms) VALUES (NEW.id, NEW.terms);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER operations_fts_delete AFTER DELETE ON operations
+            WHEN OLD.terms IS NOT NULL BEGIN
+                INSERT INTO operations_fts (operations_fts, rowid, terms) VALUES ('delete', OLD.id, OLD.terms);
+            END
+        """)
+        conn.execute("""
+            CREATE TRIGGER operations_fts_update AFTER UPDATE OF terms ON operations BEGIN
+                INSERT INTO operations_fts (operations_fts, rowid, terms)
+                SELECT 'delete', OLD.id, OLD.terms WHERE OLD.terms IS NOT NULL;
+                INSERT INTO operations_fts (rowid, terms)
+                SELECT NEW.id, NEW.terms WHERE NEW.terms IS NOT NULL;
+            END
+        """)
+
+
+def _migration_rates_version(s):
+    # номер версии курсов: save_rates увеличивает его в той же транзакции,
+    # по нему процессы бота замечают курсы, загруженные manage.py
+    with s.write() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS rates_version (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                version INTEGER NOT NULL
+            )
+        """)
+        conn.execute("INSERT OR IGNORE INTO rates_version (id, version) VALUES (0, 0)")
+
+
+MIGRATIONS = [
+    _migration_base,
+    _migration_balances,
+    _migration_date_index,
+    _migration_rollups,
+    _migration_users,
+    _migration_persistence,
+    _migration_import,
+    _migration_rates,
+    _migration_archive,
+    _migration_digests,
+    _migration_budgets,
+    _migration_search,
+    _migration_recurring,
+    _migration_search_terms,
+    _migration_rates_version,
+]
+
+
+def migrate(s):
+    with s.read() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS, start=1):
+        if number <= version:
+            continue
+        migration(s)
+        with s.write() as conn:
+            conn.execute(f"PRAGMA user_version = {number}")
+    if version < len(MIGRATIONS):
+        # производные таблицы всегда строятся текущим кодом, а не тем,
+        # что был актуален на момент старой миграции
+        with s.write() as conn:
+            _rebuild_aggregates(conn)
+    return len(MIGRATIONS)
+
+
+def init_db():
+    for s in shards:
+        migrate(s)
+
+
+# ---------- Периоды ----------
+# Все выборки по датам — полуинтервалы [start, end) в виде YYYY-MM-DD.
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def period_bounds(period, day=None):
+    if day is None:
+        day = datetime.now().date()
+    if period == "day":
+        start, end = day, day + timedelta(days=1)
+    elif period == "week":
+        start = day - timedelta(days=day.weekday())
+        end = start + timedelta(days=7)
+    elif period == "month":
+        start = month_start(day)
+        end = next_month(start)
+    elif period == "year":
+        start, end = day.replace(month=1, day=1), day.replace(year=day.year + 1, month=1, day=1)
+    else:
+        raise ValueError(f"Неизвестный период: {period}")
+    return start.isoformat(), end.isoformat()
+
+
+# ---------- Остатки ----------
+def _apply_balance(conn, user_id, op_type, amount, currency):
+    delta = amount if op_type == "income" else -amount
+    conn.execute("""
+        INSERT INTO balances (user_id, currency, amount) VALUES (?, ?, ?)
+        ON CONFLICT(user_id, currency) DO UPDATE SET amount = amount + excluded.amount
+    """, (user_id, currency, delta))
+
+
+def _expected_balances(conn):
+    return {(u, c): a for u, c, a in conn.execute(f"""
+        SELECT user_id, currency, SUM(CASE WHEN type = 'income' THEN amount ELSE -amount END)
+        FROM {_all_operations(conn)}
+        GROUP BY user_id, currency
+    """)}
+
+
+def _rebuild_balances(conn):
+    conn.execute("DELETE FROM balances")
+    conn.executemany(
+        "INSERT INTO balances (user_id, currency, amount) VALUES (?, ?, ?)",
+        [(u, c, a) for (u, c), a in _expected_balances(conn).items()]
+    )
+
+
+# Сверяет таблицу balances с пересчётом по operations во всех шардах.
+# Возвращает расхождения [(user_id, валюта, в таблице, по операциям)],
+# с fix=True заодно пересобирает таблицу.
+def check_balances(fix=False, tolerance=1e-6):
+    drift = []
+    for s in shards:
+        with s.write() as conn:
+            stored = {(u, c): a for u, c, a in conn.execute("SELECT user_id, currency, amount FROM balances")}
+            expected = _expected_balances(conn)
+            found = []
+            for key in sorted(set(stored) | set(expected), key=str):
+                have = stored.get(key, 0)
+                want = expected.get(key, 0)
+                if abs(have - want) > tolerance * max(1, abs(want)):
+                    found.append((*key, have, want))
+            if fix and found:
+                _rebuild_balances(conn)
+        drift.extend(found)
+    return drift
+
+
+# ---------- Сводные таблицы ----------
+# Возвращает итог месяца по (тип, категория, валюта) после изменения — его
+# сверяет с лимитом budget_crossing без отдельного чтения.
+def _apply_rollups(conn, user_id, op_type, amount, currency, category, date, count):
+    category = category or ""
+    for table, bucket, value in (("daily_totals", "day", date), ("monthly_totals", "month", date[:7])):
+        row = conn.execute(f"""
+            INSERT INTO {table} (user_id, type, {bucket}, category, currency, amount, count)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, type, {bucket}, category, currency) DO UPDATE SET
+                amount = amount + excluded.amount,
+                count = count + excluded.count
+            {"RETURNING amount" if bucket == "month" else ""}
+        """, (user_id, op_type, value, category, currency, amount, count)).fetchone()
+        if count < 0:
+            conn.execute(f"""
+                DELETE FROM {table}
+                WHERE user_id = ? AND type = ? AND {bucket} = ? AND category = ? AND currency = ? AND count <= 0
+            """, (user_id, op_type, value, category, currency))
+    return row[0]
+
+
+def _rebuild_rollups(conn):
+    global _data_epoch
+    _data_epoch += 1
+    conn.execute("DELETE FROM daily_totals")
+    conn.execute("DELETE FROM monthly_totals")
+    conn.execute(f"""
+        INSERT INTO daily_totals (user_id, type, day, category, currency, amount, count)
+        SELECT user_id, type, date, COALESCE(category, ''), currency, SUM(amount), COUNT(*)
+        FROM {_all_operations(conn)}
+        GROUP BY user_id, type, date, COALESCE(category, ''), currency
+    """)
+    conn.execute("""
+        INSERT INTO monthly_totals (user_id, type, month, category, currency, amount, count)
+        SELECT user_id, type, substr(day, 1, 7), category, currency, SUM(amount), SUM(count)
+        FROM daily_totals
+        GROUP BY user_id, type, substr(day, 1, 7), category, currency
+    """)
+
+
+def _rebuild_aggregates(conn):
+    _rebuild_balances(conn)
+    _rebuild_rollups(conn)
+
+
+def rebuild_rollups():
+    for s in shards:
+        with s.write() as conn:
+            _rebuild_rollups(conn)
+
+
+# Изменение операции сразу во всех производных таблицах.
+def _apply_aggregates(conn, user_id, op_type, amount, currency, category, date, count):
+    _apply_balance(conn, user_id, op_type, amount, currency)
+    month_total = _apply_rollups(conn, user_id, op_type, amount, currency, category, date, count)
+    _touch(user_id)
+    return month_total
+
+
+# ---------- Версии данных ----------
+# Номер версии операций пользователя в этом процессе: растёт после
+# каждого коммита, который их изменил. Кэши расчётов по операциям
+# (trends.py) сравнивают его с сохранённым и не ходят в базу, чтобы
+# узнать, устарели ли они. Пересборка сводных таблиц сдвигает эпоху —
+# устаревают все.
+#
+# Версии берутся из общего счётчика. Вытесненный пользователь получает
+# наибольшую из вытесненных версий — не меньше своей последней, так что
+# версия пользователя никогда не возвращается к значению, под которым
+# уже мог быть сохранён устаревший расчёт.
+_data_versions = OrderedDict()
+_data_counter = 0
+_data_evicted = 0
+_data_epoch = 0
+_data_lock = threading.Lock()
+
+
+def _bump(user_id):
+    global _data_counter, _data_evicted
+    with _data_lock:
+        _data_counter += 1
+        evicted = _lru_put(_data_versions, user_id, _data_counter)
+        if evicted is not None:
+            _data_evicted = max(_data_evicted, evicted[1])
+
+
+def _touch(user_id):
+    db_for(user_id).after_commit(lambda: _bump(user_id))
+
+
+def data_version(user_id):
+    with _data_lock:
+        return _data_epoch, _data_versions.get(user_id, _data_evicted)
+
+
+# Разбивает [start, end) на куски для сводных таблиц: целые месяцы берутся
+# из monthly_totals, неполные края — из daily_totals.
+def _rollup_ranges(start, end):
+    lo = datetime.strptime(start, "%Y-%m-%d").date()
+    hi = datetime.strptime(end, "%Y-%m-%d").date()
+    first = lo if lo.day == 1 else next_month(lo)
+    last = month_start(hi)
+    if first >= last:
+        return (start, end), (start, start), (end, end)
+    return (
+        (start, first.isoformat()),
+        (first.isoformat()[:7], last.isoformat()[:7]),
+        (last.isoformat(), end),
+    )
+
+
+# ---------- Архив ----------
+# Закрытые месяцы переносятся (archive.py) в файлы по годам рядом с базой
+# шарда. В архиве операции хранятся компактно: день — число
+# (date.toordinal()), тип — 0/1, таблица WITHOUT ROWID с ключом
+# (user_id, day, id), так что выборка пользователя за период читает
+# подряд идущие страницы. balances и сводные таблицы при архивации не
+# меняются — остатки и статистика продолжают учитывать старые операции.
+ARCHIVE_COLUMNS = (
+    "id, user_id, CASE kind WHEN 1 THEN 'income' ELSE 'expense' END AS type, "
+    "amount, currency, category, date(day + 1721424.5) AS date"
+)
+
+
+def _archive_aliases(conn):
+    return [row[1] for row in conn.execute("PRAGMA database_list") if row[1].startswith("archive_")]
+
+
+# Все операции шарда — горячие и архивные — как подзапрос для сверок и
+# пересборки производных таблиц.
+def _all_operations(conn):
+    parts = ["SELECT id, user_id, type, amount, currency, category, date FROM operations"]
+    parts += [f"SELECT {ARCHIVE_COLUMNS} FROM {alias}.operations" for alias in _archive_aliases(conn)]
+    return "(" + " UNION ALL ".join(parts) + ")"
+
+
+# Какие архивы нужны для [start, end): [(alias, начало, конец)]. Граница
+# архива перечитывается из базы, чтобы увидеть архивацию, сделанную
+# другим процессом (manage.py archive).
+def _archive_parts(s, conn, start, end):
+    row = conn.execute("SELECT value FROM archive_state WHERE key = 'archived_until'").fetchone()
+    until = row[0] if row else None
+    if until != s.archived_until:
+        s.archived_until = until
+        s.discover_archives()
+    if not conn.in_transaction:
+        s._attach(conn)
+    if until is None or (start is not None and start >= until):
+        return []
+    hi = until if end is None else min(end, until)
+    attached = set(_archive_aliases(conn))
+    parts = []
+    for year in sorted(s.archives):
+        if f"archive_{year}" not in attached:
+            continue
+        lo_year, hi_year = f"{year}-01-01", f"{year + 1}-01-01"
+        lo = lo_year if start is None else max(start, lo_year)
+        top = min(hi, hi_year)
+        if lo < top:
+            parts.append((f"archive_{year}", lo, top))
+    return parts
+
+
+def day_number(iso):
+    return datetime.strptime(iso, "%Y-%m-%d").toordinal()
+
+
+def _next_day(iso):
+    return (datetime.strptime(iso, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+# ---------- Пользователи ----------
+_known_users = OrderedDict()
+_users_lock = threading.Lock()
+
+
+# Новому пользователю заводятся базовые категории. Уже известные
+# пользователи отсекаются в памяти, без обращения к базе.
+def ensure_user(user_id):
+    with _users_lock:
+        if user_id in _known_users:
+            _known_users.move_to_end(user_id)
+            return
+    with db_for(user_id).write() as conn:
+        created = conn.execute(
+            "INSERT OR IGNORE INTO users (user_id, created) VALUES (?, ?)",
+            (user_id, datetime.now().isoformat(timespec="seconds"))
+        ).rowcount
+        if created:
+            conn.executemany(
+                "INSERT OR IGNORE INTO categories (user_id, name) VALUES (?, ?)",
+                [(user_id, c) for c in BASE_CATEGORIES]
+            )
+            db_for(user_id).after_commit(lambda: _invalidate_refs(user_id))
+    with _users_lock:
+        _lru_put(_known_users, user_id, True)
+
+
+# ---------- Операции ----------
+def add_operation(user_id, op_type, amount, currency, category=None, date=None, note=None):
+    return _add_operation(user_id, op_type, amount, currency, category, date, note)[0]
+
+
+# То же для бота: вместо id — проверка бюджета (см. budget_crossing) по
+# итогу месяца, который вернула запись в monthly_totals.
+def add_operation_checked(user_id, op_type, amount, currency, category=None, date=None, note=None):
+    _, spent = _add_operation(user_id, op_type, amount, currency, category, date, note)
+    if op_type != "expense":
+        return None
+    return budget_crossing(user_id, category, currency, spent, amount)
+
+
+def _add_operation(user_id, op_type, amount, currency, category, date, note):
+    if date is None:
+        date = datetime.now().strftime("%Y-%m-%d")
+    with db_for(user_id).write() as conn:
+        op_id = conn.execute(
+            """
+            INSERT INTO operations (user_id, type, amount, currency, category, date, note, terms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (user_id, op_type, amount, currency, category, date, note, fts_terms(user_id, note))
+        ).lastrowid
+        spent = _apply_aggregates(conn, user_id, op_type, amount, currency, category, date, 1)
+    return op_id, spent
+
+
+def get_balance(user_id):
+    catch_up(user_id)
+    with db_for(user_id).read() as conn:
+        return dict(conn.execute(
+            "SELECT currency, amount FROM balances WHERE user_id = ?", (user_id,)
+        ).fetchall())
+
+
+def get_operations_between(user_id, start, end):
+    catch_up(user_id, end)
+    with db_for(user_id).read() as conn:
+        return conn.execute("""
+            SELECT id, type, amount, currency, category
+            FROM operations
+            WHERE user_id = ? AND date >= ? AND date < ?
+            ORDER BY date, id
+        """, (user_id, start, end)).fetchall()
+
+
+# Страница истории за [start, end) с keyset-пагинацией по (date, id):
+# after — ключ последней строки предыдущей страницы, before — первой
+# строки следующей. Поиск начинается прямо с ключа в индексе
+# (user_id, date), поэтому глубина листания на время не влияет.
+# Возвращает (строки по возрастанию, есть ли ещё строки в ту же сторону).
+PAGE_SIZE = 10
+
+
+def get_operations_page(user_id, start, end, after=None, before=None, limit=PAGE_SIZE):
+    # граница по date сдвигается к ключу: иначе планировщик может взять
+    # нижнюю границу периода и пройти все строки до ключа
+    lo, hi, hi_op = start, end, "<"
+    key, key_op, order = None, None, "date, id"
+    if after is not None:
+        lo, key, key_op = after[0], after, ">"
+    elif before is not None:
+        hi, hi_op, key, key_op = before[0], "<=", before, "<"
+        order = "date DESC, id DESC"
+    catch_up(user_id, end)
+    target = db_for(user_id)
+    with target.read() as conn:
+        # горячая таблица и нужные архивы; каждый источник отдаёт не больше
+        # limit + 1 строк по своему индексу, общий порядок — снаружи
+        parts = [f"""
+            SELECT id, type, amount, currency, category, date FROM operations
+            WHERE user_id = ? AND date >= ? AND date {hi_op} ? {f"AND (date, id) {key_op} (?, ?)" if key else ""}
+            ORDER BY {order} LIMIT ?
+        """]
+        params = [user_id, lo, hi, *(key or ()), limit + 1]
+        for alias, a_lo, a_hi in _archive_parts(target, conn, lo, hi if hi_op == "<" else _next_day(hi)):
+            parts.append(f"""
+                SELECT id, CASE kind WHEN 1 THEN 'income' ELSE 'expense' END, amount, currency, category,
+                       date(day + 1721424.5) AS date
+                FROM {alias}.operations
+                WHERE user_id = ? AND day >= ? AND day < ? {f"AND (day, id) {key_op} (?, ?)" if key else ""}
+                ORDER BY {order.replace("date", "day")} LIMIT ?
+            """)
+            params += [user_id, day_number(a_lo), day_number(a_hi)]
+            if key:
+                params += [day_number(key[0]), key[1]]
+            params.append(limit + 1)
+        if len(parts) == 1:
+            sql = parts[0]
+        else:
+            sql = "SELECT * FROM (" + " UNION ALL ".join(f"SELECT * FROM ({p})" for p in parts) + f") ORDER BY {order} LIMIT ?"
+            params.append(limit + 1)
+        rows = conn.execute(sql, params).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if before is not None:
+        rows.reverse()
+    return rows, more
+
+
+# Выгрузка операций кусками по chunk строк (date, type, amount, currency,
+# category, note): курсор читает по мере надобности, поэтому память не
+# зависит от размера истории.
+EXPORT_CHUNK = 5000
+
+
+def iter_operation_chunks(user_id, start=None, end=None, op_type=None, chunk=EXPORT_CHUNK):
+    catch_up(user_id, end)
+    target = db_for(user_id)
+    # сначала архивы по годам (порядок ключа — тот же порядок по дате),
+    # потом горячая таблица
+    with target.read() as conn:
+        parts = _archive_parts(target, conn, start, end)
+    for alias, lo, hi in parts:
+        kind = "" if op_type is None else f"AND kind = {int(op_type == 'income')}"
+        with target.read() as conn:
+            cursor = conn.execute(f"""
+                SELECT date(day + 1721424.5), CASE kind WHEN 1 THEN 'income' ELSE 'expense' END,
+                       amount, currency, category, {_archive_note(conn, alias)}
+                FROM {alias}.operations
+                WHERE user_id = ? AND day >= ? AND day < ? {kind}
+                ORDER BY day, id
+            """, (user_id, day_number(lo), day_number(hi)))
+            while True:
+                rows = cursor.fetchmany(chunk)
+                if not rows:
+                    break
+                yield rows
+
+    where, params = ["user_id = ?"], [user_id]
+    if start is not None:
+        where.append("date >= ?")
+        params.append(start)
+    if end is not None:
+        where.append("date < ?")
+        params.append(end)
+    if op_type is not None:
+        where.append("type = ?")
+        params.append(op_type)
+    with target.read() as conn:
+        cursor = conn.execute(f"""
+            SELECT date, type, amount, currency, category, note
+            FROM operations
+            WHERE {" AND ".join(where)}
+            ORDER BY date, id
+        """, params)
+        while True:
+            rows = cursor.fetchmany(chunk)
+            if not rows:
+                break
+            yield rows
+
+
+def get_operations_by_date(user_id, date_str):
+    day = datetime.strptime(date_str, "%Y-%m-%d").date()
+    return get_operations_between(user_id, *period_bounds("day", day))
+
+
+# Меняются только горячие операции: архив закрытых месяцев только для
+# чтения. Возвращает False, если операции нет в горячей таблице.
+def delete_operation(user_id, op_id):
+    with db_for(user_id).write() as conn:
+        row = conn.execute(
+            "SELECT type, amount, currency, category, date FROM operations WHERE id = ? AND user_id = ?",
+            (op_id, user_id)
+        ).fetchone()
+        if row is None:
+            return False
+        t, a, c, cat, d = row
+        conn.execute("DELETE FROM operations WHERE id = ?", (op_id,))
+        _apply_aggregates(conn, user_id, t, -a, c, cat, d, -1)
+    return True
+
+
+# Возвращает (type, currency, category, date, изменение суммы) или False,
+# если операции нет (или она уже в архиве).
+def update_operation_amount(user_id, op_id, new_amount):
+    with db_for(user_id).write() as conn:
+        row = conn.execute(
+            "SELECT type, amount, currency, category, date FROM operations WHERE id = ? AND user_id = ?",
+            (op_id, user_id)
+        ).fetchone()
+        if row is None:
+            return False
+        t, a, c, cat, d = row
+        conn.execute(
+            "UPDATE operations SET amount = ? WHERE id = ?",
+            (new_amount, op_id)
+        )
+        spent = _apply_aggregates(conn, user_id, t, new_amount - a, c, cat, d, 0)
+    crossing = budget_crossing(user_id, cat, c, spent, new_amount - a) if t == "expense" else None
+    return t, c, cat, d, crossing
+
+
+def clear_db(user_id):
+    with db_for(user_id).write() as conn:
+        for table in ("operations", "balances", "daily_totals", "monthly_totals"):
+            conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+        with db_for(user_id).archive_write() as archive:
+            for alias in _archive_aliases(archive):
+                archive.execute(f"DELETE FROM {alias}.operations WHERE user_id = ?", (user_id,))
+        # иначе правила сразу начнут заполнять пустую историю
+        conn.execute("DELETE FROM recurring WHERE user_id = ?", (user_id,))
+        db_for(user_id).after_commit(lambda: _reset_recurring(user_id))
+        _touch(user_id)
+
+
+# Массовая вставка: rows — поток кортежей (type, amount, currency,
+# category, date, import_hash[, note]). Всё идёт одной транзакцией пачками по
+# batch строк; уже импортированные строки отбрасывает уникальный индекс,
+# а производные таблицы обновляются одним GROUP BY на пачку.
+IMPORT_BATCH = 20000
+
+
+def import_operations(user_id, rows, batch=IMPORT_BATCH):
+    added = skipped = 0
+    rows = iter(rows)
+    with db_for(user_id).write():
+        while True:
+            chunk = list(islice(rows, batch))
+            if not chunk:
+                break
+            n, dup = import_batch(user_id, chunk)
+            added += n
+            skipped += dup
+    return added, skipped
+
+
+# Одна пачка импорта. Вне import_operations — своя транзакция: бот пишет
+# выписку пачками через adb.write, и между ними проходят записи других
+# пользователей шарда. Повтор пачки после сбоя безопасен — её строки
+# отсеет import_hash.
+def import_batch(user_id, rows):
+    currencies = set()
+    with db_for(user_id).write() as conn:
+        # заметки может не быть — тогда NULL
+        added = _import_chunk(conn, [(user_id, *row, None)[:8] for row in rows], currencies)
+        # новые валюты появляются в справочнике, как после ручного добавления
+        if currencies:
+            conn.executemany(
+                "INSERT OR IGNORE INTO currencies (user_id, code) VALUES (?, ?)",
+                [(user_id, c) for c in sorted(currencies)]
+            )
+            db_for(user_id).after_commit(lambda: _invalidate_refs(user_id))
+        if added:
+            _touch(user_id)
+    return added, len(rows) - added
+
+
+def _import_chunk(conn, chunk, currencies):
+    until = conn.execute("SELECT value FROM archive_state WHERE key = 'archived_until'").fetchone()
+    if until is not None:
+        # строки из архивных месяцев уникальный индекс не увидит —
+        # их хэши проверяются по архивам
+        aliases = _archive_aliases(conn)
+        old = [row for row in chunk if row[5] < until[0] and row[6] is not None]
+        if old and aliases:
+            archived = set()
+            for alias in aliases:
+                for i in range(0, len(old), 500):
+                    part = old[i:i + 500]
+                    archived.update(r[0] for r in conn.execute(f"""
+                        SELECT import_hash FROM {alias}.operations
+                        WHERE user_id = ? AND import_hash IN ({",".join("?" * len(part))})
+                    """, (part[0][0], *(row[6] for row in part))))
+            if archived:
+                chunk = [row for row in chunk if row[6] not in archived]
+    last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM operations").fetchone()[0]
+    # пачка вставляется одной инструкцией из временной таблицы: FTS5
+    # сбрасывает накопленный индекс заметок в конце каждой инструкции, и
+    # при executemany триггер платил бы за это на каждой строке
+    conn.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS import_rows (
+            user_id, type, amount, currency, category, date, import_hash, note, terms
+        )
+    """)
+    conn.executemany("INSERT INTO temp.import_rows VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     ((*row, fts_terms(row[0], row[7])) for row in chunk))
+    added = conn.execute("""
+        INSERT OR IGNORE INTO operations (user_id, type, amount, currency, category, date, import_hash, note, terms)
+        SELECT * FROM temp.import_rows ORDER BY rowid
+    """).rowcount
+    conn.execute("DELETE FROM temp.import_rows")
+    if added:
+        _apply_aggregates_since(conn, last_id)
+        currencies.update(row[3] for row in chunk)
+    return added
+
+
+# Добавляет в производные таблицы все операции с id > last_id. Вызывается
+# под блокировкой записи, поэтому это ровно только что вставленные строки.
+# NOT INDEXED: иначе планировщик предпочитает полный обход покрывающего
+# индекса вместо диапазона по rowid.
+def _apply_aggregates_since(conn, last_id):
+    conn.execute("""
+        INSERT INTO balances (user_id, currency, amount)
+        SELECT user_id, currency, SUM(CASE WHEN type = 'income' THEN amount ELSE -amount END)
+        FROM operations NOT INDEXED WHERE id > ?
+        GROUP BY user_id, currency
+        ON CONFLICT(user_id, currency) DO UPDATE SET amount = amount + excluded.amount
+    """, (last_id,))
+    for table, bucket, expr in (("daily_totals", "day", "date"), ("monthly_totals", "month", "substr(date, 1, 7)")):
+        conn.execute(f"""
+            INSERT INTO {table} (user_id, type, {bucket}, category, currency, amount, count)
+            SELECT user_id, type, {expr}, COALESCE(category, ''), currency, SUM(amount), COUNT(*)
+            FROM operations NOT INDEXED WHERE id > ?
+            GROUP BY user_id, type, {expr}, COALESCE(category, ''), currency
+            ON CONFLICT(user_id, type, {bucket}, category, currency) DO UPDATE SET
+                amount = amount + excluded.amount,
+                count = count + excluded.count
+        """, (last_id,))
+
+
+# Статистика за [start, end) из сводных таблиц: O(число корзин), а не
+# O(число операций).
+def get_category_stats(user_id, start, end, op_type="expense"):
+    catch_up(user_id, end)
+    head, months, tail = _rollup_ranges(start, end)
+    with db_for(user_id).read() as conn:
+        return conn.execute("""
+            SELECT NULLIF(category, ''), currency, SUM(amount)
+            FROM (
+                SELECT category, currency, amount FROM daily_totals
+                WHERE user_id = ? AND type = ? AND day >= ? AND day < ?
+                UNION ALL
+                SELECT category, currency, amount FROM monthly_totals
+                WHERE user_id = ? AND type = ? AND month >= ? AND month < ?
+                UNION ALL
+                SELECT category, currency, amount FROM daily_totals
+                WHERE user_id = ? AND type = ? AND day >= ? AND day < ?
+            )
+            GROUP BY category, currency
+        """, (user_id, op_type, *head, user_id, op_type, *months, user_id, op_type, *tail)).fetchall()
+
+
+# Та же статистика прямо по operations — для сверки сводных таблиц.
+def get_category_stats_raw(user_id, start, end, op_type="expense"):
+    catch_up(user_id, end)
+    with db_for(user_id).read() as conn:
+        return conn.execute(f"""
+            SELECT category, currency, SUM(amount)
+            FROM {_all_operations(conn)}
+            WHERE user_id = ? AND type = ?
+            AND date >= ? AND date < ?
+            GROUP BY category, currency
+        """, (user_id, op_type, start, end)).fetchall()
+
+
+def get_monthly_category_stats(user_id, year_month):
+    day = datetime.strptime(year_month, "%Y-%m").date()
+    return get_category_stats(user_id, *period_bounds("month", day))
+
+
+# Дневные суммы для пересчёта в одну валюту. День отдаётся как
+# date.toordinal(): курсы ищутся по целым числам, а не по строкам.
+ORDINAL_SQL = "CAST(julianday({}) - 1721424.5 AS INTEGER)"
+
+
+def get_daily_totals(user_id, start, end, op_type="expense"):
+    catch_up(user_id, end)
+    with db_for(user_id).read() as conn:
+        return conn.execute(f"""
+            SELECT {ORDINAL_SQL.format("day")}, NULLIF(category, ''), currency, amount
+            FROM daily_totals
+            WHERE user_id = ? AND type = ? AND day >= ? AND day < ?
+        """, (user_id, op_type, start, end)).fetchall()
+
+
+# Те же суммы с днём строкой: NumPy переводит даты в числа сам, быстрее,
+# чем julianday() на каждой строке.
+def get_daily_totals_iso(user_id, start, end, op_type="expense"):
+    catch_up(user_id, end)
+    with db_for(user_id).read() as conn:
+        return conn.execute("""
+            SELECT day, NULLIF(category, ''), currency, amount
+            FROM daily_totals
+            WHERE user_id = ? AND type = ? AND day >= ? AND day < ?
+        """, (user_id, op_type, start, end)).fetchall()
+
+
+# Движение денег по дням и валютам за всё время: доходы со знаком плюс.
+def get_daily_flows(user_id):
+    catch_up(user_id)
+    with db_for(user_id).read() as conn:
+        return conn.execute(f"""
+            SELECT {ORDINAL_SQL.format("day")}, currency,
+                   SUM(CASE WHEN type = 'income' THEN amount ELSE -amount END)
+            FROM daily_totals
+            WHERE user_id = ?
+            GROUP BY day, currency
+        """, (user_id,)).fetchall()
+
+
+# ---------- Поиск ----------
+# query — условия /find: start/end — период [start, end), min/max — сумма
+# (включительно), currency, category (точное название), type и words —
+# слова, которые ищутся по началу в заметках и названиях категорий.
+# Вместо слова может стоять список равнозначных вариантов: ["такси",
+# "транспорт"] найдёт и заметку «такси», и операцию в «🚕 Транспорт».
+# Страницы — как у get_operations_page: по возрастанию (date, id),
+# after/before — ключи краёв соседней страницы. Строки: (id, type,
+# amount, currency, category, date, note).
+#
+# Заметки ищет FTS5: индекс сразу отдаёт id операций пользователя с
+# этими словами, остальные условия проверяются уже на них. Названия
+# категорий в индекс не входят: у них мало разных слов, и каждое есть в
+# огромной доле операций пользователя. Поэтому слово сравнивается с
+# категориями пользователя здесь, и совпавшие становятся условием
+# category IN (...) — его проверяет проход по индексу (user_id, date),
+# который останавливается, набрав страницу. Без слов запрос идёт по
+# индексу (user_id, date) или (user_id, amount) — что выберет
+# планировщик.
+WORD = re.compile(r"[^\W_]+")
+
+
+def _query_words(text):
+    return WORD.findall((text or "").lower())
+
+
+# Слова заметки для индекса: «<user_id>x<слово>». У каждого пользователя
+# свои слова, и поиск по началу слова («5xкоф»*) собирает совпадения
+# только его заметок, а не всех пользователей шарда.
+def fts_terms(user_id, note):
+    if note is None:
+        return None
+    return " ".join(f"{user_id}x{w}" for w in _query_words(note))
+
+
+# Слова запроса: [[вариант, ...], ...], вариант — список слов, которые
+# должны найтись все («wi-fi» — это «wi» и «fi»).
+def _word_groups(query):
+    groups = []
+    for item in query.get("words") or ():
+        options = [words for words in map(_query_words, [item] if isinstance(item, str) else item) if words]
+        if options:
+            groups.append(options)
+    return groups
+
+
+def _note_match(user_id, options):
+    return "(" + " OR ".join("(" + " AND ".join(f'"{user_id}x{w}"*' for w in words) + ")" for words in options) + ")"
+
+
+# Те же правила для строк архива и названий категорий: каждое слово
+# варианта — начало какого-нибудь слова заметки или категории.
+def _words_match(groups, note, category):
+    tokens = _query_words(f"{note or ''} {category or ''}")
+    return all(
+        any(all(any(t.startswith(w) for t in tokens) for w in words) for words in options)
+        for options in groups
+    )
+
+
+def _find_filters(query, alias=""):
+    where, params = [], []
+    for key, sql in (("min", "amount >= ?"), ("max", "amount <= ?"),
+                     ("currency", "currency = ?"), ("category", "category = ?")):
+        if query.get(key) is not None:
+            where.append(alias + sql)
+            params.append(query[key])
+    return where, params
+
+
+def _archive_note(conn, alias):
+    columns = [r[1] for r in conn.execute(f"PRAGMA {alias}.table_info(operations)")]
+    return "note" if "note" in columns else "NULL"
+
+
+def find_operations_page(user_id, query, after=None, before=None, limit=PAGE_SIZE):
+    lo, hi = query.get("start"), query.get("end")
+    key, key_op, desc = None, None, False
+    if after is not None:
+        lo, key, key_op = max(lo or "", after[0]), after, ">"
+    elif before is not None:
+        hi, key, key_op, desc = min(hi or "9999", _next_day(before[0])), before, "<", True
+    order = "DESC" if desc else ""
+    groups = _word_groups(query)
+
+    catch_up(user_id, query.get("end"))
+    target = db_for(user_id)
+    with target.read() as conn:
+        where, params = _find_filters(query, "o.")
+        where.insert(0, "o.user_id = ?")
+        params.insert(0, user_id)
+        for value, sql in ((lo, "o.date >= ?"), (hi, "o.date < ?"), (query.get("type"), "o.type = ?")):
+            if value is not None:
+                where.append(sql)
+                params.append(value)
+        if key:
+            where.append(f"(o.date, o.id) {key_op} (?, ?)")
+            params += key
+
+        # все категории, что встречались у пользователя, включая удалённые
+        # из справочника и архивные, — из сводной таблицы
+        categories = [r[0] for r in conn.execute(
+            "SELECT DISTINCT category FROM monthly_totals WHERE user_id = ? AND category != ''", (user_id,)
+        )] if groups else []
+        match = []
+        for options in groups:
+            named = [c for c in categories if _words_match([options], None, c)]
+            if named:
+                where.append(f"""(o.id IN (SELECT rowid FROM operations_fts WHERE operations_fts MATCH ?)
+                                  OR o.category IN ({",".join("?" * len(named))}))""")
+                params += [_note_match(user_id, options), *named]
+            else:
+                match.append(_note_match(user_id, options))
+        if match:
+            # CROSS JOIN закрепляет порядок: сначала индекс заметок, потом строки
+            source = "operations_fts CROSS JOIN operations o ON o.id = operations_fts.rowid"
+            where.insert(0, "operations_fts MATCH ?")
+            params.insert(0, " AND ".join(match))
+        else:
+            source = "operations o"
+        rows = conn.execute(f"""
+            SELECT o.id, o.type, o.amount, o.currency, o.category, o.date, o.note
+            FROM {source}
+            WHERE {" AND ".join(where)}
+            ORDER BY o.date {order}, o.id {order} LIMIT ?
+        """, (*params, limit + 1)).fetchall()
+
+        # архивы: те же условия по ключу (user_id, day, id), слова — в Python
+        for alias, a_lo, a_hi in _archive_parts(target, conn, lo, hi):
+            a_where, a_params = _find_filters(query)
+            if query.get("type") is not None:
+                a_where.append("kind = ?")
+                a_params.append(int(query["type"] == "income"))
+            if key:
+                a_where.append(f"(day, id) {key_op} (?, ?)")
+                a_params += [day_number(key[0]), key[1]]
+            cursor = conn.execute(f"""
+                SELECT id, CASE kind WHEN 1 THEN 'income' ELSE 'expense' END, amount, currency, category,
+                       date(day + 1721424.5), {_archive_note(conn, alias)}
+                FROM {alias}.operations
+                WHERE user_id = ? AND day >= ? AND day < ? {"".join(" AND " + w for w in a_where)}
+                ORDER BY day {order}, id {order}
+            """, (user_id, day_number(a_lo), day_number(a_hi), *a_params))
+            found = 0
+            for row in cursor:
+                if _words_match(groups, row[6], row[4]):
+                    rows.append(row)
+                    found += 1
+                    if found > limit:
+                        break
+    rows.sort(key=lambda r: (r[5], r[0]), reverse=desc)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if desc:
+        rows.reverse()
+    return rows, more
+
+
+# ---------- Сводки ----------
+DIGEST_PERIODS = ("day", "week", "month")
+
+
+def get_digest_subscriptions(user_id):
+    with db_for(user_id).read() as conn:
+        return [period for period in DIGEST_PERIODS if conn.execute(
+            "SELECT 1 FROM digest_subscriptions WHERE period = ? AND user_id = ?", (period, user_id)
+        ).fetchone()]
+
+
+def set_digest_subscriptions(user_id, periods, chat_id=None):
+    with db_for(user_id).write() as conn:
+        conn.executemany(
+            "DELETE FROM digest_subscriptions WHERE period = ? AND user_id = ?",
+            [(period, user_id) for period in DIGEST_PERIODS]
+        )
+        conn.executemany(
+            "INSERT INTO digest_subscriptions (period, user_id, chat_id) VALUES (?, ?, ?)",
+            [(period, user_id, user_id if chat_id is None else chat_id) for period in periods]
+        )
+
+
+# Докуда дошла рассылка за период в шарде: (last_user, done) или None.
+def get_digest_run(shard, period, start):
+    with shards[shard].read() as conn:
+        return conn.execute(
+            "SELECT last_user, done FROM digest_runs WHERE period = ? AND start = ?", (period, start)
+        ).fetchone()
+
+
+# user_id — последний обработанный подписчик; по нему же выбирается шард.
+def save_digest_run(user_id, period, start, done=False):
+    with db_for(user_id).write() as conn:
+        conn.execute("""
+            INSERT INTO digest_runs (period, start, last_user, done) VALUES (?, ?, ?, ?)
+            ON CONFLICT(period, start) DO UPDATE SET
+                last_user = MAX(last_user, excluded.last_user),
+                done = MAX(done, excluded.done)
+        """, (period, start, user_id, int(done)))
+
+
+# Страница подписчиков периода после after_user и итоги за [start, end)
+# по всем ним одним запросом: для каждого подписчика — поиск по ключу
+# сводных таблиц (user_id, type, день/месяц), без обхода operations.
+# Возвращает ([(user_id, chat_id)], [(user_id, type, category, currency,
+# amount, count)]).
+DIGEST_PAGE = 1000
+
+
+def get_digest_page(shard, period, start, end, after_user=-1, limit=DIGEST_PAGE):
+    head, months, tail = _rollup_ranges(start, end)
+    with shards[shard].read() as conn:
+        users = conn.execute("""
+            SELECT user_id, chat_id FROM digest_subscriptions
+            WHERE period = ? AND user_id > ?
+            ORDER BY user_id LIMIT ?
+        """, (period, after_user, limit)).fetchall()
+        if not users:
+            return [], []
+        # подписчики с правилами, которые не догнаны до конца периода:
+        # догоняются только они, все одной транзакцией
+        due = [r[0] for r in conn.execute("""
+            SELECT DISTINCT user_id FROM recurring
+            WHERE user_id IN (
+                SELECT user_id FROM digest_subscriptions WHERE period = ? AND user_id > ? AND user_id <= ?
+            ) AND next_date < ?
+        """, (period, after_user, users[-1][0], end))]
+        if due:
+            with shards[shard].write():
+                for user_id in due:
+                    _catch_up_now(user_id, _catch_up_bound(end))
+        # пустые края (сводка за целый месяц) не добавляют лишних поисков
+        ranges = [(table, bucket, bounds) for table, bucket, bounds in (
+            ("daily_totals", "day", head), ("monthly_totals", "month", months), ("daily_totals", "day", tail)
+        ) if bounds[0] < bounds[1]]
+        parts = " UNION ALL ".join(f"""
+            SELECT t.user_id, t.type, t.category, t.currency, t.amount, t.count
+            FROM page JOIN {table} t
+            ON t.user_id = page.user_id AND t.type IN ('expense', 'income')
+            AND t.{bucket} >= ? AND t.{bucket} < ?
+        """ for table, bucket, _ in ranges)
+        totals = conn.execute(f"""
+            WITH page AS MATERIALIZED (
+                SELECT user_id FROM digest_subscriptions
+                WHERE period = ? AND user_id > ? AND user_id <= ?
+            )
+            SELECT user_id, type, NULLIF(category, ''), currency, SUM(amount), SUM(count)
+            FROM ({parts})
+            GROUP BY user_id, type, category, currency
+        """, (period, after_user, users[-1][0], *(x for _, _, bounds in ranges for x in bounds))).fetchall()
+    return users, totals
+
+
+# ---------- Курсы валют ----------
+# Курсы общие для всех пользователей и хранятся один раз — в первом
+# шарде; таблицы rates в остальных шардах не используются.
+def save_rates(rows):
+    with shards[0].write() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO rates (base, quote, date, rate) VALUES (?, ?, ?, ?)", rows
+        )
+        conn.execute("UPDATE rates_version SET version = version + 1")
+
+
+def get_rates_version():
+    with shards[0].read() as conn:
+        return conn.execute("SELECT version FROM rates_version").fetchone()[0]
+
+
+# Курсы и их версия. Версия читается первой: если курсы обновят между
+# запросами, таблица окажется новее версии и просто перечитается ещё раз.
+def get_all_rates():
+    with shards[0].read() as conn:
+        version = conn.execute("SELECT version FROM rates_version").fetchone()[0]
+        rows = conn.execute(f"""
+            SELECT base, quote, {ORDINAL_SQL.format("date")}, rate
+            FROM rates
+            ORDER BY base, quote, date
+        """).fetchall()
+    return version, rows
+
+
+# ---------- Кэш справочников ----------
+# Валюты и категории читаются на каждом шаге добавления, а меняются редко.
+# Изменение справочника пользователя увеличивает ref_version и сбрасывает
+# его записи в кэше; загрузка, начатая до сброса, в кэш не попадает.
+ref_version = 0
+ref_cache_stats = {"hits": 0, "misses": 0}
+# до трёх записей на пользователя: валюты, категории, бюджеты
+_ref_cache = OrderedDict()
+_ref_lock = threading.Lock()
+
+
+def _invalidate_refs(user_id):
+    global ref_version
+    with _ref_lock:
+        ref_version += 1
+        _ref_cache.pop((user_id, "currencies"), None)
+        _ref_cache.pop((user_id, "categories"), None)
+        _ref_cache.pop((user_id, "budgets"), None)
+
+
+def _cached_ref(key, loader):
+    # счётчики меняются из потоков пула чтения — только под замком
+    with _ref_lock:
+        value = _ref_cache.get(key)
+        if value is not None:
+            _ref_cache.move_to_end(key)
+            ref_cache_stats["hits"] += 1
+            return value
+        ref_cache_stats["misses"] += 1
+        version = ref_version
+    value = loader(key[0])
+    with _ref_lock:
+        if version == ref_version:
+            _lru_put(_ref_cache, key, value, 3 * USER_CACHE)
+    return value
+
+
+def get_ref_cache_stats():
+    with _ref_lock:
+        return {**ref_cache_stats, "version": ref_version}
+
+
+# валюты
+def add_currency(user_id, code):
+    try:
+        with db_for(user_id).write() as conn:
+            conn.execute("INSERT INTO currencies (user_id, code) VALUES (?, ?)", (user_id, code.upper()))
+            db_for(user_id).after_commit(lambda: _invalidate_refs(user_id))
+    except sqlite3.IntegrityError:
+        pass
+
+
+def delete_currency_db(user_id, code):
+    with db_for(user_id).write() as conn:
+        conn.execute("DELETE FROM currencies WHERE user_id = ? AND code = ?", (user_id, code.upper()))
+        db_for(user_id).after_commit(lambda: _invalidate_refs(user_id))
+
+
+def _load_currencies(user_id):
+    with db_for(user_id).read() as conn:
+        return tuple(r[0] for r in conn.execute(
+            "SELECT code FROM currencies WHERE user_id = ? ORDER BY id", (user_id,)
+        ))
+
+
+def get_all_currencies(user_id):
+    return _cached_ref((user_id, "currencies"), _load_currencies)
+
+
+# категории
+def _load_categories(user_id):
+    with db_for(user_id).read() as conn:
+        return tuple(r[0] for r in conn.execute(
+            "SELECT name FROM categories WHERE user_id = ? ORDER BY id", (user_id,)
+        ))
+
+
+def get_all_categories(user_id):
+    return _cached_ref((user_id, "categories"), _load_categories)
+
+
+def add_category(user_id, name):
+    try:
+        with db_for(user_id).write() as conn:
+            conn.execute("INSERT INTO categories (user_id, name) VALUES (?, ?)", (user_id, name))
+            db_for(user_id).after_commit(lambda: _invalidate_refs(user_id))
+    except sqlite3.IntegrityError:
+        pass
+
+
+def delete_category(user_id, name):
+    with db_for(user_id).write() as conn:
+        conn.execute("DELETE FROM categories WHERE user_id = ? AND name = ?", (user_id, name))
+        conn.execute("DELETE FROM budgets WHERE user_id = ? AND category = ?", (user_id, name))
+        db_for(user_id).after_commit(lambda: _invalidate_refs(user_id))
+
+
+# ---------- Бюджеты ----------
+# Бюджеты {(категория, валюта): месячный лимит} кэшируются вместе со
+# справочниками — проверка после записи операции обходится без чтения
+# таблицы budgets.
+def _load_budgets(user_id):
+    with db_for(user_id).read() as conn:
+        return {(cat, cur): amount for cat, cur, amount in conn.execute(
+            "SELECT category, currency, amount FROM budgets WHERE user_id = ?", (user_id,)
+        )}
+
+
+def get_budgets(user_id):
+    return _cached_ref((user_id, "budgets"), _load_budgets)
+
+
+def set_budget(user_id, category, currency, amount):
+    with db_for(user_id).write() as conn:
+        conn.execute("""
+            INSERT INTO budgets (user_id, category, currency, amount) VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id, category, currency) DO UPDATE SET amount = excluded.amount
+        """, (user_id, category or "", currency, amount))
+        db_for(user_id).after_commit(lambda: _invalidate_refs(user_id))
+
+
+def delete_budget(user_id, category, currency):
+    with db_for(user_id).write() as conn:
+        conn.execute(
+            "DELETE FROM budgets WHERE user_id = ? AND category = ? AND currency = ?",
+            (user_id, category or "", currency)
+        )
+        db_for(user_id).after_commit(lambda: _invalidate_refs(user_id))
+
+
+# Бюджеты с расходом за месяц: [(категория, валюта, лимит, потрачено)].
+def get_budget_report(user_id, month):
+    catch_up(user_id, next_month(datetime.strptime(month, "%Y-%m").date()).isoformat())
+    with db_for(user_id).read() as conn:
+        return conn.execute("""
+            SELECT b.category, b.currency, b.amount, COALESCE(t.amount, 0)
+            FROM budgets b
+            LEFT JOIN monthly_totals t
+            ON t.user_id = b.user_id AND t.type = 'expense' AND t.month = ?
+            AND t.category = b.category AND t.currency = b.currency
+            WHERE b.user_id = ?
+            ORDER BY b.category, b.currency
+        """, (month, user_id)).fetchall()
+
+
+# Пороги, о которых бот предупреждает: доля месячного лимита.
+BUDGET_THRESHOLDS = (0.8, 1.0)
+
+
+# Проверка после записи расхода на delta: spent — расход за месяц по
+# категории и валюте после записи, его возвращает та же транзакция, что
+# обновила monthly_totals, а лимит берётся из кэша — в базу проверка не
+# ходит. Если сумма перешла порог — (порог, потрачено, лимит), иначе None.
+def budget_crossing(user_id, category, currency, spent, delta):
+    limit = get_budgets(user_id).get((category or "", currency))
+    if limit is None or delta <= 0:
+        return None
+    crossed = [t for t in BUDGET_THRESHOLDS if spent - delta < t * limit <= spent]
+    return (crossed[-1], spent, limit) if crossed else None
+
+
+# ---------- Регулярные операции ----------
+# Повторения правил не пишет никакое расписание: их записывает первое
+# чтение, которому нужен период с ещё не записанными повторениями
+# (catch_up в начале функций чтения). Пользователь, который не заходит в
+# бот, ничего не стоит, а после долгого перерыва все пропущенные
+# повторения вставляются одной пачкой через _import_chunk — остатки и
+# сводные таблицы обновляются так же, как при импорте. Повторения в
+# будущем не записываются: граница — завтрашний день.
+#
+# Повторение получает import_hash «rec:<правило>:<день>», а next_date
+# правила сдвигается в той же транзакции. Два одновременных чтения не
+# запишут его дважды: второе под блокировкой записи уже не найдёт, что
+# догонять, а уникальный индекс отбросит дубль, даже если next_date
+# разойдётся с операциями.
+RECURRING_PERIODS = ("day", "week", "month")
+
+# Самый ранний next_date правил пользователя (None — действующих правил
+# нет). По нему чтение решает, нужно ли догонять, не обращаясь к базе.
+# Изменение правил сбрасывает запись и сдвигает _recurring_version;
+# загрузка, начатая до сброса, в кэш не попадает.
+_recurring_next = OrderedDict()
+_recurring_version = 0
+_recurring_lock = threading.Lock()
+_NOT_LOADED = object()
+
+
+def _reset_recurring(user_id):
+    global _recurring_version
+    with _recurring_lock:
+        _recurring_version += 1
+        _recurring_next.pop(user_id, None)
+
+
+def _set_due(user_id, due):
+    with _recurring_lock:
+        _lru_put(_recurring_next, user_id, due)
+
+
+# Следующее повторение после day. Месячное правило держится числа из
+# start: 31-го в коротких месяцах — последний день, потом снова 31-е.
+def next_occurrence(period, start, day):
+    current = datetime.fromisoformat(day).date()
+    if period == "day":
+        return (current + timedelta(days=1)).isoformat()
+    if period == "week":
+        return (current + timedelta(days=7)).isoformat()
+    month = next_month(current)
+    last = calendar.monthrange(month.year, month.month)[1]
+    return month.replace(day=min(int(start[8:]), last)).isoformat()
+
+
+def _next_due(conn, user_id):
+    return conn.execute("SELECT MIN(next_date) FROM recurring WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+# Записывает повторения с датой раньше bound и сдвигает next_date.
+# Вызывается под блокировкой записи; возвращает число новых операций.
+def _materialize(conn, user_id, bound):
+    rows, moves = [], []
+    for rule_id, op_type, amount, currency, category, note, period, start, until, day in conn.execute("""
+        SELECT id, type, amount, currency, category, note, period, start, until, next_date
+        FROM recurring WHERE user_id = ? AND next_date < ?
+    """, (user_id, bound)).fetchall():
+        while day is not None and day < bound:
+            rows.append((user_id, op_type, amount, currency, category, day, f"rec:{rule_id}:{day}", note))
+            day = next_occurrence(period, start, day)
+            if until is not None and day > until:
+                day = None
+        moves.append((day, rule_id))
+    conn.executemany("UPDATE recurring SET next_date = ? WHERE id = ?", moves)
+    added = 0
+    for i in range(0, len(rows), IMPORT_BATCH):
+        added += _import_chunk(conn, rows[i:i + IMPORT_BATCH], set())
+    if added:
+        _touch(user_id)
+    return added
+
+
+def _catch_up_bound(end):
+    tomorrow = (datetime.now().date() + timedelta(days=1)).isoformat()
+    return tomorrow if end is None else min(end, tomorrow)
+
+
+# Догоняет правила пользователя до конца периода [.., end), который
+# сейчас будет прочитан (None — до сегодняшнего дня включительно).
+# Если догонять нечего, это один поиск в словаре.
+def catch_up(user_id, end=None):
+    bound = _catch_up_bound(end)
+    with _recurring_lock:
+        due = _recurring_next.get(user_id, _NOT_LOADED)
+        if due is not _NOT_LOADED:
+            _recurring_next.move_to_end(user_id)
+        version = _recurring_version
+    if due is _NOT_LOADED:
+        with db_for(user_id).read() as conn:
+            due = _next_due(conn, user_id)
+        with _recurring_lock:
+            if version == _recurring_version:
+                _lru_put(_recurring_next, user_id, due)
+    if due is None or due >= bound:
+        return 0
+    return _catch_up_now(user_id, bound)
+
+
+# Без чтения: вызывающий уже знает, что догонять есть что.
+def _catch_up_now(user_id, bound):
+    target = db_for(user_id)
+    with target.write() as conn:
+        added = _materialize(conn, user_id, bound)
+        due = _next_due(conn, user_id)
+        target.after_commit(lambda: _set_due(user_id, due))
+    return added
+
+
+# start и until — YYYY-MM-DD; until включительно.
+def add_recurring(user_id, op_type, amount, currency, category, note, period, start, until=None):
+    if period not in RECURRING_PERIODS:
+        raise ValueError(f"Неизвестный период: {period}")
+    with db_for(user_id).write() as conn:
+        rule_id = conn.execute("""
+            INSERT INTO recurring (user_id, type, amount, currency, category, note, period, start, until, next_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (user_id, op_type, amount, currency, category, note, period, start, until,
+              start if until is None or start <= until else None)).lastrowid
+        db_for(user_id).after_commit(lambda: _reset_recurring(user_id))
+    return rule_id
+
+
+# [(id, type, amount, currency, category, note, period, start, until, next_date)]
+def get_recurring(user_id):
+    with db_for(user_id).read() as conn:
+        return conn.execute("""
+            SELECT id, type, amount, currency, category, note, period, start, until, next_date
+            FROM recurring WHERE user_id = ? ORDER BY id
+        """, (user_id,)).fetchall()
+
+
+# Уже записанные повторения остаются в истории.
+def delete_recurring(user_id, rule_id):
+    with db_for(user_id).write() as conn:
+        deleted = conn.execute(
+            "DELETE FROM recurring WHERE id = ? AND user_id = ?", (rule_id, user_id)
+        ).rowcount
+        db_for(user_id).after_commit(lambda: _reset_recurring(user_id))
+    return bool(deleted)
+
+
+# ---------- Перенос общих данных ----------
+# Данные, накопленные до разделения по пользователям (user_id = 0),
+# передаются владельцу. Совпадающие валюты и категории не дублируются.
+def claim_legacy(user_id):
+    if db_for(0) is not db_for(user_id):
+        raise ValueError("Владелец попадает в другой шард — используйте split_into_shards(owner=...)")
+    with db_for(0).write() as conn:
+        notes = conn.execute("SELECT id, note FROM operations WHERE user_id = 0 AND note IS NOT NULL").fetchall()
+        moved = conn.execute("UPDATE operations SET user_id = ? WHERE user_id = 0", (user_id,)).rowcount
+        # слова индекса заметок несут id владельца
+        conn.executemany("UPDATE operations SET terms = ? WHERE id = ?",
+                         [(fts_terms(user_id, note), op_id) for op_id, note in notes])
+        for table, column in (("currencies", "code"), ("categories", "name")):
+            conn.execute(f"""
+                INSERT OR IGNORE INTO {table} (user_id, {column})
+                SELECT ?, {column} FROM {table} WHERE user_id = 0 ORDER BY id
+            """, (user_id,))
+            conn.execute(f"DELETE FROM {table} WHERE user_id = 0")
+        conn.execute(
+            "INSERT OR IGNORE INTO users (user_id, created) VALUES (?, ?)",
+            (user_id, datetime.now().isoformat(timespec="seconds"))
+        )
+        _rebuild_aggregates(conn)
+    _invalidate_refs(user_id)
+    return moved
+
+
+# Раскладывает данные одной общей базы по текущим шардам. user_id = 0
+# можно сразу передать владельцу через owner.
+def split_into_shards(source_path, owner=None, batch=MIGRATION_BATCH):
+    source = Storage(source_path)
+    migrate(source)
+    owner_of = (lambda u: owner if u == 0 and owner is not None else u)
+    moved = 0
+    try:
+        with source.read() as src:
+            for table, columns in (
+                ("currencies", "user_id, code"),
+                ("categories", "user_id, name"),
+                ("users", "user_id, created"),
+                ("operations", "user_id, type, amount, currency, category, date, note"),
+            ):
+                cursor = src.execute(f"SELECT {columns} FROM {table} ORDER BY rowid")
+                # у операций ещё слова индекса заметок — уже с новым владельцем
+                target_columns = columns + ", terms" if table == "operations" else columns
+                marks = ", ".join("?" * len(target_columns.split(",")))
+                while True:
+                    rows = cursor.fetchmany(batch)
+                    if not rows:
+                        break
+                    by_shard = {}
+                    for row in rows:
+                        row = (owner_of(row[0]),) + tuple(row[1:])
+                        if table == "operations":
+                            row += (fts_terms(row[0], row[6]),)
+                        by_shard.setdefault(id(db_for(row[0])), (db_for(row[0]), []))[1].append(row)
+                    for target, chunk in by_shard.values():
+                        with target.write() as conn:
+                            conn.executemany(
+                                f"INSERT OR IGNORE INTO {table} ({target_columns}) VALUES ({marks})", chunk
+                            )
+                    if table == "operations":
+                        moved += len(rows)
+    finally:
+        source.close()
+    now = datetime.now().isoformat(timespec="seconds")
+    for s in shards:
+        with s.write() as conn:
+            conn.execute("INSERT OR IGNORE INTO users (user_id, created) SELECT DISTINCT user_id, ? FROM operations", (now,))
+            _rebuild_aggregates(conn)
+    return moved
+
+
+shards = []
+db = None
+configure()
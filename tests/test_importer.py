@@ -0,0 +1,44 @@
+# Чтение банковских выписок: суммы и ключи дедупликации.
+#
+#   python -m pytest -q tests
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from importer import parse_amount, read_statement
+
+
+@pytest.mark.parametrize("text, value", [
+    ("250", 250.0),
+    ("12,5", 12.5),
+    ("-99.90", -99.9),
+    ("1.234,56", 1234.56),
+    ("1,234.56", 1234.56),
+    ("1 234,56", 1234.56),
+    ("1\xa0234.56", 1234.56),
+    ("-1.234.567,89", -1234567.89),
+])
+def test_parse_amount(text, value):
+    assert parse_amount(text) == pytest.approx(value)
+
+
+def _write(tmp_path, name, lines):
+    path = tmp_path / name
+    path.write_text("\n".join(["Дата;Сумма;Валюта;Описание", *lines]) + "\n", encoding="utf-8")
+    return str(path)
+
+
+# две одинаковые покупки за день получают разные ключи, а порядок строк
+# в выписке на ключи не влияет
+def test_repeated_rows_keep_ordinals_in_unsorted_file(tmp_path):
+    coffee = "2024-05-01;-150;RUB;Кофе"
+    bread = "2024-05-02;-60;RUB;Хлеб"
+    sorted_rows = read_statement(_write(tmp_path, "a.csv", [coffee, coffee, bread]))
+    mixed_rows = read_statement(_write(tmp_path, "b.csv", [coffee, bread, coffee]))
+    keys = [row[5] for row in sorted_rows]
+    assert len(set(keys)) == 3
+    assert sorted(keys) == sorted(row[5] for row in mixed_rows)
@@ -0,0 +1,72 @@
+# Разбор быстрого ввода: что считается суммой и валютой.
+#
+#   python -m pytest -q tests
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+from quick_entry import QuickIndex, has_amount
+
+CURRENCIES = ("RUB", "USD", "EUR")
+
+
+@pytest.fixture(scope="module")
+def index():
+    return QuickIndex(tuple(storage.BASE_CATEGORIES), CURRENCIES)
+
+
+@pytest.mark.parametrize("text", ["-250 еда", "250", "+5000 зарплата", "  -10 bus", "12.05 встреча"])
+def test_has_amount_first_token(text):
+    assert has_amount(text)
+
+
+@pytest.mark.parametrize("text", ["до 5", "встреча 12.05", "купить 2 батона", "🍔 Еда", ""])
+def test_has_amount_not_first_token(text):
+    assert not has_amount(text)
+
+
+# трёхбуквенные слова в заметке — не валюта
+@pytest.mark.parametrize("text, note", [
+    ("-10 еда bus", "bus"),
+    ("-50 такси до дома bus", "до дома bus"),
+    ("-300 еда gym", "gym"),
+    ("-300 еда кафе all", "кафе all"),
+])
+def test_latin_words_are_notes(index, text, note):
+    entry = index.parse(text)
+    assert entry.currency == "RUB"
+    assert entry.note == note
+
+
+# код ISO заглавными или сразу после суммы — валюта, которой у пользователя нет
+@pytest.mark.parametrize("text", ["-10 GBP", "-10 еда GBP", "-10 gbp еда", "-10gbp", "+500 JPY зарплата"])
+def test_unknown_currency_rejected(index, text):
+    with pytest.raises(ValueError, match="GBP|JPY"):
+        index.parse(text)
+
+
+def test_lowercase_code_away_from_amount_is_note(index):
+    entry = index.parse("-10 еда gbp")
+    assert entry.currency == "RUB" and entry.note == "gbp"
+
+
+@pytest.mark.parametrize("text", ["-10 usd еда", "-10usd еда", "-10 еда USD"])
+def test_known_currency(index, text):
+    assert index.parse(text).currency == "USD"
+
+
+def test_guessed_category(index):
+    entry = index.parse("12.05 встреча")
+    assert entry.guessed
+    assert entry.category == index.fallback
+    assert entry.note == "встреча"
+
+
+@pytest.mark.parametrize("text", ["-250 еда", "-100 другое", "+5000 зарплата"])
+def test_named_category_not_guessed(index, text):
+    assert not index.parse(text).guessed
@@ -0,0 +1,61 @@
+# Кэши по пользователям в storage ограничены FINBOT_USER_CACHE: давние
+# записи вытесняются, а прочитанное после вытеснения совпадает с базой.
+#
+#   python -m pytest -q tests
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import storage
+
+LIMIT = 5
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "USER_CACHE", LIMIT)
+    storage.configure(str(tmp_path / "finance.db"), "single")
+    storage.init_db()
+    yield
+    storage.db.close()
+    storage.configure()
+
+
+def test_caches_stay_bounded(db):
+    for user_id in range(1, 4 * LIMIT):
+        storage.ensure_user(user_id)
+        storage.add_currency(user_id, "RUB")
+        storage.get_all_currencies(user_id)
+        storage.get_all_categories(user_id)
+        storage.add_operation(user_id, "expense", 10, "RUB", "🍔 Еда")
+        storage.catch_up(user_id)
+    assert len(storage._known_users) == LIMIT
+    assert len(storage._data_versions) == LIMIT
+    assert len(storage._recurring_next) == LIMIT
+    assert len(storage._ref_cache) <= 3 * LIMIT
+    # вытесненный пользователь читается из базы заново
+    assert storage.get_all_currencies(1) == ("RUB",)
+    storage.ensure_user(1)
+    assert len(storage.get_all_categories(1)) == len(storage.BASE_CATEGORIES)
+
+
+# версия вытесненного пользователя не возвращается к прежнему значению
+def test_data_version_survives_eviction(db):
+    storage.ensure_user(1)
+    storage.add_currency(1, "RUB")
+    seen = [storage.data_version(1)]
+    storage.add_operation(1, "expense", 10, "RUB", "🍔 Еда")
+    seen.append(storage.data_version(1))
+    for user_id in range(2, 3 * LIMIT):
+        storage.ensure_user(user_id)
+        storage.add_currency(user_id, "RUB")
+        storage.add_operation(user_id, "expense", 10, "RUB", "🍔 Еда")
+    assert 1 not in storage._data_versions
+    after = storage.data_version(1)
+    assert after not in seen and after > seen[-1]
+    storage.add_operation(1, "expense", 10, "RUB", "🍔 Еда")
+    assert storage.data_version(1) > after
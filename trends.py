@@ -0,0 +1,182 @@
+import calendar
+import os
+from collections import namedtuple
+from datetime import date, timedelta
+
+import numpy as np
+
+import storage
+
+# Сколько последних дней загружается: текущий и прошлый месяц плюс база
+# для поиска необычных трат. Старая история на результат не влияет, поэтому
+# время расчёта не растёт с её длиной.
+BASELINE_DAYS = 90
+# Окно не короче текущего месяца и базы перед его первым днём (прошлый
+# месяц в них помещается): иначе индексы дней ушли бы в минус, а NumPy
+# молча считает их с конца массива.
+MIN_WINDOW_DAYS = 31 + BASELINE_DAYS
+WINDOW_DAYS = max(int(os.getenv("FINBOT_TRENDS_DAYS", "400")), MIN_WINDOW_DAYS)
+ANOMALY_SIGMA = 3.0
+ANOMALY_MIN_DAYS = 14
+CACHE_SIZE = 10000
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Ряд — категория в одной валюте или итог по валюте (category = None,
+# total = True). Суммы — расходы.
+Series = namedtuple(
+    "Series",
+    "category currency total ma7 ma30 month prev_month delta forecast prev_total anomalies",
+)
+Trends = namedtuple("Trends", "today days_in_month series")
+
+
+# ---------- Расчёт ----------
+# rows — (день YYYY-MM-DD, категория, валюта, сумма) из daily_totals.
+# Все ряды лежат в одной матрице «ряд × день окна», и каждая величина
+# считается сразу для всех рядов через накопленные суммы по оси дней:
+# сумма за [a, b) — это C[:, b] - C[:, a].
+def compute(rows, today):
+    t = today.toordinal()
+    first = t - WINDOW_DAYS + 1
+    width = WINDOW_DAYS
+    days_in_month = calendar.monthrange(today.year, today.month)[1]
+    if not rows:
+        return Trends(today, days_in_month, [])
+
+    days, categories, currencies, amounts = zip(*rows)
+    keys = sorted(set(zip(categories, currencies)), key=lambda k: (k[1], k[0] or ""))
+    index = {key: i for i, key in enumerate(keys)}
+    row_index = np.fromiter((index[key] for key in zip(categories, currencies)), dtype=np.int64, count=len(rows))
+    column = np.array(days, dtype="datetime64[D]").astype(np.int64) + EPOCH_ORDINAL - first
+    matrix = np.bincount(row_index * width + column, weights=np.asarray(amounts, dtype=float),
+                         minlength=len(keys) * width).reshape(len(keys), width)
+
+    # итог по каждой валюте — ещё несколько рядов той же матрицы
+    codes = sorted({c for _, c in keys})
+    code_index = np.array([codes.index(c) for _, c in keys])
+    totals = np.zeros((len(codes), width))
+    np.add.at(totals, code_index, matrix)
+    matrix = np.vstack([totals, matrix])
+    labels = [(None, c, True) for c in codes] + [(cat, c, False) for cat, c in keys]
+
+    cumulative = np.zeros((matrix.shape[0], width + 1))
+    np.cumsum(matrix, axis=1, out=cumulative[:, 1:])
+    squares = np.zeros_like(cumulative)
+    np.cumsum(matrix ** 2, axis=1, out=squares[:, 1:])
+
+    def window(a, b):
+        return cumulative[:, b] - cumulative[:, a]
+
+    end = width
+    month_start = today.replace(day=1)
+    prev_start = (month_start - timedelta(days=1)).replace(day=1)
+    m0 = month_start.toordinal() - first
+    p0 = prev_start.toordinal() - first
+    prev_len = month_start.toordinal() - prev_start.toordinal()
+
+    ma7 = window(end - 7, end) / 7
+    ma30 = window(end - 30, end) / 30
+    month = window(m0, end)
+    prev_month = window(p0, p0 + min(today.day, prev_len))
+    prev_total = window(p0, m0)
+    delta = np.divide(month - prev_month, prev_month, out=np.full_like(month, np.nan), where=prev_month > 0)
+    # прогноз: уже потрачено плюс оставшиеся дни по среднему за 30 дней
+    forecast = month + (days_in_month - today.day) * ma30
+
+    # необычный день: выше среднего за BASELINE_DAYS предыдущих дней на
+    # ANOMALY_SIGMA стандартных отклонений; проверяются дни этого месяца
+    check = np.arange(m0, end)
+    lo = np.clip(check - BASELINE_DAYS, 0, None)
+    n = (check - lo).astype(float)
+    total = cumulative[:, check] - cumulative[:, lo]
+    total_sq = squares[:, check] - squares[:, lo]
+    mean = total / n
+    std = np.sqrt(np.maximum(total_sq / n - mean ** 2, 0))
+    active = (np.count_nonzero(matrix[:, :end] > 0, axis=1) >= ANOMALY_MIN_DAYS)[:, None]
+    values = matrix[:, check]
+    flagged = active & (values > 0) & (values > mean + ANOMALY_SIGMA * std) & (std > 0)
+    rows_flagged, cols_flagged = np.nonzero(flagged)
+    anomalies = {}
+    for r, c in zip(rows_flagged.tolist(), cols_flagged.tolist()):
+        anomalies.setdefault(r, []).append(
+            (date.fromordinal(first + int(check[c])), float(values[r, c]), float(mean[r, c]))
+        )
+
+    series = []
+    for i, (category, currency, is_total) in enumerate(labels):
+        if month[i] == 0 and prev_total[i] == 0 and ma30[i] == 0:
+            continue
+        series.append(Series(
+            category, currency, is_total, float(ma7[i]), float(ma30[i]), float(month[i]),
+            float(prev_month[i]), None if np.isnan(delta[i]) else float(delta[i]),
+            float(forecast[i]), float(prev_total[i]), anomalies.get(i, []),
+        ))
+    return Trends(today, days_in_month, series)
+
+
+def load(user_id, today=None):
+    today = today or date.today()
+    start = date.fromordinal(today.toordinal() - WINDOW_DAYS + 1)
+    rows = storage.get_daily_totals_iso(user_id, start.isoformat(), (today + timedelta(days=1)).isoformat())
+    return compute(rows, today)
+
+
+# ---------- Кэш ----------
+# Результат хранится до следующей записи пользователя (storage.data_version)
+# или до смены дня.
+_cache = {}
+
+
+def get_trends(user_id, today=None):
+    today = today or date.today()
+    version = storage.data_version(user_id)
+    cached = _cache.get(user_id)
+    if cached is not None and cached[0] == version and cached[1] == today:
+        return cached[2]
+    result = load(user_id, today)
+    if len(_cache) >= CACHE_SIZE:
+        _cache.pop(next(iter(_cache)), None)
+    _cache[user_id] = (version, today, result)
+    return result
+
+
+# ---------- Текст ----------
+MONTHS_GENITIVE = ["января", "февраля", "марта", "апреля", "мая", "июня",
+                   "июля", "августа", "сентября", "октября", "ноября", "декабря"]
+TOP_CATEGORIES = 5
+TOP_ANOMALIES = 5
+
+
+def _delta_text(delta):
+    return "" if delta is None else f" ({delta * 100:+.0f}%)"
+
+
+def render(trends):
+    today = trends.today
+    if not trends.series:
+        return "📈 За последние месяцы расходов нет."
+    prev = today.replace(day=1) - timedelta(days=1)
+    msg = (f"📈 Тренды на {today.day} {MONTHS_GENITIVE[today.month - 1]} "
+           f"(день {today.day} из {trends.days_in_month})\n")
+    anomalies = []
+    for total in (s for s in trends.series if s.total):
+        cur = total.currency
+        msg += f"\n💸 {cur}: {round(total.month, 2)} с начала месяца"
+        if total.delta is not None:
+            msg += f" ({total.delta * 100:+.0f}% к 1–{min(today.day, prev.day)} {MONTHS_GENITIVE[prev.month - 1]})"
+        msg += "\n"
+        msg += (f"Прогноз на месяц ≈ {round(total.forecast)} {cur} · в день: "
+                f"{round(total.ma7)} за 7 дн., {round(total.ma30)} за 30 дн.\n")
+        categories = sorted((s for s in trends.series if not s.total and s.currency == cur),
+                            key=lambda s: -s.month)
+        for s in categories[:TOP_CATEGORIES]:
+            if s.month:
+                msg += f"  {s.category or '📦 Другое'}: {round(s.month, 2)}{_delta_text(s.delta)} → ≈ {round(s.forecast)}\n"
+        anomalies += [(day, s, amount, usual) for s in categories for day, amount, usual in s.anomalies]
+    if anomalies:
+        anomalies.sort(key=lambda item: item[0], reverse=True)
+        msg += "\n⚠️ Необычные траты:\n"
+        for day, s, amount, usual in anomalies[:TOP_ANOMALIES]:
+            msg += (f"  {day:%d.%m} {s.category or '📦 Другое'} — {round(amount, 2)} {s.currency} "
+                    f"(обычно ≈ {round(usual)} в день)\n")
+    return msg
@@ -0,0 +1,169 @@
+import asyncio
+import hmac
+import json
+import os
+import secrets
+import signal
+
+from telegram import Update
+
+WEBHOOK_URL = os.getenv("FINBOT_WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("FINBOT_WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("FINBOT_WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("FINBOT_WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("FINBOT_WEBHOOK_SECRET", "")
+# сколько апдейтов может ждать обработки, прежде чем приёмник начнёт
+# отвечать 503 — Telegram повторит доставку позже
+WEBHOOK_MAX_PENDING = int(os.getenv("FINBOT_WEBHOOK_MAX_PENDING", "1000"))
+MAX_BODY = 1 << 20
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+RESPONSES = {
+    200: b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n",
+    400: b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n",
+    403: b"HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\n\r\n",
+    404: b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n",
+    413: b"HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n",
+    503: b"HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\nContent-Length: 0\r\n\r\n",
+}
+
+
+# ---------- Приёмник вебхуков ----------
+# Минимальный HTTP/1.1-сервер на asyncio с keep-alive: принимает только
+# POST на свой путь, проверяет секрет и кладёт Update прямо в
+# update_queue приложения. Очередь ограничена max_pending.
+class WebhookServer:
+    def __init__(self, app, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, path=WEBHOOK_PATH,
+                 secret=WEBHOOK_SECRET, max_pending=WEBHOOK_MAX_PENDING, on_accept=None):
+        self.app = app
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret = secret.encode()
+        self.max_pending = max_pending
+        self.on_accept = on_accept
+        self.accepted = 0
+        self.rejected = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.listen, self.port, backlog=1024)
+        if self.port == 0:
+            self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", "0"))
+                if length > MAX_BODY:
+                    writer.write(RESPONSES[413])
+                    break
+                body = await reader.readexactly(length) if length else b""
+                writer.write(RESPONSES[self._accept(request_line, headers, body)])
+                if headers.get("connection", "").lower() == "close":
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def _accept(self, request_line, headers, body):
+        try:
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            return 400
+        if method != "POST" or target.split("?", 1)[0] != self.path:
+            return 404
+        if self.secret and not hmac.compare_digest(headers.get(SECRET_HEADER, "").encode(), self.secret):
+            return 403
+        return self._deliver(body)
+
+    # Очередь приложения почти всегда пуста: Application сразу забирает
+    # апдейты в задачи, и ждут они уже в update_processor. Поэтому
+    # считаем и очередь, и апдейты, прошедшие семафор процессора; у
+    # ChatOrderedUpdateProcessor он не ограничен, так что это все
+    # принятые, но не обработанные апдейты.
+    def pending(self):
+        return self.app.update_processor.current_concurrent_updates + self.app.update_queue.qsize()
+
+    # Проверенное тело запроса: в очередь приложения. Приёмник пула
+    # воркеров (workers.py) вместо этого пересылает его воркеру.
+    def _deliver(self, body):
+        if self.pending() >= self.max_pending:
+            self.rejected += 1
+            return 503
+        try:
+            update = Update.de_json(json.loads(body), self.app.bot)
+        except (ValueError, TypeError, KeyError):
+            return 400
+        self.app.update_queue.put_nowait(update)
+        self.accepted += 1
+        if self.on_accept is not None:
+            self.on_accept(update)
+        return 200
+
+
+# Без секрета приёмник принял бы поддельный апдейт от любого, кто
+# достучится до порта, — от имени любого пользователя. Пустой секрет
+# остаётся только для WebhookServer в локальных бенчмарках; при запуске
+# бота без FINBOT_WEBHOOK_SECRET секрет генерируется на этот запуск и
+# уходит в Telegram через set_webhook.
+def require_secret(server_options):
+    if not server_options.get("secret", WEBHOOK_SECRET):
+        server_options["secret"] = secrets.token_urlsafe(32)
+        print("FINBOT_WEBHOOK_SECRET не задан: секрет вебхука сгенерирован на этот запуск")
+    return server_options
+
+
+# Аналог app.run_polling(): поднимает приложение, приёмник и регистрирует
+# вебхук в Telegram; останавливается по SIGINT/SIGTERM.
+def run_webhook(app, url=WEBHOOK_URL, **server_options):
+    if not url:
+        raise SystemExit("Для FINBOT_MODE=webhook нужен FINBOT_WEBHOOK_URL")
+    asyncio.run(_serve(app, url, require_secret(server_options)))
+
+
+async def _serve(app, url, server_options):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    server = WebhookServer(app, **server_options)
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    try:
+        await server.start()
+        await app.bot.set_webhook(
+            url=url,
+            secret_token=server.secret.decode(),
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=100,
+        )
+        await stop.wait()
+    finally:
+        await server.stop()
+        await app.stop()
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
@@ -0,0 +1,388 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import struct
+import tempfile
+from collections import deque
+from contextlib import suppress
+
+from telegram import Bot, Update
+from telegram.error import TelegramError
+
+import storage
+from webhook import WEBHOOK_URL, WebhookServer, require_secret
+
+# сколько процессов с ботом поднимать; 0 — обычный запуск в одном процессе
+WORKERS = int(os.getenv("FINBOT_WORKERS", "0"))
+# сколько апдейтов приёмник держит для одного воркера, прежде чем
+# вебхук начнёт отвечать 503, а опрос getUpdates — ждать
+WORKER_MAX_PENDING = int(os.getenv("FINBOT_WORKER_MAX_PENDING", "1000"))
+# сколько апдейтов воркер берёт в работу, не дочитывая сокет дальше
+WORKER_IN_FLIGHT = int(os.getenv("FINBOT_WORKER_IN_FLIGHT", "256"))
+WORKER_START_TIMEOUT = 60
+POLL_TIMEOUT = 30
+SEND_BATCH = 256
+
+_LENGTH = struct.Struct(">I")
+# spawn, а не fork: воркер не наследует открытые соединения с базой и
+# состояние цикла событий приёмника
+_CONTEXT = multiprocessing.get_context("spawn")
+
+
+# ---------- Маршрутизация ----------
+# Апдейты одного чата всегда попадают в один и тот же воркер: в нём
+# живёт состояние ConversationHandler этого чата, и там же
+# ChatOrderedUpdateProcessor держит их порядок. Ключ — id чата, как в
+# ChatOrderedUpdateProcessor.chat_key; у апдейтов без чата — id
+# пользователя. Бот работает в личных чатах, где это одно и то же.
+def route_key(data):
+    for name, value in data.items():
+        if name == "update_id" or not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = value.get("from") or value.get("user")
+        if user:
+            return user["id"]
+    return 0
+
+
+# Тот же хэш, что у шардов базы: при FINBOT_SHARDS, кратном числу
+# воркеров, каждый воркер пишет только в свои шарды.
+def worker_index(data, count):
+    return storage.shard_index(route_key(data), count)
+
+
+def frame(body):
+    return _LENGTH.pack(len(body)) + body
+
+
+# ---------- Воркер ----------
+# Отдельный процесс с обычным Application из bot.py: свои соединения с
+# базой, свой SQLitePersistence и свой цикл событий. Апдейты приходят
+# из приёмника по unix-сокету кадрами «длина + JSON». Конец потока —
+# сигнал остановиться: воркер дорабатывает всё принятое, сбрасывает
+# состояние в базу и выходит.
+def worker_main(index, path, token, builder_factory=None):
+    # жизнью воркера управляет приёмник: Ctrl+C и SIGTERM приходят всей
+    # группе процессов, а выключаться воркер должен после приёмника
+    for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+        signal.signal(sig, signal.SIG_IGN)
+    asyncio.run(_run_worker(index, path, token, builder_factory))
+
+
+async def _run_worker(index, path, token, builder_factory):
+    import bot
+    import metrics
+
+    if bot.metrics_server:
+        # у каждого воркера свой порт: FINBOT_METRICS_PORT + 1 + номер
+        bot.metrics_server.port += 1 + index
+        metrics.instrument_storage()
+    # сводки по расписанию рассылает только первый воркер
+    app = bot.build_application(token, builder_factory() if builder_factory else None, jobs=index == 0)
+    processor = app.update_processor
+    reader, writer = await asyncio.open_unix_connection(path)
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    try:
+        while True:
+            # пока воркер занят, новые кадры ждут в сокете и в очереди
+            # приёмника, а не в памяти воркера
+            while processor.pending_updates + app.update_queue.qsize() >= WORKER_IN_FLIGHT:
+                await processor.wait_progress()
+            try:
+                header = await reader.readexactly(_LENGTH.size)
+                body = await reader.readexactly(_LENGTH.unpack(header)[0])
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            app.update_queue.put_nowait(Update.de_json(json.loads(body), app.bot))
+    finally:
+        writer.close()
+        # app.stop() тоже дождался бы очереди, но создавал бы задачи уже
+        # остановленного приложения
+        await app.update_queue.join()
+        await app.stop()
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+# ---------- Связь с воркером ----------
+# Сторона приёмника: очередь кадров для одного воркера, задача, которая
+# пишет их в сокет, и сам процесс. Очередь переживает перезапуск
+# воркера — кадры, не отправленные старому, достаются новому в том же
+# порядке.
+class WorkerLink:
+    def __init__(self, index, path, token, max_pending=WORKER_MAX_PENDING, builder_factory=None):
+        self.index = index
+        self.path = path
+        self.token = token
+        self.max_pending = max_pending
+        self.builder_factory = builder_factory
+        self.queue = deque()
+        self.sent = 0
+        self.restarts = 0
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._closing = False
+        self._process = None
+        self._writer = None
+        self._exit = None
+        self._sender = None
+        self._watcher = None
+
+    async def start(self):
+        await self._spawn()
+
+    async def _spawn(self):
+        loop = asyncio.get_running_loop()
+        connected = loop.create_future()
+
+        def accept(reader, writer):
+            if connected.done():
+                writer.close()
+            else:
+                connected.set_result(writer)
+
+        server = await asyncio.start_unix_server(accept, self.path)
+        self._process = _CONTEXT.Process(
+            target=worker_main, args=(self.index, self.path, self.token, self.builder_factory),
+            name=f"finbot-worker-{self.index}",
+        )
+        self._process.start()
+        self._exit = self._wait_exit(self._process)
+        try:
+            done, _ = await asyncio.wait((connected, self._exit), timeout=WORKER_START_TIMEOUT,
+                                         return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            server.close()
+            with suppress(FileNotFoundError):
+                os.unlink(self.path)
+        if connected not in done:
+            self._process.kill()
+            raise RuntimeError(f"Воркер {self.index} не запустился")
+        self._writer = connected.result()
+        self._closing = False
+        self._sender = asyncio.create_task(self._send(self._writer))
+        self._watcher = asyncio.create_task(self._watch(self._exit))
+
+    @staticmethod
+    def _wait_exit(process):
+        loop = asyncio.get_running_loop()
+        exited = loop.create_future()
+
+        def ready():
+            loop.remove_reader(process.sentinel)
+            process.join()
+            exited.set_result(process.exitcode)
+
+        loop.add_reader(process.sentinel, ready)
+        return exited
+
+    async def _send(self, writer):
+        while True:
+            while not self.queue:
+                if self._closing:
+                    return
+                self._ready.clear()
+                await self._ready.wait()
+            if self._closing:
+                return
+            batch = [self.queue.popleft() for _ in range(min(len(self.queue), SEND_BATCH))]
+            self._space.set()
+            writer.writelines(batch)
+            await writer.drain()
+            self.sent += len(batch)
+
+    # Упавший воркер поднимается заново; апдейты, которые он успел
+    # получить, но не обработал, потеряны — как при падении одиночного бота.
+    async def _watch(self, exited):
+        code = await exited
+        if self._closing:
+            return
+        print(f"Воркер {self.index} завершился с кодом {code}, перезапуск")
+        self._closing = True
+        self._ready.set()
+        self._writer.close()
+        with suppress(ConnectionError):
+            await self._sender
+        self.restarts += 1
+        await self._spawn()
+
+    def put(self, data):
+        if len(self.queue) >= self.max_pending:
+            return False
+        self.queue.append(data)
+        self._ready.set()
+        return True
+
+    async def put_wait(self, data):
+        while len(self.queue) >= self.max_pending:
+            self._space.clear()
+            await self._space.wait()
+        self.put(data)
+
+    # flush=True — сначала отдать воркеру всю очередь (выключение),
+    # иначе остаток очереди ждёт следующего воркера (перезапуск). В обоих
+    # случаях воркер дорабатывает всё, что уже получил.
+    async def stop(self, flush=True):
+        while flush and self.queue and not self._exit.done():
+            self._space.clear()
+            await self._space.wait()
+        self._closing = True
+        self._ready.set()
+        with suppress(ConnectionError):
+            await self._sender
+        self._writer.close()
+        with suppress(ConnectionError):
+            await self._writer.wait_closed()
+        await self._exit
+        await self._watcher
+
+    async def restart(self):
+        await self.stop(flush=False)
+        self.restarts += 1
+        await self._spawn()
+
+
+# ---------- Пул воркеров ----------
+class WorkerPool:
+    def __init__(self, token, count=WORKERS, max_pending=WORKER_MAX_PENDING, builder_factory=None):
+        self.directory = tempfile.mkdtemp(prefix="finbot-workers-")
+        self.links = [
+            WorkerLink(i, os.path.join(self.directory, f"{i}.sock"), token, max_pending, builder_factory)
+            for i in range(count)
+        ]
+        self._restarting = None
+
+    async def start(self):
+        await asyncio.gather(*(link.start() for link in self.links))
+
+    def link_for(self, data):
+        return self.links[worker_index(data, len(self.links))]
+
+    # Для вебхука: False — очередь воркера полна, пусть Telegram повторит.
+    def route(self, data, body):
+        return self.link_for(data).put(frame(body))
+
+    async def route_wait(self, data, body):
+        await self.link_for(data).put_wait(frame(body))
+
+    def pending(self):
+        return sum(len(link.queue) for link in self.links)
+
+    # Перезапуск по одному воркеру: остальные чаты обслуживаются как
+    # обычно, а апдейты чатов перезапускаемого копятся в его очереди.
+    async def restart(self):
+        for link in self.links:
+            await link.restart()
+
+    def restart_in_background(self):
+        if self._restarting is None or self._restarting.done():
+            self._restarting = asyncio.create_task(self.restart())
+
+    async def stop(self):
+        if self._restarting is not None:
+            await self._restarting
+        await asyncio.gather(*(link.stop() for link in self.links))
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+# Приёмник вебхуков пула: тело запроса не разбирается в Update, а сразу
+# уходит воркеру своего чата.
+class RouterWebhookServer(WebhookServer):
+    def __init__(self, pool, **options):
+        super().__init__(None, **options)
+        self.pool = pool
+
+    def _deliver(self, body):
+        try:
+            data = json.loads(body)
+            if not isinstance(data, dict):
+                return 400
+            routed = self.pool.route(data, body)
+        except (ValueError, TypeError, KeyError):
+            return 400
+        if not routed:
+            self.rejected += 1
+            return 503
+        self.accepted += 1
+        return 200
+
+
+# ---------- Запуск ----------
+# Один приёмник (getUpdates или вебхук) и count воркеров. SIGINT/SIGTERM —
+# перестать принимать, доработать очереди и выйти; SIGHUP — перезапустить
+# воркеры по одному, например после обновления кода.
+def run(mode, token, count=WORKERS, url=WEBHOOK_URL, **server_options):
+    if mode == "webhook":
+        if not url:
+            raise SystemExit("Для FINBOT_MODE=webhook нужен FINBOT_WEBHOOK_URL")
+        require_secret(server_options)
+    # миграции один раз до воркеров; свои соединения приёмнику не нужны
+    storage.init_db()
+    storage.close_all()
+    asyncio.run(_serve(mode, token, count, url, server_options))
+
+
+async def _serve(mode, token, count, url, server_options):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    pool = WorkerPool(token, count)
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    loop.add_signal_handler(signal.SIGHUP, pool.restart_in_background)
+
+    await pool.start()
+    print(f"Бот запущен: {count} воркеров.")
+    async with Bot(token) as bot:
+        if mode == "webhook":
+            server = RouterWebhookServer(pool, **server_options)
+            await server.start()
+            try:
+                await bot.set_webhook(
+                    url=url,
+                    secret_token=server.secret.decode(),
+                    allowed_updates=Update.ALL_TYPES,
+                    max_connections=100,
+                )
+                await stop.wait()
+            finally:
+                await server.stop()
+                await pool.stop()
+        else:
+            await bot.delete_webhook()
+            offset = [None]
+            polling = asyncio.create_task(_poll(bot, pool, offset))
+            try:
+                await stop.wait()
+            finally:
+                polling.cancel()
+                with suppress(asyncio.CancelledError):
+                    await polling
+                await pool.stop()
+                # подтверждаем Telegram всё, что уже отдано воркерам
+                if offset[0] is not None:
+                    await bot.get_updates(offset=offset[0], timeout=0)
+
+
+async def _poll(bot, pool, offset):
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset[0], timeout=POLL_TIMEOUT,
+                                            allowed_updates=Update.ALL_TYPES)
+        except TelegramError as e:
+            print(f"getUpdates: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            data = update.to_dict()
+            await pool.route_wait(data, json.dumps(data).encode())
+            offset[0] = update.update_id + 1